@@ -1,4 +1,11 @@
 from little_boxes import activitypub as ap
+from little_boxes.errors import (
+    ActivityGoneError,
+    ActivityNotFoundError,
+    ActivityUnavailableError,
+    NotAnActivityError,
+    RemoteServerUnavailableError,
+)
 from flask import current_app
 import requests
 from models import (
@@ -6,14 +13,16 @@ from models import (
     Activity,
     create_remote_actor,
     Actor,
+    Sound,
     update_remote_actor,
     update_remote_track,
     delete_remote_track,
 )
 from urllib.parse import urlparse
-from .vars import Box
+from .vars import Box, HEADERS
 from version import VERSION
 from utils.various import strip_end
+from utils import home_timeline, http_client
 
 
 class Reel2BitsBackend(ap.Backend):
@@ -177,6 +186,7 @@ class Reel2BitsBackend(ap.Backend):
         act.payload = activity.to_dict()
         act.url = activity.id
         act.type = activity.type
+        act.set_payload_meta()
         act.box = box.value
 
         # Activity is local only if the url starts like BASE_URL
@@ -241,7 +251,32 @@ class Reel2BitsBackend(ap.Backend):
                 return activity.payload
 
         current_app.logger.debug("fetch_iri: cannot find locally, fetching remote")
-        return super().fetch_iri(iri)
+        return self._fetch_remote_iri(iri)
+
+    def _fetch_remote_iri(self, iri: str) -> ap.ObjectType:
+        """
+        Same as little_boxes Backend.fetch_iri(), through the pooled HTTP client
+        """
+        self.check_url(iri)
+        try:
+            resp = http_client.get(
+                iri, headers={"User-Agent": self.user_agent(), "Accept": HEADERS[0]}, allow_redirects=False
+            )
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            raise RemoteServerUnavailableError(f"failed to fetch {iri}")
+
+        if resp.status_code == 404:
+            raise ActivityNotFoundError(f"{iri} is not found")
+        elif resp.status_code == 410:
+            raise ActivityGoneError(f"{iri} is gone")
+        elif resp.status_code in [500, 502, 503]:
+            raise ActivityUnavailableError(f"unable to fetch {iri}, server error ({resp.status_code})")
+        resp.raise_for_status()
+
+        try:
+            return resp.json()
+        except ValueError:
+            raise NotAnActivityError(f"{iri} is not JSON")
 
     def fetch_iri(self, iri: str) -> ap.ObjectType:
         current_app.logger.debug(f"asked to fetch {iri}")
@@ -262,6 +297,10 @@ class Reel2BitsBackend(ap.Backend):
                 return
 
             sound_id = create_sound_for_remote_track(act)
+            if not sound_id:
+                # no usable file in the Audio
+                return
+            home_timeline.fanout(Sound.query.get(sound_id))
             # TODO(dashie): fetch_remote_track should be done inside the upload_workflow to not have to do celery tasks dependencies
             # Plus it's better to do it like that, one function to do everything, locally or remotely.
             upload_workflow.delay(sound_id)
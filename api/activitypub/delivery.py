@@ -0,0 +1,248 @@
+# Recipients of the outgoing activities, resolved to the inboxes to post to
+# Followers collections of the local actors are expanded from the database, and each remote actor
+# is delivered through its instance shared inbox when it advertises one, so an instance
+# with many followers of the same local actor receives each activity only once.
+# With DELIVERY_WORKER the posts are queued in database for delivery_worker.py instead of a Celery task each.
+import collections
+import datetime
+import json
+
+from flask import current_app
+from little_boxes import activitypub as ap
+from little_boxes.key import Key
+from little_boxes.linked_data_sig import generate_signature
+from sqlalchemy import and_, exists, select
+
+from models import db, Actor, Follower, Delivery, DeliveryPayload
+from utils.metrics import federation_fanout_recipients, federation_fanout_inboxes
+
+ADDRESSING_FIELDS = ["to", "cc", "bto", "bcc"]
+
+# seconds before the retries of a failed delivery: 1 minute, 4 minutes, 16 minutes...
+RETRY_DELAY = 60
+RETRY_FACTOR = 4
+# client errors worth a retry, the other ones won't get better
+RETRY_STATUSES = (408, 429)
+
+# outcome of a post, status is None if the inbox was unreachable
+DeliveryResult = collections.namedtuple("DeliveryResult", ["id", "payload_id", "attempts", "status", "error"])
+
+
+def addresses(activity):
+    """
+    Addresses of an activity, deduplicated across to/cc/bto/bcc, in order
+    """
+    data = activity.to_dict() if isinstance(activity, ap.BaseActivity) else activity
+    seen = []
+    for field in ADDRESSING_FIELDS:
+        value = data.get(field) or []
+        for address in value if isinstance(value, list) else [value]:
+            if isinstance(address, dict):
+                address = address.get("id")
+            if address and address not in seen:
+                seen.append(address)
+    return seen
+
+
+def actor_inbox(inbox_url, shared_inbox_url):
+    return shared_inbox_url or inbox_url
+
+
+def local_followers_inboxes(actor_id):
+    """
+    Inboxes of the followers of a local actor, from the database
+    :return: a list of (actor url, inbox)
+    """
+    q = (
+        db.session.query(Actor.url, Actor.inbox_url, Actor.shared_inbox_url)
+        .join(Follower, Follower.actor_id == Actor.id)
+        .filter(Follower.target_id == actor_id)
+    )
+    return [(url, actor_inbox(inbox_url, shared_inbox_url)) for url, inbox_url, shared_inbox_url in q]
+
+
+def remote_inbox(address):
+    """
+    Inbox of an actor unknown in database, fetched
+    """
+    try:
+        obj = ap.get_backend().fetch_iri(address)
+    except Exception as e:
+        current_app.logger.warning(f"cannot resolve recipient {address}: {e}")
+        return None
+    if not isinstance(obj, dict) or not obj.get("inbox"):
+        # a remote collection, the local activities only address the local followers
+        current_app.logger.warning(f"recipient {address} is not an actor, skipped")
+        return None
+    return actor_inbox(obj["inbox"], (obj.get("endpoints") or {}).get("sharedInbox"))
+
+
+def resolve_inboxes(activity, sender_url):
+    """
+    Inboxes to deliver an activity to, one per shared inbox or per actor without one
+    :param sender_url: the actor posting it, never a recipient
+    :return: the inboxes, deduplicated
+    """
+    base_url = current_app.config["BASE_URL"]
+    recipients = set()
+    inboxes = []
+
+    def add(actor_url, inbox):
+        if actor_url == sender_url or actor_url in recipients:
+            return
+        recipients.add(actor_url)
+        if inbox and inbox not in inboxes:
+            inboxes.append(inbox)
+
+    for address in addresses(activity):
+        if address in (ap.AS_PUBLIC, sender_url):
+            continue
+
+        if address.startswith(base_url):
+            followed = Actor.query.filter(Actor.followers_url == address).first()
+            if followed:
+                for actor_url, inbox in local_followers_inboxes(followed.id):
+                    add(actor_url, inbox)
+                continue
+
+        actor = Actor.query.filter(Actor.url == address).first()
+        if actor:
+            add(actor.url, actor_inbox(actor.inbox_url, actor.shared_inbox_url))
+        else:
+            add(address, remote_inbox(address))
+
+    federation_fanout_recipients.inc(len(recipients))
+    federation_fanout_inboxes.inc(len(inboxes))
+    current_app.logger.info(f"{len(recipients)} recipients delivered through {len(inboxes)} inboxes")
+    return inboxes
+
+
+def queue_deliveries(activity, inboxes):
+    """
+    Queue the posts of an activity for the delivery worker,
+    its body gets the linked data signature once for all the inboxes
+    :param activity: the activity dict, from a local actor
+    :return: the number of deliveries queued
+    """
+    if not inboxes:
+        return 0
+    actor = Actor.query.filter(Actor.url == activity["actor"]).first()
+    if not actor or not actor.private_key:
+        current_app.logger.error(f"no local actor {activity['actor']}, activity not delivered")
+        return 0
+
+    # Don't overwrite the signature if we're forwarding an activity
+    if "signature" not in activity:
+        key = Key(owner=actor.url)
+        key.load(actor.private_key)
+        generate_signature(activity, key)
+
+    payload = DeliveryPayload(actor_id=actor.id, body=json.dumps(activity))
+    db.session.add(payload)
+    db.session.flush()
+    db.session.bulk_insert_mappings(Delivery, [{"payload_id": payload.id, "inbox": inbox} for inbox in inboxes])
+    db.session.commit()
+    return len(inboxes)
+
+
+def claim_deliveries(limit, lease, known_payloads=()):
+    """
+    Take the pending deliveries due, skipping the ones locked by another worker.
+    They are pushed back by lease seconds while being posted, and counted as attempted
+    so a worker dying while posting cannot retry them forever.
+    :param known_payloads: ids of the payloads the caller already has
+    :return: the deliveries as (id, payload_id, inbox, attempts)
+        and the other payloads as {id: (body, actor url, actor private key)}
+    """
+    now = datetime.datetime.utcnow()
+    table = Delivery.__table__
+    due = (
+        select([table.c.id])
+        .where(and_(table.c.state == Delivery.STATE_PENDING, table.c.next_attempt <= now))
+        .order_by(table.c.next_attempt)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = db.session.execute(
+        table.update()
+        .where(table.c.id.in_(due))
+        .values(next_attempt=now + datetime.timedelta(seconds=lease), attempts=table.c.attempts + 1)
+        .returning(table.c.id, table.c.payload_id, table.c.inbox, table.c.attempts)
+    ).fetchall()
+    db.session.commit()
+
+    deliveries = [(id, payload_id, str(inbox), attempts) for id, payload_id, inbox, attempts in claimed]
+    missing = {d[1] for d in deliveries} - set(known_payloads)
+    payloads = {}
+    if missing:
+        q = (
+            db.session.query(DeliveryPayload.id, DeliveryPayload.body, Actor.url, Actor.private_key)
+            .join(Actor, Actor.id == DeliveryPayload.actor_id)
+            .filter(DeliveryPayload.id.in_(missing))
+        )
+        payloads = {id: (body, url, private_key) for id, body, url, private_key in q}
+    return deliveries, payloads
+
+
+def delivered(status):
+    # like requests raise_for_status()
+    return status is not None and status < 400
+
+
+def retry_delay(status, attempts, max_attempts):
+    """
+    :param status: HTTP status of the failed post, None if the inbox was unreachable
+    :param attempts: posts made, the failed one included
+    :return: seconds to wait before posting again, None if given up
+    """
+    if status is not None and status < 500 and status not in RETRY_STATUSES:
+        return None
+    if attempts >= max_attempts:
+        return None
+    return RETRY_DELAY * RETRY_FACTOR ** (attempts - 1)
+
+
+def report_deliveries(results, max_attempts):
+    """
+    Write back the outcomes of the posts in bulk: the delivered ones are deleted with their payload
+    once it has been delivered everywhere, the failed ones are retried later or kept as given up
+    :param results: DeliveryResult list
+    """
+    now = datetime.datetime.utcnow()
+    done = [r for r in results if delivered(r.status)]
+    failed = []
+    for result in results:
+        if delivered(result.status):
+            continue
+        update = {"id": result.id, "last_status": result.status, "last_error": (result.error or "")[:255] or None}
+        delay = retry_delay(result.status, result.attempts, max_attempts)
+        if delay is None:
+            update["state"] = Delivery.STATE_FAILED
+        else:
+            update["next_attempt"] = now + datetime.timedelta(seconds=delay)
+        failed.append(update)
+
+    if done:
+        Delivery.query.filter(Delivery.id.in_([r.id for r in done])).delete(synchronize_session=False)
+        DeliveryPayload.query.filter(
+            DeliveryPayload.id.in_({r.payload_id for r in done}),
+            ~exists().where(Delivery.payload_id == DeliveryPayload.id),
+        ).delete(synchronize_session=False)
+    if failed:
+        db.session.bulk_update_mappings(Delivery, failed)
+    db.session.commit()
+
+
+def purge_failed_deliveries(before):
+    """
+    Delete the given up deliveries created before a date, and the payloads left without deliveries
+    :return: the number of deliveries deleted
+    """
+    count = Delivery.query.filter(Delivery.state == Delivery.STATE_FAILED, Delivery.creation_date < before).delete(
+        synchronize_session=False
+    )
+    DeliveryPayload.query.filter(
+        DeliveryPayload.creation_date < before, ~exists().where(Delivery.payload_id == DeliveryPayload.id)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return count
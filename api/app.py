@@ -23,9 +23,7 @@ import commands
 from utils.flake_id import FlakeId
 import html
 from utils.meta_tags import get_default_head_tags, get_request_head_tags
-from sqlalchemy import event
-from sqlalchemy.engine import Engine
-import time
+from utils import metrics
 
 from models import db, Config, user_datastore, create_actor
 from utils.various import InvalidUsage, is_admin, add_user_log, join_url
@@ -136,9 +134,6 @@ def create_app(config_filename="config.development.Config", app_name=None, regis
         file_handler.setFormatter(formatter)
         app.logger.addHandler(file_handler)
 
-    dbLogger = logging.getLogger("reel2bits.sqltime")
-    dbLogger.setLevel(logging.DEBUG)
-
     CORS(app, origins=["*"])
 
     if app.debug:
@@ -264,20 +259,8 @@ def create_app(config_filename="config.development.Config", app_name=None, regis
         response.status_code = error.status_code
         return response
 
-    @event.listens_for(Engine, "before_cursor_execute")
-    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-        if not False:
-            return
-        conn.info.setdefault("query_start_time", []).append(time.time())
-        dbLogger.debug("Start Query: %s", statement)
-
-    @event.listens_for(Engine, "after_cursor_execute")
-    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-        if not False:
-            return
-        total = time.time() - conn.info["query_start_time"].pop(-1)
-        dbLogger.debug("Query Complete!")
-        dbLogger.debug("Total Time: %f", total)
+    # Requests timings and database queries, see utils.metrics
+    metrics.init_app(app)
 
     # Tracks files upload set
     sounds = UploadSet("sounds", AUDIO)
@@ -1,4 +1,6 @@
 from authlib.integrations.flask_oauth2 import AuthorizationServer, ResourceProtector
+from authlib.integrations.flask_oauth2.signals import token_authenticated
+from authlib.oauth2.rfc6749 import HttpRequest
 from authlib.integrations.sqla_oauth2 import (
     create_query_client_func,
     create_save_token_func,
@@ -9,7 +11,8 @@ from authlib.oauth2.rfc6749 import grants
 from werkzeug.security import gen_salt
 from models import db, User
 from models import OAuth2Client, OAuth2AuthorizationCode, OAuth2Token
-from flask import current_app
+from flask import current_app, _app_ctx_stack
+from flask import request as flask_request
 
 
 class AuthorizationCodeGrant(grants.AuthorizationCodeGrant):
@@ -77,7 +80,25 @@ class ClientCredentialsGrant(grants.ClientCredentialsGrant):
 query_client = create_query_client_func(db.session, OAuth2Client)
 save_token = create_save_token_func(db.session, OAuth2Token)
 authorization = AuthorizationServer(query_client=query_client, save_token=save_token)
-require_oauth = ResourceProtector()
+
+
+class HeadersResourceProtector(ResourceProtector):
+    """
+    The bearer tokens are only read from the headers, the request body is left unread
+    so that it can be streamed, like the resumable uploads bytes, instead of being loaded in memory
+    """
+
+    def acquire_token(self, scope=None, operator="AND"):
+        oauth_request = HttpRequest(flask_request.method, flask_request.full_path, None, flask_request.headers)
+        if not callable(operator):
+            operator = operator.upper()
+        token = self.validate_request(scope, oauth_request, operator)
+        token_authenticated.send(self, token=token)
+        _app_ctx_stack.top.authlib_server_oauth2_token = token
+        return token
+
+
+require_oauth = HeadersResourceProtector()
 
 
 def config_oauth(app):
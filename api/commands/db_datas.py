@@ -1,8 +1,11 @@
 import click
-from models import db, Sound, User, Role, Config, Album
+from models import db, Sound, SoundInfo, User, Role, Config, Album, Activity
+from sqlalchemy import text as sa_text
+from little_boxes.activitypub import AS_PUBLIC
 from utils.flake_id import FlakeId
 from uuid import UUID
 from utils.defaults import Reel2bitsDefaults
+from utils.various import waveform_from_json, save_waveform_levels
 import os
 from flask.cli import with_appcontext
 from flask import current_app
@@ -163,3 +166,59 @@ def generate_users_uuid():
         if not user.flake_id:
             user.flake_id = UUID(int=flake_gen.get())
     db.session.commit()
+
+
+@db_datas.command(name="008-convert-waveforms")
+@with_appcontext
+def convert_waveforms():
+    """
+    Convert JSON waveforms to compact peaks (68_9a4e2c7b1d05)
+
+    BREAKING, waveforms are not displayed until converted.
+    """
+    q = SoundInfo.query.filter(SoundInfo.waveform.isnot(None), SoundInfo.waveform_peaks.is_(None))
+    for si in q.all():
+        try:
+            si.waveform_peaks = waveform_from_json(si.waveform)
+        except (ValueError, KeyError):
+            print(f"invalid waveform for sound {si.sound_id}, skipping")
+            continue
+        si.waveform = None
+    db.session.commit()
+
+
+@db_datas.command(name="009-generate-waveform-levels")
+@with_appcontext
+def generate_waveform_levels():
+    """
+    Generate the waveform levels pyramid from the peaks (69_3e8b5f0a6c12)
+
+    BREAKING, waveforms are not displayed until generated.
+    can be run again after changing WAVEFORM_OVERVIEW_POINTS.
+    """
+    for si in SoundInfo.query.filter(SoundInfo.waveform_peaks.isnot(None)).all():
+        save_waveform_levels(si.sound_id, si.waveform_peaks)
+        db.session.commit()
+
+
+@db_datas.command(name="010-extract-activities-meta")
+@with_appcontext
+def extract_activities_meta():
+    """
+    Fill the Activity object_type and is_public from the payloads (71_e5c09a3b7f21)
+
+    BREAKING, the timelines are empty until extracted.
+    done in batches of ids, in SQL, same as Activity.set_payload_meta().
+    """
+    batch = 10000
+    max_id = db.session.query(db.func.max(Activity.id)).scalar() or 0
+    for start in range(0, max_id + 1, batch):
+        db.session.execute(
+            sa_text(
+                "UPDATE activity SET object_type = payload->'object'->>'type', "
+                "is_public = coalesce(payload->'to' ? :public, false) "
+                "WHERE id >= :start AND id < :end"
+            ),
+            {"public": AS_PUBLIC, "start": start, "end": start + batch},
+        )
+        db.session.commit()
@@ -1,4 +1,5 @@
 import click
+import datetime
 import sys
 from flask.cli import with_appcontext
 from flask_mail import Message
@@ -6,6 +7,7 @@ from flask import render_template, current_app
 import texttable
 from pprint import pprint as pp
 from models import Config
+from activitypub.delivery import purge_failed_deliveries
 
 
 @click.group()
@@ -72,3 +74,14 @@ def routes():
         table.add_row([rule.endpoint, methods, rule])
 
     print(table.draw())
+
+
+@system.command(name="clean-deliveries")
+@click.option("--days", default=7, show_default=True, help="Age of the given up deliveries to delete")
+@with_appcontext
+def clean_deliveries(days):
+    """
+    Delete the deliveries given up by the delivery worker older than --days, and their payloads.
+    """
+    count = purge_failed_deliveries(datetime.datetime.utcnow() - datetime.timedelta(days=days))
+    print(f"Deleted {count} deliveries")
@@ -1,10 +1,12 @@
 import click
-from models import db, Sound
+from models import db, Sound, SoundUpload
 from flask.cli import with_appcontext
 from flask import current_app
 from os.path import splitext
-from utils.various import get_waveform, generate_audio_dat_file
+from utils.various import save_waveform_levels
+from transcoding_utils import process_audio
 import os
+import datetime
 
 
 @click.group()
@@ -41,9 +43,11 @@ def regenerate_waveform(slug, all):
         print(f"Processing waveform for {sound.id}, {sound.slug}")
 
         if sound.transcode_needed:
-            fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], sound.user.slug, sound.filename_transcoded)
+            fname = os.path.join(
+                current_app.config["UPLOADED_SOUNDS_DEST"], sound.uploads_dirname(), sound.filename_transcoded
+            )
         else:
-            fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], sound.user.slug, sound.filename)
+            fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], sound.uploads_dirname(), sound.filename)
 
         sound_infos = sound.sound_infos.first()
         if not sound_infos or not sound_infos.done_basic:
@@ -56,12 +60,9 @@ def regenerate_waveform(slug, all):
         else:
             fname_t = fname
 
-        dat_file_name = generate_audio_dat_file(fname_t, sound_infos.duration)
-
-        sound_infos.waveform = get_waveform(dat_file_name, sound_infos.duration)
-
-        # Delete the temporary dat file
-        os.unlink(dat_file_name)
+        stats = process_audio(fname_t, sound_infos.rate, sound_infos.duration)
+        sound_infos.waveform_peaks = stats["peaks"] if stats else None
+        save_waveform_levels(sound.id, sound_infos.waveform_peaks)
 
     db.session.commit()
 
@@ -85,3 +86,20 @@ def create_missing_activities():
 
             sound.activity_id = federate_new_sound(sound)
             db.session.commit()
+
+
+@tracks.command(name="clean-uploads")
+@click.option("--hours", default=24, show_default=True, help="Age of the resumable uploads to delete")
+@with_appcontext
+def clean_uploads(hours):
+    """
+    Delete the resumable uploads older than --hours, and the bytes received for the incomplete ones.
+    """
+    before = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    uploads = SoundUpload.query.filter(SoundUpload.created < before).all()
+    for upload in uploads:
+        if not upload.sound_id and os.path.isfile(upload.path()):
+            os.unlink(upload.path())
+        db.session.delete(upload)
+    db.session.commit()
+    print(f"Deleted {len(uploads)} uploads")
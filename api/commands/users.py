@@ -1,11 +1,13 @@
 import click
-from models import db, user_datastore, create_actor, Role, User
+from models import db, user_datastore, create_actor, Role, User, Actor, Follower, Sound, Album
+from sqlalchemy import func, select, and_
 from flask.cli import with_appcontext
 from flask import current_app
 from flask_security.utils import hash_password
 from flask_security import confirmable as FSConfirmable
 import texttable
 import datetime
+from utils import home_timeline
 
 
 @click.group()
@@ -157,3 +159,65 @@ def confirm(username):
     db.session.commit()
 
     print("User confirmed at: ", u.confirmed_at)
+
+
+@users.command(name="rebuild-counters")
+@with_appcontext
+def rebuild_counters():
+    """
+    Recompute users followers, following, tracks and albums counters.
+    """
+    user_table = User.__table__
+
+    def count_follows(column):
+        return (
+            select([func.count(Follower.id)])
+            .where(and_(column == Actor.id, Actor.user_id == user_table.c.id))
+            .as_scalar()
+        )
+
+    public_tracks = (
+        select([func.count(Sound.id)])
+        .where(
+            and_(
+                Sound.user_id == user_table.c.id,
+                Sound.private.is_(False),
+                Sound.transcode_state == Sound.TRANSCODE_DONE,
+            )
+        )
+        .as_scalar()
+    )
+    public_albums = (
+        select([func.count(Album.id)])
+        .where(and_(Album.user_id == user_table.c.id, Album.private.is_(False)))
+        .as_scalar()
+    )
+
+    result = db.session.execute(
+        user_table.update().values(
+            followers_count=count_follows(Follower.target_id),
+            following_count=count_follows(Follower.actor_id),
+            public_tracks_count=public_tracks,
+            public_albums_count=public_albums,
+        )
+    )
+    db.session.commit()
+
+    print(f"Counters rebuilt for {result.rowcount} users")
+
+
+@users.command(name="rebuild-home-timelines")
+@click.option("--username", default=None, help="Only rebuild the home timeline of this local user")
+@with_appcontext
+def rebuild_home_timelines(username):
+    """
+    Rebuild local users home timelines, after follows changes.
+    """
+    q = User.query.filter(User.local.is_(True))
+    if username:
+        q = q.filter(User.name == username)
+    users = q.all()
+    for user in users:
+        home_timeline.rebuild(user)
+
+    print(f"Home timelines rebuilt for {len(users)} users")
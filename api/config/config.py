@@ -117,8 +117,63 @@ class BaseConfig(object):
     # 134217728   1 gibabyte
     UPLOAD_TRACK_MAX_SIZE = os.getenv("UPLOAD_TRACK_MAX_SIZE", 67108864)
 
-    # Where is audiowaveform located
-    AUDIOWAVEFORM_BIN = os.getenv("AUDIOWAVEFORM_BIN", "/usr/local/bin/audiowaveform")
+    # Waveform points at full resolution, and in the overview level (lowest) of the pyramid
+    WAVEFORM_MAX_POINTS = os.getenv("WAVEFORM_MAX_POINTS", 16384)
+    WAVEFORM_OVERVIEW_POINTS = os.getenv("WAVEFORM_OVERVIEW_POINTS", 200)
+    # Cache-Control max-age of the waveform levels, in seconds
+    WAVEFORM_CACHE_MAX_AGE = os.getenv("WAVEFORM_CACHE_MAX_AGE", 2592000)
+
+    # Transcoding of the uploaded tracks to MP3, ffmpeg encoder settings
+    FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+    TRANSCODE_CODEC = os.getenv("TRANSCODE_CODEC", "libmp3lame")
+    TRANSCODE_BITRATE = os.getenv("TRANSCODE_BITRATE", "196k")
+
+    # Renditions ladder of the local tracks, encoded while processing, comma separated, empty to disable
+    # opus: low bitrate Ogg Opus, mp3: mid bitrate MP3, hls: segmented AAC with its HLS playlist
+    RENDITIONS = os.getenv("RENDITIONS", "opus,mp3,hls")
+    RENDITION_OPUS_BITRATE = os.getenv("RENDITION_OPUS_BITRATE", "64k")
+    RENDITION_MP3_BITRATE = os.getenv("RENDITION_MP3_BITRATE", "128k")
+    RENDITION_HLS_BITRATE = os.getenv("RENDITION_HLS_BITRATE", "128k")
+    # seconds
+    RENDITION_HLS_SEGMENT = os.getenv("RENDITION_HLS_SEGMENT", 6)
+
+    # Cache of the rendered tracks and albums JSON, in Redis if set, else in a per-process LRU
+    JSON_CACHE_REDIS_URL = os.getenv("JSON_CACHE_REDIS_URL", None)
+    JSON_CACHE_LOCAL_SIZE = os.getenv("JSON_CACHE_LOCAL_SIZE", 1024)
+    # seconds
+    JSON_CACHE_TTL = os.getenv("JSON_CACHE_TTL", 86400)
+
+    # Tracks kept in each user home timeline
+    HOME_TIMELINE_MAX_LENGTH = os.getenv("HOME_TIMELINE_MAX_LENGTH", 800)
+
+    # Streaming API events are published there, disabled if not set
+    STREAMING_REDIS_URL = os.getenv("STREAMING_REDIS_URL", None)
+
+    # HTTP client of the federation and the remote tracks fetches, seconds
+    HTTP_CONNECT_TIMEOUT = os.getenv("HTTP_CONNECT_TIMEOUT", 5)
+    # between two received bytes
+    HTTP_READ_TIMEOUT = os.getenv("HTTP_READ_TIMEOUT", 30)
+    # connections kept alive, per process: remote hosts and idle connections per host
+    HTTP_POOL_HOSTS = os.getenv("HTTP_POOL_HOSTS", 64)
+    HTTP_POOL_SIZE = os.getenv("HTTP_POOL_SIZE", 8)
+
+    # Outgoing activities queued in database and posted by delivery_worker.py, instead of a Celery task per inbox
+    DELIVERY_WORKER = bool_env("DELIVERY_WORKER", False)
+    # deliveries claimed at once, posts in flight per worker and per remote host, posts before giving up
+    DELIVERY_BATCH_SIZE = os.getenv("DELIVERY_BATCH_SIZE", 500)
+    DELIVERY_CONCURRENCY = os.getenv("DELIVERY_CONCURRENCY", 1000)
+    DELIVERY_PER_HOST = os.getenv("DELIVERY_PER_HOST", 8)
+    DELIVERY_MAX_ATTEMPTS = os.getenv("DELIVERY_MAX_ATTEMPTS", 4)
+
+    # Prometheus metrics, served by /metrics, with a bearer token if METRICS_TOKEN is set
+    METRICS_ENABLED = bool_env("METRICS_ENABLED", False)
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", None)
+    # Exporter of the Celery workers and delivery worker metrics, disabled if not set, one port per worker
+    METRICS_WORKER_PORT = os.getenv("METRICS_WORKER_PORT", None)
+
+    # Count the queries of each request, add a Server-Timing header and log the requests doing more than QUERY_BUDGET
+    QUERY_BUDGET_ENABLED = bool_env("QUERY_BUDGET_ENABLED", False)
+    QUERY_BUDGET = os.getenv("QUERY_BUDGET", 30)
 
     # If using sentry
     SENTRY_DSN = os.getenv("SENTRY_DSN", None)
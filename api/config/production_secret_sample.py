@@ -20,8 +20,8 @@ class Config(BaseConfig):
     UPLOADED_ARTWORKSOUNDS_DEST = "/Users/dashie/dev/reel2bits/uploads/artwork_sounds"
     UPLOADED_AVATARS_DEST = "/Users/dashie/dev/reel2bits/uploads/avatars"
 
-    # Where is the audiowaveform binary located
-    AUDIOWAVEFORM_BIN = "/usr/local/bin/audiowaveform"
+    # Where is the ffmpeg binary located
+    FFMPEG_BIN = "/usr/bin/ffmpeg"
 
     # If you are using Sentry, otherwise, set to None
     SENTRY_DSN = None
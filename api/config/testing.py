@@ -28,3 +28,5 @@ class Config(BaseConfig):
     SERVER_NAME = REEL2BITS_HOSTNAME
     REEL2BITS_PROTOCOL = "http"
     AP_ENABLED = True
+    METRICS_ENABLED = True
+    QUERY_BUDGET_ENABLED = True
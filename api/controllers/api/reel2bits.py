@@ -1,7 +1,7 @@
 from flask import Blueprint, jsonify, request, abort, current_app, render_template
 from models import db, User, PasswordResetToken, Sound, SoundTag, Actor, Follower, create_remote_actor, Config, Activity
 from utils.various import add_user_log, generate_random_token, add_log
-from datas_helpers import to_json_account, to_json_relationship, default_genres, to_json_track
+from datas_helpers import to_json_account, to_json_accounts, to_json_relationship, default_genres, to_json_track
 from app_oauth import require_oauth
 from authlib.integrations.flask_oauth2 import current_token
 from flask_security.utils import hash_password, verify_password
@@ -337,11 +337,7 @@ def search():
 
     # Handle the found users
     if len(users) > 0:
-        for actor in users:
-            relationship = False
-            if current_user:
-                relationship = to_json_relationship(current_user, actor.user)
-            accounts.append(to_json_account(actor.user, relationship))
+        accounts = to_json_accounts([actor.user for actor in users], current_user)
 
     if len(accounts) <= 0:
         # Do a webfinger
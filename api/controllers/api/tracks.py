@@ -1,17 +1,21 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, make_response, url_for
 from app_oauth import require_oauth
 from authlib.integrations.flask_oauth2 import current_token
-from forms import SoundUploadForm
-from models import db, Sound, User, Album, UserLogging, SoundTag
+from forms import SoundUploadForm, SoundMetadatasForm
+from models import db, Sound, User, Album, UserLogging, SoundTag, SoundWaveform, SoundUpload
 import json
-from utils.various import add_user_log, get_hashed_filename
+from utils.various import add_user_log, get_hashed_filename, waveform_to_json
 from flask_uploads import UploadSet, AUDIO
 from datas_helpers import to_json_track, to_json_account, to_json_relationship
 from os.path import splitext
 import os
+import fcntl
+import functools
+import uuid
 from sqlalchemy import and_
 from utils.defaults import Reel2bitsDefaults
 from tasks import send_update_sound
+from utils import blobs, uploads
 import sqlalchemy.exc
 
 
@@ -21,6 +25,92 @@ sounds = UploadSet("sounds", AUDIO)
 artworksounds = UploadSet("artworksounds", Reel2bitsDefaults.artwork_extensions_allowed)
 
 
+def track_metadatas(form):
+    """
+    Track fields of a validated SoundMetadatasForm, JSON serializable to be kept by a SoundUpload
+    """
+    return {
+        "title": form.title.data,
+        "description": form.description.data,
+        "album_id": (form.album.data.id if form.album.data else None),
+        "licence": form.licence.data,
+        "private": form.private.data,
+        "genre": form.genre.data,
+        "tags": [t.strip() for t in form.tags.data.split(",") if t],
+    }
+
+
+def create_track(
+    user, path, filename_orig, transcode_needed, metadatas, artwork_filename=None, sha256=None, upload=None
+):
+    """
+    Create the track of an uploaded file and push its processing in queue
+    :param path: the uploaded file, moved to the blobs store, or dropped if the same audio is already there
+    :param metadatas: see track_metadatas()
+    :param sha256: the hash of the file, if already known
+    :param upload: the SoundUpload of the file, if resumable, marked complete with the track
+    """
+    file_size = os.path.getsize(path)
+    blob = blobs.store(path, sha256=sha256)
+
+    rec = Sound()
+    rec.blob_id = blob.id
+    rec.filename = blob.filename
+    rec.filename_orig = filename_orig
+    rec.artwork_filename = artwork_filename
+
+    rec.licence = metadatas["licence"]
+    album = Album.query.get(metadatas["album_id"]) if metadatas["album_id"] else None
+    if album:
+        rec.album_id = album.id
+        if not album.sounds:
+            rec.album_order = 0
+        else:
+            rec.album_order = album.sounds.count() + 1
+
+    rec.user_id = user.id
+    if not metadatas["title"]:
+        rec.title, _ = splitext(filename_orig)
+    else:
+        rec.title = metadatas["title"]
+    rec.description = metadatas["description"]
+    rec.private = metadatas["private"]
+    rec.file_size = file_size
+    rec.transcode_file_size = 0  # will be filled, if needed in transcoding workflow
+    rec.genre = metadatas["genre"]
+
+    # For each tag get it or create it
+    for tag in metadatas["tags"]:
+        dbt = SoundTag.query.filter(SoundTag.name == tag).first()
+        if not dbt:
+            dbt = SoundTag(name=tag)
+            db.session.add(dbt)
+        rec.tags.append(dbt)
+
+    if transcode_needed:
+        rec.transcode_state = Sound.TRANSCODE_WAITING
+        rec.transcode_needed = True
+
+    db.session.add(rec)
+    if upload:
+        upload.sound = rec
+
+    # recompute user quota
+    user.quota_count = user.quota_count + rec.file_size
+
+    db.session.commit()
+
+    # push the job in queue
+    from tasks import upload_workflow
+
+    upload_workflow.delay(rec.id)
+
+    # log
+    add_user_log(rec.id, user.id, "sounds", "info", "Uploaded {0} -- {1}".format(rec.id, rec.title))
+
+    return rec
+
+
 @bp_api_tracks.route("/api/tracks", methods=["POST"])
 @require_oauth("write")
 def upload():
@@ -82,69 +172,264 @@ def upload():
         # Save the track file
         sounds.save(file_uploaded, folder=current_user.slug, name=filename_hashed)
 
-        rec = Sound()
-        rec.filename = filename_hashed
-        rec.filename_orig = filename_orig
-
         # Save the artwork
+        artwork_filename = None
         if artwork_uploaded:
             artwork_filename = get_hashed_filename(artwork_uploaded.filename)
             artworksounds.save(artwork_uploaded, folder=current_user.slug, name=artwork_filename)
-            rec.artwork_filename = artwork_filename
 
-        rec.licence = form.licence.data
-        if form.album.data:
-            rec.album_id = form.album.data.id
-            if not form.album.data.sounds:
-                rec.album_order = 0
-            else:
-                rec.album_order = form.album.data.sounds.count() + 1
+        mimetype = file_uploaded.mimetype
+        rec = create_track(
+            current_user,
+            os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], current_user.slug, filename_hashed),
+            filename_orig,
+            "flac" in mimetype or "ogg" in mimetype or "wav" in mimetype,
+            track_metadatas(form),
+            artwork_filename=artwork_filename,
+        )
 
-        rec.user_id = current_user.id
-        if not form.title.data:
-            rec.title, _ = splitext(filename_orig)
-        else:
-            rec.title = form.title.data
-        rec.description = form.description.data
-        rec.private = form.private.data
-        rec.file_size = file_size
-        rec.transcode_file_size = 0  # will be filled, if needed in transcoding workflow
-        rec.genre = form.genre.data
-
-        # Handle tags
-        tags = form.tags.data.split(",")
-        # Clean
-        tags = [t.strip() for t in tags if t]
-        # For each tag get it or create it
-        for tag in tags:
-            dbt = SoundTag.query.filter(SoundTag.name == tag).first()
-            if not dbt:
-                dbt = SoundTag(name=tag)
-                db.session.add(dbt)
-            rec.tags.append(dbt)
+        return jsonify({"id": rec.flake_id, "slug": rec.slug})
 
-        if "flac" in file_uploaded.mimetype or "ogg" in file_uploaded.mimetype or "wav" in file_uploaded.mimetype:
-            rec.transcode_state = Sound.TRANSCODE_WAITING
-            rec.transcode_needed = True
+    return jsonify({"error": json.dumps(form.errors)}), 400
 
-        db.session.add(rec)
 
-        # recompute user quota
-        current_user.quota_count = current_user.quota_count + rec.file_size
+def tus_response(body="", status=204, headers=None):
+    resp = make_response(body, status)
+    resp.headers["Tus-Resumable"] = uploads.TUS_VERSION
+    resp.headers["Cache-Control"] = "no-store"
+    for name, value in (headers or {}).items():
+        resp.headers[name] = str(value)
+    return resp
 
-        db.session.commit()
 
-        # push the job in queue
-        from tasks import upload_workflow
+def get_upload(upload_id, user):
+    try:
+        upload_id = uuid.UUID(upload_id)
+    except ValueError:
+        return None
+    return SoundUpload.query.filter(SoundUpload.upload_id == upload_id, SoundUpload.user_id == user.id).first()
 
-        upload_workflow.delay(rec.id)
 
-        # log
-        add_user_log(rec.id, current_user.id, "sounds", "info", "Uploaded {0} -- {1}".format(rec.id, rec.title))
+def upload_offset_of(upload):
+    if upload.sound_id:
+        return upload.length
+    path = upload.path()
+    return os.path.getsize(path) if os.path.isfile(path) else 0
 
-        return jsonify({"id": rec.flake_id, "slug": rec.slug})
 
-    return jsonify({"error": json.dumps(form.errors)}), 400
+def upload_done(upload):
+    return tus_response(
+        jsonify({"id": upload.sound.flake_id, "slug": upload.sound.slug}), 200, {"Upload-Offset": upload.length}
+    )
+
+
+@bp_api_tracks.route("/api/tracks/uploads", methods=["POST"])
+@require_oauth("write")
+def upload_create():
+    """
+    Create a resumable upload of a track (tus protocol, creation extension).
+    The bytes are then sent by PATCH, the track is created and processed when the last one lands.
+    ---
+    tags:
+        - Tracks
+    security:
+        - OAuth2:
+            - write
+    parameters:
+        - name: Upload-Length
+          in: header
+          type: integer
+          required: true
+          description: Size of the file in bytes
+        - name: Upload-Metadata
+          in: header
+          type: string
+          required: false
+          description: filename and the /api/tracks fields, in tus format, or sent as form data
+    responses:
+        201:
+            description: Returns the upload id, the Location header is the upload URL.
+    """
+    current_user = current_token.user
+    if not current_user:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    try:
+        length = int(request.headers["Upload-Length"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Upload-Length header missing or invalid"}), 400
+    if length <= 0 or length > int(current_app.config["UPLOAD_TRACK_MAX_SIZE"]):
+        return jsonify({"error": "file empty or too big"}), 413  # Request Entity Too Large
+
+    if (current_user.quota_count + length) > current_user.quota:
+        return jsonify({"error": "quota limit reached"}), 507  # Insufficient storage
+
+    metadata = request.headers.get("Upload-Metadata")
+    try:
+        formdata = uploads.parse_metadata(metadata) if metadata else request.form
+    except ValueError:
+        return jsonify({"error": "Upload-Metadata header invalid"}), 400
+
+    filename_orig = formdata.get("filename")
+    _, ext = splitext(filename_orig or "")
+    if not sounds.extension_allowed(ext[1:].lower()):
+        return jsonify({"error": {"file": "filename missing or not an audio file"}}), 400
+
+    form = SoundMetadatasForm(formdata=formdata)
+    if not form.validate_on_submit():
+        return jsonify({"error": json.dumps(form.errors)}), 400
+
+    upload = SoundUpload(
+        user=current_user,
+        filename=get_hashed_filename(f"upload{ext.lower()}"),
+        filename_orig=filename_orig,
+        length=length,
+        metadatas=track_metadatas(form),
+    )
+    os.makedirs(os.path.dirname(upload.path()), exist_ok=True)
+    open(upload.path(), "wb").close()
+    db.session.add(upload)
+    db.session.commit()
+
+    location = url_for("bp_api_tracks.upload_patch", upload_id=upload.upload_id, _external=True)
+    return tus_response(jsonify({"upload_id": upload.upload_id}), 201, {"Location": location, "Upload-Offset": 0})
+
+
+@bp_api_tracks.route("/api/tracks/uploads/<string:upload_id>", methods=["HEAD"])
+@require_oauth("write")
+def upload_head(upload_id):
+    """
+    Offset of a resumable upload, where to resume it.
+    ---
+    tags:
+        - Tracks
+    security:
+        - OAuth2:
+            - write
+    responses:
+        200:
+            description: The Upload-Offset and Upload-Length headers.
+    """
+    upload = get_upload(upload_id, current_token.user)
+    if not upload:
+        return tus_response(status=404)
+    return tus_response(status=200, headers={"Upload-Offset": upload_offset_of(upload), "Upload-Length": upload.length})
+
+
+@bp_api_tracks.route("/api/tracks/uploads/<string:upload_id>", methods=["PATCH"])
+@require_oauth("write")
+def upload_patch(upload_id):
+    """
+    Send the next bytes of a resumable upload, as application/offset+octet-stream.
+    Upload-Offset must be the current offset, bytes received before an interruption are kept.
+    ---
+    tags:
+        - Tracks
+    security:
+        - OAuth2:
+            - write
+    parameters:
+        - name: Upload-Offset
+          in: header
+          type: integer
+          required: true
+          description: Offset of the bytes sent, see HEAD
+    responses:
+        204:
+            description: Bytes received, the new offset is in the Upload-Offset header.
+        200:
+            description: Upload complete, returns the track id and slug.
+        409:
+            description: Upload-Offset isn't the current offset.
+    """
+    current_user = current_token.user
+    upload = get_upload(upload_id, current_user)
+    if not upload:
+        return jsonify({"error": "not found"}), 404
+    if request.mimetype != "application/offset+octet-stream":
+        return jsonify({"error": "Content-Type must be application/offset+octet-stream"}), 415
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Upload-Offset header missing or invalid"}), 400
+
+    if upload.sound_id:
+        # complete, the response of the last bytes was lost
+        return upload_done(upload)
+
+    path = upload.path()
+    with open(path, "ab") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return jsonify({"error": "upload already receiving bytes"}), 423  # Locked
+
+        current = f.tell()
+        if offset != current:
+            return tus_response(jsonify({"error": "wrong Upload-Offset"}), 409, {"Upload-Offset": current})
+
+        hasher = uploads.resume_hasher(upload.upload_id, path, current)
+        error = None
+        try:
+            for chunk in iter(functools.partial(request.stream.read, uploads.CHUNK_SIZE), b""):
+                if current + len(chunk) > upload.length:
+                    error = jsonify({"error": "more bytes than Upload-Length"}), 413
+                    break
+                if (current_user.quota_count + current + len(chunk)) > current_user.quota:
+                    error = jsonify({"error": "quota limit reached"}), 507
+                    break
+                f.write(chunk)
+                hasher.update(chunk)
+                current += len(chunk)
+        finally:
+            # also when the client goes away, what was received is kept
+            f.flush()
+            uploads.keep_hasher(upload.upload_id, current, hasher)
+
+        if error:
+            return error
+        if current < upload.length:
+            return tus_response(status=204, headers={"Upload-Offset": current})
+
+        uploads.forget_hasher(upload.upload_id)
+        _, ext = splitext(upload.filename)
+        create_track(
+            current_user,
+            path,
+            upload.filename_orig,
+            ext[1:] in uploads.TRANSCODED_EXTENSIONS,
+            upload.metadatas,
+            sha256=hasher.hexdigest(),
+            upload=upload,
+        )
+
+    return upload_done(upload)
+
+
+@bp_api_tracks.route("/api/tracks/uploads/<string:upload_id>", methods=["DELETE"])
+@require_oauth("write")
+def upload_delete(upload_id):
+    """
+    Cancel a resumable upload (tus protocol, termination extension).
+    ---
+    tags:
+        - Tracks
+    security:
+        - OAuth2:
+            - write
+    responses:
+        204:
+            description: Upload deleted.
+    """
+    upload = get_upload(upload_id, current_token.user)
+    if not upload:
+        return jsonify({"error": "not found"}), 404
+    if not upload.sound_id and os.path.isfile(upload.path()):
+        os.unlink(upload.path())
+    uploads.forget_hasher(upload.upload_id)
+    db.session.delete(upload)
+    db.session.commit()
+    return tus_response(status=204)
 
 
 @bp_api_tracks.route("/api/tracks/<string:username_or_id>/<string:soundslug>", methods=["GET"])
@@ -213,6 +498,71 @@ def show(username_or_id, soundslug):
     return jsonify(to_json_track(sound, account))
 
 
+@bp_api_tracks.route("/api/tracks/<string:track_id>/waveform", methods=["GET"])
+@require_oauth(optional=True)
+def waveform(track_id):
+    """
+    Get track waveform peaks.
+    ---
+    tags:
+        - Tracks
+    parameters:
+        - name: track_id
+          in: path
+          type: string
+          required: true
+          description: Track flake ID
+        - name: level
+          in: query
+          type: integer
+          description: Level of details, 0 is the overview, highest available is used if too big
+    responses:
+        200:
+            description: Returns the waveform peaks, base64 of signed 8 bits min/max pairs.
+    """
+    # Get logged in user from bearer token, or None if not logged in
+    if current_token:
+        current_user = current_token.user
+    else:
+        current_user = None
+
+    try:
+        level = int(request.args.get("level", 0))
+    except ValueError:
+        return jsonify({"error": "invalid level"}), 400
+    if level < 0:
+        return jsonify({"error": "invalid level"}), 400
+
+    try:
+        sound = Sound.query.filter(Sound.flake_id == track_id).first()
+    except sqlalchemy.exc.DataError:
+        return jsonify({"error": "not found"}), 404
+    if not sound:
+        return jsonify({"error": "not found"}), 404
+
+    if sound.private:
+        if not current_user or sound.user_id != current_user.id:
+            return jsonify({"error": "forbidden"}), 403
+
+    wf = (
+        SoundWaveform.query.filter(SoundWaveform.sound_id == sound.id, SoundWaveform.level <= level)
+        .order_by(SoundWaveform.level.desc())
+        .first()
+    )
+    if not wf:
+        return jsonify({"error": "not found"}), 404
+
+    resp = jsonify(waveform_to_json(wf.peaks, wf.level))
+    resp.set_etag(wf.etag)
+    # levels only change when regenerated, revalidated with the etag once expired
+    resp.cache_control.max_age = int(current_app.config["WAVEFORM_CACHE_MAX_AGE"])
+    if sound.private:
+        resp.cache_control.private = True
+    else:
+        resp.cache_control.public = True
+    return resp.make_conditional(request)
+
+
 @bp_api_tracks.route("/api/tracks/<string:username>/<string:soundslug>", methods=["PATCH"])
 @require_oauth("write")
 def edit(username, soundslug):
@@ -388,7 +738,7 @@ def logs(username_or_id, soundslug):
           description: Track slug
     responses:
         200:
-            description: Returns track logs.
+            description: Returns track logs and the time spent in each processing stage.
     """
     # Get logged in user from bearer token, or None if not logged in
     if current_token:
@@ -434,7 +784,22 @@ def logs(username_or_id, soundslug):
     for log in user_logs:
         logs.append({"message": log.message, "date": log.timestamp, "level": log.level})
 
-    logs = {"trackSlug": sound.slug, "logs": logs}
+    # time spent in each stage of the processing, for the author only like the logs
+    timings = []
+    if current_user and sound.user_id == current_user.id:
+        for timing in sound.timings:
+            timings.append(
+                {
+                    "stage": timing.stage,
+                    "elapsed": timing.elapsed,
+                    "input_size": timing.input_size,
+                    "duration": timing.duration,
+                    "success": timing.success,
+                    "date": timing.created,
+                }
+            )
+
+    logs = {"trackSlug": sound.slug, "logs": logs, "timings": timings}
     return jsonify(logs)
 
 
@@ -442,7 +807,7 @@ def logs(username_or_id, soundslug):
 @require_oauth("write")
 def retry_processing(username_or_id, soundslug):
     """
-    Reset track processing state.
+    Resume track processing after its last completed stage.
     ---
     tags:
         - Tracks
@@ -487,15 +852,13 @@ def retry_processing(username_or_id, soundslug):
     if not sound:
         return jsonify({"error": "not found"}), 404
 
-    if sound.transcode_state != Sound.TRANSCODE_ERROR:
+    # processing failed, or published stages failed after the processing
+    stalled = sound.transcode_state == Sound.TRANSCODE_DONE and not sound.stage_done(Sound.STAGE_NOTIFIED)
+    if sound.transcode_state != Sound.TRANSCODE_ERROR and not stalled:
         return jsonify({"error": "cannot reset transcode state if no error"}), 503
 
-    # Delete sound info if any
-    if sound.sound_infos.count() > 0:
-        db.session.delete(sound.sound_infos.one())
-
-    # Reset transcode state if transcode is needed
-    if sound.transcode_needed:
+    # The workflow resumes after the last completed stage, keeping the sound infos and waveform already done
+    if sound.transcode_state == Sound.TRANSCODE_ERROR:
         sound.transcode_state = Sound.TRANSCODE_WAITING
 
     db.session.commit()
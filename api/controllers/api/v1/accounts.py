@@ -18,11 +18,21 @@ from flask_security.utils import hash_password
 from flask_security import confirmable as FSConfirmable
 from app_oauth import authorization, require_oauth
 from authlib.integrations.flask_oauth2 import current_token
-from datas_helpers import to_json_track, to_json_account, to_json_relationship
+from datas_helpers import (
+    to_json_account,
+    to_json_accounts,
+    to_json_relationship,
+    to_json_relationships,
+    to_json_tracks,
+    tracks_load_options,
+)
 from utils.various import forbidden_username, add_user_log, add_log, get_hashed_filename
+from utils.pagination import paginate, has_cursors, keyset_paginate, keyset_response
 from tasks import send_update_profile, federate_delete_actor, post_to_outbox
 import re
+import uuid
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 import sqlalchemy.exc
 from flask_mail import Message
 from flask import render_template
@@ -480,6 +490,22 @@ def user_statuses(username_or_id):
           in: query
           type: integer
           description: page number
+        - name: max_id
+          in: query
+          type: string
+          description: return results older than this id
+        - name: since_id
+          in: query
+          type: string
+          description: return results newer than this id
+        - name: min_id
+          in: query
+          type: string
+          description: return results immediately newer than this id
+        - name: with_total
+          in: query
+          type: boolean
+          description: paginated only, compute the exact totalItems instead of an approximated totalPages
     responses:
         200:
             description: Returns array of Status
@@ -498,30 +524,28 @@ def user_statuses(username_or_id):
     if not user:
         abort(404)
 
-    q = db.session.query(Activity, Sound).filter(
-        Activity.type == "Create", Activity.payload[("object", "type")].astext == "Audio"
-    )
+    q = db.session.query(Activity, Sound).filter(Activity.type == "Create", Activity.object_type == "Audio")
     q = q.filter(Activity.meta_deleted.is_(False))
 
-    q = q.filter(Activity.payload["to"].astext.contains("https://www.w3.org/ns/activitystreams#Public"))
+    q = q.filter(Activity.is_public.is_(True))
 
     q = q.filter(Activity.actor_id == user.actor[0].id)
 
     q = q.join(Sound, Sound.activity_id == Activity.id)
-    q = q.order_by(Activity.creation_date.desc())
-
-    q = q.paginate(page=page, per_page=count)
-
-    tracks = []
-    for t in q.items:
-        if t.Sound:
-            relationship = False
-            if current_token and current_token.user:
-                relationship = to_json_relationship(current_token.user, t.Sound.user)
-            account = to_json_account(t.Sound.user, relationship)
-            tracks.append(to_json_track(t.Sound, account))
-        else:
-            print(t.Activity)
+    q = q.options(*tracks_load_options())
+
+    viewer = current_token.user if current_token else None
+
+    if has_cursors():
+        # mastoapi compatible, max_id/since_id/min_id cursors are track ids
+        sounds = [t.Sound for t in keyset_paginate(q, Sound.flake_id, count)]
+        return keyset_response(sounds, to_json_tracks(sounds, viewer), lambda s: s.flake_id)
+
+    # the user counter is close enough from this query and spares a COUNT(*)
+    q = paginate(q.order_by(Activity.creation_date.desc()), page, count, user.public_tracks_count)
+
+    sounds = [t.Sound for t in q.items if t.Sound]
+    tracks = to_json_tracks(sounds, viewer)
     resp = {"page": page, "page_size": count, "totalItems": q.total, "items": tracks, "totalPages": q.pages}
     return jsonify(resp)
 
@@ -583,19 +607,21 @@ def relationships():
         schema:
             $ref: '#/definitions/Relationship'
     """
-    flake_ids = request.args.getlist("id")
+    flake_ids = []
+    for id in request.args.getlist("id"):
+        try:
+            flake_ids.append(uuid.UUID(id))
+        except ValueError:
+            continue  # unknown account
     of_user = current_token.user
 
-    rels = []
-    for id in flake_ids:
-        against_user = User.query.filter(User.flake_id == id).first()
-        if not against_user:
-            if len(flake_ids) > 1:
-                next
-            else:
-                return jsonify([])
-        rels.append(to_json_relationship(of_user, against_user))
-    return jsonify(rels)
+    if not flake_ids:
+        return jsonify([])
+
+    users = {u.flake_id: u for u in User.query.filter(User.flake_id.in_(flake_ids)).all()}
+    against_users = [users[id] for id in flake_ids if id in users]
+    rels = to_json_relationships(of_user, against_users)
+    return jsonify([rels[u.id] for u in against_users])
 
 
 @bp_api_v1_accounts.route("/api/v1/accounts/<string:username_or_id>/follow", methods=["POST"])
@@ -743,6 +769,22 @@ def followers(username_or_id):
           in: query
           type: integer
           description: page number
+        - name: max_id
+          in: query
+          type: string
+          description: return results older than this id
+        - name: since_id
+          in: query
+          type: string
+          description: return results newer than this id
+        - name: min_id
+          in: query
+          type: string
+          description: return results immediately newer than this id
+        - name: with_total
+          in: query
+          type: boolean
+          description: paginated only, compute the exact totalItems instead of an approximated totalPages
     responses:
       200:
         description: Returns paginated array of Account
@@ -761,19 +803,20 @@ def followers(username_or_id):
     count = int(request.args.get("count", 20))
     page = int(request.args.get("page", 1))
 
-    q = user.actor[0].followers
-    q = q.paginate(page=page, per_page=count)
+    q = user.actor[0].followers.options(joinedload(Follower.actor).joinedload(Actor.user))
+    viewer = current_token.user if current_token else None
 
-    followers = []
-    for t in q.items:
-        # Note: the items are Follower(actor, target)
-        # Where target is `user` since we are asking his followers
-        # And actor = the user following `user`
-        relationship = False
-        if current_token and current_token.user:
-            relationship = to_json_relationship(current_token.user, t.actor.user)
-        account = to_json_account(t.actor.user, relationship)
-        followers.append(account)
+    if has_cursors():
+        # mastoapi compatible, max_id/since_id/min_id cursors are the follow relationship ids
+        items = keyset_paginate(q, Follower.id, count, int)
+        return keyset_response(items, to_json_accounts([t.actor.user for t in items], viewer), lambda t: t.id)
+
+    q = paginate(q.order_by(Follower.id.desc()), page, count, user.followers_count)
+
+    # Note: the items are Follower(actor, target)
+    # Where target is `user` since we are asking his followers
+    # And actor = the user following `user`
+    followers = to_json_accounts([t.actor.user for t in q.items], viewer)
 
     resp = {"page": page, "page_size": count, "totalItems": q.total, "items": followers, "totalPages": q.pages}
     return jsonify(resp)
@@ -802,6 +845,22 @@ def following(username_or_id):
           in: query
           type: integer
           description: page number
+        - name: max_id
+          in: query
+          type: string
+          description: return results older than this id
+        - name: since_id
+          in: query
+          type: string
+          description: return results newer than this id
+        - name: min_id
+          in: query
+          type: string
+          description: return results immediately newer than this id
+        - name: with_total
+          in: query
+          type: boolean
+          description: paginated only, compute the exact totalItems instead of an approximated totalPages
     responses:
       200:
         description: Returns paginated array of Account
@@ -820,19 +879,20 @@ def following(username_or_id):
     count = int(request.args.get("count", 20))
     page = int(request.args.get("page", 1))
 
-    q = user.actor[0].followings
-    q = q.paginate(page=page, per_page=count)
-
-    followings = []
-    for t in q.items:
-        # Note: the items are Follower(actor, target)
-        # Where actor is `user` since we are asking his followers
-        # And target = the user following `user`
-        relationship = False
-        if current_token and current_token.user:
-            relationship = to_json_relationship(current_token.user, t.target.user)
-        account = to_json_account(t.target.user, relationship)
-        followings.append(account)
+    q = user.actor[0].followings.options(joinedload(Follower.target).joinedload(Actor.user))
+    viewer = current_token.user if current_token else None
+
+    if has_cursors():
+        # mastoapi compatible, max_id/since_id/min_id cursors are the follow relationship ids
+        items = keyset_paginate(q, Follower.id, count, int)
+        return keyset_response(items, to_json_accounts([t.target.user for t in items], viewer), lambda t: t.id)
+
+    q = paginate(q.order_by(Follower.id.desc()), page, count, user.following_count)
+
+    # Note: the items are Follower(actor, target)
+    # Where actor is `user` since we are asking his followers
+    # And target = the user following `user`
+    followings = to_json_accounts([t.target.user for t in q.items], viewer)
 
     resp = {"page": page, "page_size": count, "totalItems": q.total, "items": followings, "totalPages": q.pages}
     return jsonify(resp)
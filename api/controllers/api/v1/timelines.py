@@ -1,8 +1,9 @@
 from flask import Blueprint, jsonify, request, abort
-from models import db, Sound, Activity, Album, User
+from models import db, Sound, Activity, Album, User, HomeTimeline
 from app_oauth import require_oauth
-from datas_helpers import to_json_track, to_json_account, to_json_album, to_json_relationship
+from datas_helpers import to_json_tracks, to_json_albums, tracks_load_options, albums_load_options
 from authlib.integrations.flask_oauth2 import current_token
+from utils.pagination import paginate, has_cursors, keyset_paginate, keyset_paginate_by, keyset_response
 
 
 bp_api_v1_timelines = Blueprint("bp_api_v1_timelines", __name__)
@@ -22,21 +23,51 @@ def home():
           type: integer
           required: true
           description: count
-        - name: with_muted
+        - name: page
           in: query
-          type: boolean
-          required: true
-          description: with muted users
+          type: integer
+          description: page number
+        - name: max_id
+          in: query
+          type: string
+          description: return results older than this id
         - name: since_id
           in: query
           type: string
-          description: last ID
+          description: return results newer than this id
+        - name: min_id
+          in: query
+          type: string
+          description: return results immediately newer than this id
+        - name: with_total
+          in: query
+          type: boolean
+          description: paginated only, compute the exact totalItems instead of an approximated totalPages
     responses:
         200:
             description: Returns array of Status
     """
-    # TODO don't forget to handle if paginated=true paginate else mastoapi
-    resp = {"page": 1, "page_size": 20, "totalItems": 0, "items": [], "totalPages": 1}
+    user = current_token.user
+    if not user:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    count = int(request.args.get("count", 20))
+    page = int(request.args.get("page", 1))
+
+    # materialized on write, see utils.home_timeline
+    q = Sound.query.join(HomeTimeline, HomeTimeline.sound_id == Sound.id)
+    q = q.filter(HomeTimeline.user_id == user.id, Sound.transcode_state == Sound.TRANSCODE_DONE)
+    q = q.options(*tracks_load_options())
+
+    if has_cursors():
+        # mastoapi compatible, max_id/since_id/min_id cursors are track ids
+        sounds = keyset_paginate(q, HomeTimeline.flake_id, count)
+        return keyset_response(sounds, to_json_tracks(sounds, user), lambda s: s.flake_id)
+
+    q = paginate(q.order_by(HomeTimeline.flake_id.desc()), page, count)
+
+    tracks = to_json_tracks(q.items, user)
+    resp = {"page": page, "page_size": count, "totalItems": q.total, "items": tracks, "totalPages": q.pages}
     return jsonify(resp)
 
 
@@ -63,6 +94,26 @@ def public():
           in: query
           type: boolean
           description: local only or TWKN
+        - name: paginated
+          in: query
+          type: boolean
+          description: paginated with page, or mastoapi compatible list with Link header
+        - name: max_id
+          in: query
+          type: string
+          description: return results older than this id
+        - name: since_id
+          in: query
+          type: string
+          description: return results newer than this id
+        - name: min_id
+          in: query
+          type: string
+          description: return results immediately newer than this id
+        - name: with_total
+          in: query
+          type: boolean
+          description: paginated only, compute the exact totalItems instead of an approximated totalPages
     responses:
         200:
             description: Returns array of Status
@@ -72,63 +123,47 @@ def public():
     paginated = request.args.get("paginated", False)
     count = int(request.args.get("count", 20))
     local_only = request.args.get("local", False)
+    viewer = current_token.user if current_token else None
 
-    q = db.session.query(Activity, Sound).filter(
-        Activity.type == "Create", Activity.payload[("object", "type")].astext == "Audio"
-    )
+    q = db.session.query(Activity, Sound).filter(Activity.type == "Create", Activity.object_type == "Audio")
     q = q.filter(Activity.meta_deleted.is_(False))
 
     if local_only:
         q = q.filter(Activity.local.is_(True))
 
-    q = q.filter(Activity.payload["to"].astext.contains("https://www.w3.org/ns/activitystreams#Public"))
+    q = q.filter(Activity.is_public.is_(True))
 
     q = q.join(Sound, Sound.activity_id == Activity.id)
-    q = q.order_by(Activity.creation_date.desc())
+    q = q.filter(Sound.transcode_state == Sound.TRANSCODE_DONE)
+    q = q.options(*tracks_load_options())
 
     if paginated:
         # Render timeline as paginated
         page = int(request.args.get("page", 1))
 
-        q = q.paginate(page=page, per_page=count)
-
-        tracks = []
-        for t in q.items:
-            if t.Sound:
-                # TODO(dashie) FIXME can probably be moved out to the q.filter()
-                if not t.Sound.transcode_state == Sound.TRANSCODE_DONE:
-                    continue
-                relationship = False
-                if current_token and current_token.user:
-                    relationship = to_json_relationship(current_token.user, t.Sound.user)
-                account = to_json_account(t.Sound.user, relationship)
-                tracks.append(to_json_track(t.Sound, account))
-            else:
-                print(t.Activity)
+        q = paginate(q.order_by(Activity.creation_date.desc(), Activity.id.desc()), page, count)
+
+        tracks = to_json_tracks([t.Sound for t in q.items], viewer)
         resp = {"page": page, "page_size": count, "totalItems": q.total, "items": tracks, "totalPages": q.pages}
         return jsonify(resp)
     else:
-        # mastoapi compatible
-        since_id = request.args.get("since_id")
-
-        # since then we want the timeline
-        if since_id:
-            q = q.filter(Sound.flake_id > since_id)
+        # mastoapi compatible, max_id/since_id/min_id cursors are track ids,
+        # paged on the activities order like above, along the ix_activity_timeline index
+        rows = keyset_paginate_by(q, (Activity.creation_date, Activity.id), count, activity_sort_key)
+        sounds = [t.Sound for t in rows]
+        return keyset_response(sounds, to_json_tracks(sounds, viewer), lambda s: s.flake_id)
 
-        # then limit count
-        q = q.limit(count)
 
-        tracks = []
-        for t in q.all():
-            if t.Sound:
-                relationship = False
-                if current_token and current_token.user:
-                    relationship = to_json_relationship(current_token.user, t.Sound.user)
-                account = to_json_account(t.Sound.user, relationship)
-                tracks.append(to_json_track(t.Sound, account))
-            else:
-                print(t.Activity)
-        return jsonify(tracks)
+def activity_sort_key(flake_id):
+    """
+    (creation_date, id) of the Create activity of a track
+    """
+    return (
+        db.session.query(Activity.creation_date, Activity.id)
+        .join(Sound, Sound.activity_id == Activity.id)
+        .filter(Sound.flake_id == flake_id)
+        .first()
+    )
 
 
 @bp_api_v1_timelines.route("/api/v1/timelines/drafts", methods=["GET"])
@@ -149,6 +184,22 @@ def drafts():
           in: query
           type: integer
           description: page number
+        - name: max_id
+          in: query
+          type: string
+          description: return results older than this id
+        - name: since_id
+          in: query
+          type: string
+          description: return results newer than this id
+        - name: min_id
+          in: query
+          type: string
+          description: return results immediately newer than this id
+        - name: with_total
+          in: query
+          type: boolean
+          description: paginated only, compute the exact totalItems instead of an approximated totalPages
     responses:
         200:
             description: Returns array of Status
@@ -164,15 +215,16 @@ def drafts():
         Sound.user_id == user.id, Sound.private.is_(True), Sound.transcode_state == Sound.TRANSCODE_DONE
     )
 
-    q = q.order_by(Sound.uploaded.desc())
+    q = q.options(*tracks_load_options())
 
-    q = q.paginate(page=page, per_page=count)
+    if has_cursors():
+        # mastoapi compatible, max_id/since_id/min_id cursors are track ids
+        sounds = keyset_paginate(q, Sound.flake_id, count)
+        return keyset_response(sounds, to_json_tracks(sounds, current_token.user), lambda s: s.flake_id)
 
-    tracks = []
-    for t in q.items:
-        relationship = to_json_relationship(current_token.user, t.user)
-        account = to_json_account(t.user, relationship)
-        tracks.append(to_json_track(t, account))
+    q = paginate(q.order_by(Sound.uploaded.desc()), page, count)
+
+    tracks = to_json_tracks(q.items, current_token.user)
     resp = {"page": page, "page_size": count, "totalItems": q.total, "items": tracks, "totalPages": q.pages}
     return jsonify(resp)
 
@@ -199,6 +251,22 @@ def albums():
           in: query
           type: string
           description: the user flake id to get albums list
+        - name: max_id
+          in: query
+          type: string
+          description: return results older than this id
+        - name: since_id
+          in: query
+          type: string
+          description: return results newer than this id
+        - name: min_id
+          in: query
+          type: string
+          description: return results immediately newer than this id
+        - name: with_total
+          in: query
+          type: boolean
+          description: paginated only, compute the exact totalItems instead of an approximated totalPages
     responses:
         200:
             description: Returns array of Status
@@ -213,7 +281,7 @@ def albums():
     if not user:
         return jsonify({"error": "User does not exist"}), 404
 
-    q = Album.query.order_by(Album.created.desc())
+    q = Album.query.options(*albums_load_options())
 
     only_public = True
     if current_token and current_token.user:
@@ -225,15 +293,17 @@ def albums():
     else:
         q = q.filter(Album.user_id == current_token.user.id)
 
-    q = q.paginate(page=page, per_page=count)
+    viewer = current_token.user if current_token else None
+
+    if has_cursors():
+        # mastoapi like, max_id/since_id/min_id cursors are album ids
+        items = keyset_paginate(q, Album.flake_id, count)
+        return keyset_response(items, to_json_albums(items, viewer), lambda a: a.flake_id)
 
-    albums = []
-    for t in q.items:
-        relationship = False
-        if current_token and current_token.user:
-            relationship = to_json_relationship(current_token.user, t.user)
-        account = to_json_account(t.user, relationship)
-        albums.append(to_json_album(t, account))
+    total = user.public_albums_count if only_public else None
+    q = paginate(q.order_by(Album.created.desc()), page, count, total)
+
+    albums = to_json_albums(q.items, viewer)
     resp = {"page": page, "page_size": count, "totalItems": q.total, "items": albums, "totalPages": q.pages}
     return jsonify(resp)
 
@@ -256,6 +326,22 @@ def unprocessed():
           in: query
           type: integer
           description: page number
+        - name: max_id
+          in: query
+          type: string
+          description: return results older than this id
+        - name: since_id
+          in: query
+          type: string
+          description: return results newer than this id
+        - name: min_id
+          in: query
+          type: string
+          description: return results immediately newer than this id
+        - name: with_total
+          in: query
+          type: boolean
+          description: paginated only, compute the exact totalItems instead of an approximated totalPages
     responses:
         200:
             description: Returns array of Status
@@ -272,14 +358,15 @@ def unprocessed():
         Sound.transcode_state.in_((Sound.TRANSCODE_WAITING, Sound.TRANSCODE_PROCESSING, Sound.TRANSCODE_ERROR)),
     )
 
-    q = q.order_by(Sound.uploaded.desc())
+    q = q.options(*tracks_load_options())
+
+    if has_cursors():
+        # mastoapi compatible, max_id/since_id/min_id cursors are track ids
+        sounds = keyset_paginate(q, Sound.flake_id, count)
+        return keyset_response(sounds, to_json_tracks(sounds, current_token.user), lambda s: s.flake_id)
 
-    q = q.paginate(page=page, per_page=count)
+    q = paginate(q.order_by(Sound.uploaded.desc()), page, count)
 
-    tracks = []
-    for t in q.items:
-        relationship = to_json_relationship(current_token.user, t.user)
-        account = to_json_account(t.user, relationship)
-        tracks.append(to_json_track(t, account))
+    tracks = to_json_tracks(q.items, current_token.user)
     resp = {"page": page, "page_size": count, "totalItems": q.total, "items": tracks, "totalPages": q.pages}
     return jsonify(resp)
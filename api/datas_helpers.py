@@ -1,86 +1,274 @@
 from flask import url_for, current_app
-from models import Album, Sound
-import json
+from models import db, Actor, Follower, Role, roles_users, User, Sound, SoundInfo, SoundRendition, Album
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload, selectinload
+from utils import json_cache
+import datetime
 
 
-def to_json_relationship(of_user, against_user):
+def to_json_relationships(of_user, against_users, actors=None):
     """
-    user relationship against_user
+    user relationships against a list of users, answered with one query on followers
     of_user is the user "point of view"
     following = is of_user following against_user ?
     followed_by = is against_user following of_user ?
     etc.
+    actors is an optional dict of {user.id: Actor} already fetched for against_users
+    :return: a dict of {against_user.id: relationship}
+    """
+    if not of_user or not against_users:
+        return {}
+
+    user_ids = list({user.id for user in against_users})
+    if actors is None:
+        actors = {}
+        for actor in Actor.query.filter(Actor.user_id.in_(user_ids)).order_by(Actor.id.asc()):
+            actors.setdefault(actor.user_id, actor)
+    actor_ids = [actors[user_id].id for user_id in user_ids if user_id in actors]
+
+    me = of_user.actor[0].id
+    follows = db.session.query(Follower.actor_id, Follower.target_id).filter(
+        or_(
+            and_(Follower.actor_id == me, Follower.target_id.in_(actor_ids)),
+            and_(Follower.target_id == me, Follower.actor_id.in_(actor_ids)),
+        )
+    )
+    following = set()
+    followed_by = set()
+    for actor_id, target_id in follows:
+        if actor_id == me:
+            following.add(target_id)
+        if target_id == me:
+            followed_by.add(actor_id)
+
+    rels = {}
+    for user_id in user_ids:
+        actor = actors.get(user_id)
+        rels[user_id] = dict(
+            id=user_id,
+            following=actor is not None and actor.id in following,
+            followed_by=actor is not None and actor.id in followed_by,
+            blocking=False,  # TODO handle that
+            muting=False,  # TODO maybe handle that
+            muting_notifications=False,
+            requested=False,  # TODO handle that
+            domain_blocking=False,
+            showing_reblogs=True,
+            endorsed=False,  # not managed
+        )
+    return rels
+
+
+def to_json_relationship(of_user, against_user):
+    """
+    user relationship against_user
+    of_user is the user "point of view"
     """
     if not of_user:
         return None
-    obj = dict(
-        id=against_user.id,
-        following=True if of_user.actor[0].is_following(against_user.actor[0]) else False,
-        followed_by=True if against_user.actor[0].is_following(of_user.actor[0]) else False,
-        blocking=False,  # TODO handle that
-        muting=False,  # TODO maybe handle that
-        muting_notifications=False,
-        requested=False,  # TODO handle that
-        domain_blocking=False,
-        showing_reblogs=True,
-        endorsed=False,  # not managed
-    )
-    return obj
+    return to_json_relationships(of_user, [against_user])[against_user.id]
+
+
+def to_json_accounts(users, viewer=None):
+    """
+    Serialize a list of users in a constant number of queries.
+    Actors and admin role are fetched grouped for the whole list
+    instead of being lazy loaded for each user, counters are the denormalized User ones.
+    viewer is the user "point of view" for the relationships, if any.
+    Returned list is in the same order as users.
+    """
+    user_ids = list({user.id for user in users})
+    if not user_ids:
+        return []
+
+    actors = {}
+    for actor in Actor.query.filter(Actor.user_id.in_(user_ids)).order_by(Actor.id.asc()):
+        # same as user.actor[0]
+        actors.setdefault(actor.user_id, actor)
+
+    relationships = to_json_relationships(viewer, users, actors)
+
+    admins = db.session.query(roles_users.c.user_id).join(Role, Role.id == roles_users.c.role_id)
+    admins = {r.user_id for r in admins.filter(Role.name == "admin", roles_users.c.user_id.in_(user_ids))}
+
+    objs = {}
+    for user in users:
+        if user.id in objs:
+            continue
+        actor = actors[user.id]
+        url_feed = url_for("bp_feeds.tracks", user_id=user.flake_id, _external=True)
+        if user.path_avatar():
+            url_avatar = url_for("get_uploads_stuff", thing="avatars", stuff=user.path_avatar(), _external=True)
+        else:
+            url_avatar = f"{current_app.config['REEL2BITS_URL']}/static/userpic_placeholder.svg"
+
+        obj = dict(
+            id=user.id,
+            flakeId=user.flake_id,
+            username=user.name,
+            acct=(user.name if user.local else f"{user.name}@{actor.domain}"),
+            display_name=user.display_name,
+            locked=False,
+            created_at=user.created_at,
+            followers_count=user.followers_count,
+            following_count=user.following_count,
+            statuses_count=user.public_tracks_count,
+            note=actor.summary,
+            url=actor.url,
+            avatar=url_avatar,
+            avatar_static=url_avatar,
+            header="",
+            header_static="",
+            emojis=[],
+            moved=None,
+            fields=[],
+            bot=False,
+            source={
+                "privacy": "unlisted",
+                "sensitive": False,
+                "language": user.locale,
+                "note": actor.summary,
+                "fields": [],
+            },
+            pleroma={"is_admin": user.id in admins},
+            reel2bits={
+                "albums_count": user.public_albums_count,
+                "lang": user.locale,
+                "quota_limit": user.quota,
+                "quota_count": user.quota_count,
+                "url_feed": url_feed,
+            },
+        )
+        if user.id in relationships:
+            obj["pleroma"]["relationship"] = relationships[user.id]
+        objs[user.id] = obj
+
+    return [objs[user.id] for user in users]
 
 
 def to_json_account(user, relationship=False):
-    url_feed = url_for("bp_feeds.tracks", user_id=user.flake_id, _external=True)
-    if user.path_avatar():
-        url_avatar = url_for("get_uploads_stuff", thing="avatars", stuff=user.path_avatar(), _external=True)
-    else:
-        url_avatar = f"{current_app.config['REEL2BITS_URL']}/static/userpic_placeholder.svg"
-
-    obj = dict(
-        id=user.id,
-        flakeId=user.flake_id,
-        username=user.name,
-        acct=user.acct(),
-        display_name=user.display_name,
-        locked=False,
-        created_at=user.created_at,
-        followers_count=user.actor[0].followers.count(),
-        following_count=user.actor[0].followings.count(),
-        statuses_count=user.sounds.filter(
-            Sound.private.is_(False), Sound.transcode_state == Sound.TRANSCODE_DONE
-        ).count(),
-        note=user.actor[0].summary,
-        url=user.actor[0].url,
-        avatar=url_avatar,
-        avatar_static=url_avatar,
-        header="",
-        header_static="",
-        emojis=[],
-        moved=None,
-        fields=[],
-        bot=False,
-        source={
-            "privacy": "unlisted",
-            "sensitive": False,
-            "language": user.locale,
-            "note": user.actor[0].summary,
-            "fields": [],
-        },
-        pleroma={"is_admin": user.is_admin()},
-        reel2bits={
-            "albums_count": user.albums.filter(Album.private.is_(False)).count(),
-            "lang": user.locale,
-            "quota_limit": user.quota,
-            "quota_count": user.quota_count,
-            "url_feed": url_feed,
-        },
-    )
+    obj = to_json_accounts([user])[0]
     if relationship:
         obj["pleroma"]["relationship"] = relationship
     return obj
 
 
+def tracks_load_options():
+    """
+    Loader options for a Sound query whose results will be serialized,
+    everything to_json_track() touches except the SoundInfo and SoundRendition
+    (dynamic relationships, see sound_infos_of() and renditions_of()).
+    Usage: Sound.query.options(*tracks_load_options())
+    """
+    return (
+        joinedload(Sound.user).selectinload(User.actor),
+        joinedload(Sound.album),
+        selectinload(Sound.tags),
+    )
+
+
+def albums_load_options():
+    """
+    Loader options for an Album query whose results will be serialized, see tracks_load_options().
+    """
+    return (joinedload(Album.user), selectinload(Album.tags))
+
+
+def sound_infos_of(tracks):
+    """
+    Fetch the SoundInfo of all the tracks in one query
+    :return: a dict of {track.id: SoundInfo}
+    """
+    track_ids = [track.id for track in tracks]
+    if not track_ids:
+        return {}
+    infos = {}
+    for si in SoundInfo.query.filter(SoundInfo.sound_id.in_(track_ids)).order_by(SoundInfo.id.asc()):
+        # same as track.sound_infos.first()
+        infos.setdefault(si.sound_id, si)
+    return infos
+
+
+def renditions_of(tracks):
+    """
+    Fetch the SoundRendition of all the tracks in one query
+    :return: a dict of {track.id: [SoundRendition]}
+    """
+    track_ids = [track.id for track in tracks]
+    if not track_ids:
+        return {}
+    renditions = {}
+    for rendition in SoundRendition.query.filter(SoundRendition.sound_id.in_(track_ids)).order_by(SoundRendition.id):
+        renditions.setdefault(rendition.sound_id, []).append(rendition)
+    return renditions
+
+
+def to_json_rendition(track, rendition):
+    return {
+        "kind": rendition.kind,
+        "codec": rendition.codec,
+        "bitrate": rendition.bitrate,
+        "mime_type": rendition.mime_type,
+        "file_size": rendition.file_size,
+        "url": url_for("get_uploads_stuff", thing="sounds", stuff=track.path_rendition(rendition), _external=True),
+    }
+
+
+def elapsed_since(date):
+    return (datetime.datetime.utcnow() - date).total_seconds()
+
+
+def with_account(body, account):
+    """
+    Merge the viewer dependent parts in a cached track or album body, body is left untouched
+    """
+    obj = dict(body, account=account)
+    obj["reel2bits"] = dict(body["reel2bits"], uploaded_elapsed=elapsed_since(body["created_at"]))
+    if obj["reel2bits"]["type"] == "album":
+        obj["reel2bits"]["tracks"] = [with_account(track, account) for track in body["reel2bits"]["tracks"]]
+    return obj
+
+
+def track_version(track):
+    return (track.updated, track.transcode_state)
+
+
+def tracks_bodies(tracks):
+    """
+    Viewer independent part of the tracks, from the json cache or rendered then cached
+    :return: a dict of {track.id: body}
+    """
+    versions = {track.id: track_version(track) for track in tracks}
+    bodies = json_cache.get_many("track", versions)
+    missing = [track for track in tracks if track.id not in bodies]
+    if missing:
+        infos = sound_infos_of(missing)
+        renditions = renditions_of(missing)
+        rendered = {
+            track.id: _to_json_track(track, infos.get(track.id), renditions.get(track.id, [])) for track in missing
+        }
+        json_cache.set_many("track", {track_id: (versions[track_id], body) for track_id, body in rendered.items()})
+        bodies.update(rendered)
+    return bodies
+
+
+def to_json_tracks(tracks, viewer=None):
+    """
+    Serialize a list of tracks in a constant number of queries,
+    tracks should have been loaded with tracks_load_options().
+    viewer is the user "point of view" for the accounts relationships, if any.
+    Returned list is in the same order as tracks.
+    """
+    accounts = to_json_accounts([track.user for track in tracks], viewer)
+    bodies = tracks_bodies(tracks)
+    return [with_account(bodies[track.id], account) for track, account in zip(tracks, accounts)]
+
+
 def to_json_track(track, account):
-    si = track.sound_infos.first()
+    return with_account(tracks_bodies([track])[track.id], account)
+
+
+def _to_json_track(track, si, renditions):
     url_orig = url_for("get_uploads_stuff", thing="sounds", stuff=track.path_sound(orig=True), _external=True)
     url_transcode = url_for("get_uploads_stuff", thing="sounds", stuff=track.path_sound(orig=False), _external=True)
     if track.path_artwork():
@@ -92,7 +280,6 @@ def to_json_track(track, account):
         "id": track.flake_id,
         "uri": None,
         "url": None,
-        "account": account,
         "in_reply_to_id": None,
         "in_reply_to_account_id": None,
         "reblog": None,
@@ -123,9 +310,14 @@ def to_json_track(track, account):
             "picture_url": url_artwork,
             "media_orig": url_orig,
             "media_transcoded": url_transcode,
-            "waveform": (json.loads(si.waveform) if si else None),
+            # lowest bitrate first
+            "renditions": [to_json_rendition(track, rendition) for rendition in renditions],
+            "waveform": (
+                url_for("bp_api_tracks.waveform", track_id=track.flake_id, _external=True)
+                if si and si.done_waveform and not si.waveform_error
+                else None
+            ),
             "private": track.private,
-            "uploaded_elapsed": track.elapsed(),
             "album_id": (track.album.id if track.album else None),
             "album_order": (track.album_order if track.album else None),
             "genre": track.genre,
@@ -135,6 +327,7 @@ def to_json_track(track, account):
                 "transcode_state": track.transcode_state,
                 "transcode_needed": track.transcode_needed,
                 "done": track.processing_done(),
+                "stage": track.processing_stage,
             },
             "metadatas": {
                 "licence": track.licence_info(),
@@ -156,7 +349,78 @@ def to_json_track(track, account):
     return obj
 
 
+def tracks_of_albums(albums):
+    """
+    Fetch the tracks of all the albums in one query, loaded with tracks_load_options()
+    :return: a dict of {album.id: [Sound]}, ordered like album.sounds
+    """
+    album_ids = [album.id for album in albums]
+    if not album_ids:
+        return {}
+    tracks = {album_id: [] for album_id in album_ids}
+    for track in Sound.query.options(*tracks_load_options()).filter(Sound.album_id.in_(album_ids)):
+        tracks[track.album_id].append(track)
+    return tracks
+
+
+def albums_tracks_versions(albums):
+    """
+    Count and last update of the tracks of each album, in one query.
+    The albums embed their tracks, adding, reordering or processing one of them updates the track,
+    which changes the album version in every process, not only in the one invalidating it.
+    :return: a dict of {album.id: (count, last updated)}
+    """
+    album_ids = [album.id for album in albums]
+    if not album_ids:
+        return {}
+    q = (
+        db.session.query(Sound.album_id, func.count(Sound.id), func.max(Sound.updated))
+        .filter(Sound.album_id.in_(album_ids))
+        .group_by(Sound.album_id)
+    )
+    return {album_id: (count, updated) for album_id, count, updated in q}
+
+
+def album_version(album, tracks_version):
+    return (album.updated,) + tracks_version
+
+
+def albums_bodies(albums):
+    """
+    Viewer independent part of the albums with their tracks, from the json cache or rendered then cached
+    :return: a dict of {album.id: body}
+    """
+    tracks_versions = albums_tracks_versions(albums)
+    versions = {album.id: album_version(album, tracks_versions.get(album.id, (0, None))) for album in albums}
+    bodies = json_cache.get_many("album", versions)
+    missing = [album for album in albums if album.id not in bodies]
+    if missing:
+        tracks = tracks_of_albums(missing)
+        tracks_by_id = tracks_bodies([track for album_tracks in tracks.values() for track in album_tracks])
+        rendered = {
+            album.id: _to_json_album(album, [tracks_by_id[track.id] for track in tracks[album.id]]) for album in missing
+        }
+        json_cache.set_many("album", {album_id: (versions[album_id], body) for album_id, body in rendered.items()})
+        bodies.update(rendered)
+    return bodies
+
+
+def to_json_albums(albums, viewer=None):
+    """
+    Serialize a list of albums with their tracks in a constant number of queries,
+    albums should have been loaded with albums_load_options().
+    Returned list is in the same order as albums.
+    """
+    accounts = to_json_accounts([album.user for album in albums], viewer)
+    bodies = albums_bodies(albums)
+    return [with_account(bodies[album.id], account) for album, account in zip(albums, accounts)]
+
+
 def to_json_album(album, account):
+    return with_account(albums_bodies([album])[album.id], account)
+
+
+def _to_json_album(album, tracks):
     url_feed = url_for("bp_feeds.album", user_id=album.user.flake_id, album_id=album.id, _external=True)
     if album.path_artwork():
         url_artwork = url_for("get_uploads_stuff", thing="artwork_albums", stuff=album.path_artwork(), _external=True)
@@ -167,7 +431,6 @@ def to_json_album(album, account):
         "id": album.flake_id,
         "uri": None,
         "url": None,
-        "account": account,
         "in_reply_to_id": None,
         "in_reply_to_account_id": None,
         "reblog": None,
@@ -197,9 +460,8 @@ def to_json_album(album, account):
             "title": album.title,
             "picture_url": url_artwork,
             "private": album.private,
-            "uploaded_elapsed": album.elapsed(),
-            "tracks_count": album.sounds.count(),
-            "tracks": [to_json_track(t, account) for t in album.sounds],
+            "tracks_count": len(tracks),
+            "tracks": tracks,
             "genre": album.genre,
             "tags": [a.name for a in album.tags],
             "url_feed": url_feed,
@@ -0,0 +1,228 @@
+"""
+Delivery worker, posts the outgoing activities queued by activitypub.delivery.queue_deliveries()
+
+Runs next to the Celery workers when DELIVERY_WORKER is enabled, on its own asyncio loop:
+    python delivery_worker.py
+Pending deliveries are claimed by batches (SELECT ... FOR UPDATE SKIP LOCKED, several workers can run)
+and posted concurrently, up to DELIVERY_CONCURRENCY in flight and DELIVERY_PER_HOST per remote host,
+over keep-alive connections.
+The body of an activity is signed once when queued, its digest and its actor key are loaded once per worker,
+only the HTTP signature is made for each inbox, with OpenSSL, several times faster than the pycryptodome one.
+The results are written back in bulk every second: delivered ones deleted, failed ones retried later or given up.
+"""
+import asyncio
+import base64
+import collections
+import hashlib
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import urlsplit
+
+import aiohttp
+from cachetools import LRUCache
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from little_boxes import activitypub as ap
+from prometheus_client import start_http_server
+
+from activitypub.delivery import DeliveryResult, claim_deliveries, report_deliveries
+from activitypub.vars import HEADERS
+from app import create_app
+from utils import metrics
+
+# seconds a claimed delivery is hidden from the other workers, a post is cut after POST_TIMEOUT
+LEASE = 300
+POST_TIMEOUT = 120
+# seconds between two polls when nothing is due, and between two reports of the results
+POLL_INTERVAL = 1
+REPORT_INTERVAL = 1
+# seconds before claiming again after a failure, the database being unavailable
+CLAIM_RETRY = 5
+# payloads kept loaded, an activity is posted to all its inboxes in a row
+PAYLOADS_CACHE = 1000
+# same ones as little_boxes HTTPSigAuth, used by post_to_remote_inbox
+SIGNED_HEADERS = "(request-target) user-agent host date digest content-type"
+
+# body to post, with its digest, and the key of its actor
+Payload = collections.namedtuple("Payload", ["body", "digest", "key", "key_id"])
+
+
+def load_payload(body, actor_url, private_key):
+    body = body.encode("utf-8")
+    return Payload(
+        body=body,
+        digest="SHA-256=" + base64.b64encode(hashlib.sha256(body).digest()).decode("ascii"),
+        key=serialization.load_pem_private_key(private_key.encode("utf-8"), password=None, backend=default_backend()),
+        key_id=f"{actor_url}#main-key",
+    )
+
+
+def signed_headers(payload, inbox, user_agent):
+    """
+    Headers of the post of a payload to an inbox, with its HTTP signature
+    """
+    url = urlsplit(inbox)
+    path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+    # in the SIGNED_HEADERS order
+    headers = {
+        "User-Agent": user_agent,
+        "Host": url.netloc,
+        "Date": formatdate(usegmt=True),
+        "Digest": payload.digest,
+        "Content-Type": HEADERS[1],
+    }
+    signed = "\n".join(
+        [f"(request-target): post {path}"] + [f"{name.lower()}: {value}" for name, value in headers.items()]
+    )
+    signature = payload.key.sign(signed.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256())
+    headers["Signature"] = (
+        f'keyId="{payload.key_id}",algorithm="rsa-sha256",headers="{SIGNED_HEADERS}",'
+        f'signature="{base64.b64encode(signature).decode("ascii")}"'
+    )
+    headers["Accept"] = HEADERS[1]
+    return headers
+
+
+def outcome(status):
+    """
+    Label of utils.metrics.delivery_outcome(), like post_to_remote_inbox
+    """
+    if status is None:
+        return "unreachable"
+    if status < 400:
+        return "delivered"
+    return "client_error" if status < 500 else "server_error"
+
+
+class Worker:
+    def __init__(self, app, user_agent):
+        config = app.config
+        self.app = app
+        self.user_agent = user_agent
+        self.batch_size = int(config["DELIVERY_BATCH_SIZE"])
+        self.concurrency = int(config["DELIVERY_CONCURRENCY"])
+        self.host_concurrency = int(config["DELIVERY_PER_HOST"])
+        self.max_attempts = int(config["DELIVERY_MAX_ATTEMPTS"])
+        self.timeout = aiohttp.ClientTimeout(
+            total=POST_TIMEOUT,
+            sock_connect=float(config["HTTP_CONNECT_TIMEOUT"]),
+            sock_read=float(config["HTTP_READ_TIMEOUT"]),
+        )
+        # payload id: Payload
+        self.payloads = LRUCache(maxsize=PAYLOADS_CACHE)
+        self.in_flight = set()
+        self.results = []
+        self.stopping = False
+        # queries, one at a time, and RSA signatures, off the loop so the posts in flight go on meanwhile,
+        # OpenSSL releases the GIL while signing
+        self.database = ThreadPoolExecutor(max_workers=1)
+        self.signers = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+    def stop(self):
+        self.stopping = True
+
+    async def db_call(self, func, *args):
+        def call():
+            with self.app.app_context():
+                return func(*args)
+
+        return await asyncio.get_event_loop().run_in_executor(self.database, call)
+
+    async def claim(self, limit):
+        """
+        :return: the deliveries claimed, as (id, payload_id, inbox, attempts, Payload)
+        """
+        deliveries, new_payloads = await self.db_call(claim_deliveries, limit, LEASE, list(self.payloads.keys()))
+        payloads = {d[1]: self.payloads.get(d[1]) for d in deliveries}
+        for payload_id, loaded in new_payloads.items():
+            payloads[payload_id] = self.payloads[payload_id] = load_payload(*loaded)
+        # a payload deleted meanwhile with its actor has no deliveries left
+        return [delivery + (payloads[delivery[1]],) for delivery in deliveries if payloads[delivery[1]]]
+
+    async def deliver(self, session, delivery_id, payload_id, inbox, attempts, payload):
+        start = time.perf_counter()
+        status = error = None
+        try:
+            headers = await asyncio.get_event_loop().run_in_executor(
+                self.signers, signed_headers, payload, inbox, self.user_agent
+            )
+            async with session.post(inbox, data=payload.body, headers=headers, allow_redirects=False) as resp:
+                status = resp.status
+                # read for the connection to be reused
+                await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            error = f"{e.__class__.__name__}: {e}"
+        metrics.federation_delivery_seconds.observe(time.perf_counter() - start)
+        metrics.delivery_outcome(inbox, outcome(status))
+        self.results.append(DeliveryResult(delivery_id, payload_id, attempts, status, error))
+
+    async def report(self):
+        if not self.results:
+            return
+        results, self.results = self.results, []
+        await self.db_call(report_deliveries, results, self.max_attempts)
+
+    async def report_periodically(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            try:
+                await self.report()
+            except Exception:
+                # posted again once their lease is over
+                self.app.logger.exception("failed to report the deliveries")
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.host_concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=self.timeout) as session:
+            reporter = asyncio.ensure_future(self.report_periodically())
+            while not self.stopping:
+                if len(self.in_flight) >= self.concurrency:
+                    await asyncio.wait(self.in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                limit = min(self.batch_size, self.concurrency - len(self.in_flight))
+                try:
+                    batch = await self.claim(limit)
+                except Exception:
+                    self.app.logger.exception("failed to claim deliveries")
+                    await asyncio.sleep(CLAIM_RETRY)
+                    continue
+                for delivery in batch:
+                    task = asyncio.ensure_future(self.deliver(session, *delivery))
+                    self.in_flight.add(task)
+                    task.add_done_callback(self.in_flight.discard)
+                if len(batch) < limit:
+                    # nothing more due for now
+                    await asyncio.sleep(POLL_INTERVAL)
+            if self.in_flight:
+                await asyncio.wait(self.in_flight)
+            reporter.cancel()
+        await self.report()
+
+
+def main():
+    app = create_app(register_blueprints=False)
+    if not app.config["DELIVERY_WORKER"]:
+        raise SystemExit("DELIVERY_WORKER is not enabled, the activities are posted by the Celery workers")
+    port = int(app.config["METRICS_WORKER_PORT"] or 0)
+    if port:
+        start_http_server(port)
+        print(f" * Metrics exporter listening on port {port}")
+    with app.app_context():
+        user_agent = ap.get_backend().user_agent()
+
+    worker = Worker(app, user_agent)
+    loop = asyncio.get_event_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    print(f" * Delivery worker, {worker.concurrency} posts in flight, {worker.host_concurrency} per remote host")
+    loop.run_until_complete(worker.run())
+    worker.database.shutdown()
+    worker.signers.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -55,10 +55,13 @@ def get_licences():
     ]
 
 
-class SoundUploadForm(Form):
+class SoundMetadatasForm(Form):
+    """
+    Track fields of an upload, the file comes with SoundUploadForm or a resumable upload
+    """
+
     title = StringField(lazy_gettext("Title"), [Length(max=255)])
     description = TextAreaField(lazy_gettext("Description"))
-    file = FileField(lazy_gettext("File"), [FileRequired(), FileAllowed(AUDIO)])
     album = QuerySelectField(
         query_factory=get_albums,
         allow_blank=True,
@@ -76,6 +79,10 @@ class SoundUploadForm(Form):
             if field.data is True and form.album.data.private is False:
                 raise ValidationError(lazy_gettext("Cannot put private sound in public album"))
 
+
+class SoundUploadForm(SoundMetadatasForm):
+    file = FileField(lazy_gettext("File"), [FileRequired(), FileAllowed(AUDIO)])
+
     submit = SubmitField(lazy_gettext("Upload"))
 
 
@@ -0,0 +1,49 @@
+"""Add User denormalized followers, following, tracks and albums counters
+
+Revision ID: 5c1f3b9d2e47
+Revises: f1993296be9e
+Create Date: 2026-10-18 09:12:31.402817
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "5c1f3b9d2e47"
+down_revision = "f1993296be9e"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+
+
+def upgrade():
+    op.add_column("user", sa.Column("followers_count", sa.Integer(), server_default="0", nullable=False))
+    op.add_column("user", sa.Column("following_count", sa.Integer(), server_default="0", nullable=False))
+    op.add_column("user", sa.Column("public_tracks_count", sa.Integer(), server_default="0", nullable=False))
+    op.add_column("user", sa.Column("public_albums_count", sa.Integer(), server_default="0", nullable=False))
+    # same counts as `flask users rebuild-counters`, the counters are then kept up to date by the app
+    op.execute(
+        """
+        UPDATE "user" SET
+            followers_count = (
+                SELECT count(followers.id) FROM followers, actor
+                WHERE followers.target_id = actor.id AND actor.user_id = "user".id
+            ),
+            following_count = (
+                SELECT count(followers.id) FROM followers, actor
+                WHERE followers.actor_id = actor.id AND actor.user_id = "user".id
+            ),
+            public_tracks_count = (
+                SELECT count(sound.id) FROM sound
+                WHERE sound.user_id = "user".id AND sound.private IS false AND sound.transcode_state = 2
+            ),
+            public_albums_count = (
+                SELECT count(album.id) FROM album WHERE album.user_id = "user".id AND album.private IS false
+            )
+        """
+    )
+
+
+def downgrade():
+    op.drop_column("user", "public_albums_count")
+    op.drop_column("user", "public_tracks_count")
+    op.drop_column("user", "following_count")
+    op.drop_column("user", "followers_count")
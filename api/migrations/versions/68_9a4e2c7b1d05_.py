@@ -0,0 +1,22 @@
+"""Add SoundInfo compact waveform peaks
+
+Revision ID: 9a4e2c7b1d05
+Revises: 5c1f3b9d2e47
+Create Date: 2026-10-18 10:02:47.118230
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "9a4e2c7b1d05"
+down_revision = "5c1f3b9d2e47"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+
+
+def upgrade():
+    op.add_column("sound_info", sa.Column("waveform_peaks", sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("sound_info", "waveform_peaks")
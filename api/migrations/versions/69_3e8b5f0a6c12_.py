@@ -0,0 +1,32 @@
+"""Add SoundWaveform levels pyramid
+
+Revision ID: 3e8b5f0a6c12
+Revises: 9a4e2c7b1d05
+Create Date: 2026-10-18 11:24:09.530416
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "3e8b5f0a6c12"
+down_revision = "9a4e2c7b1d05"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+
+
+def upgrade():
+    op.create_table(
+        "sound_waveform",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("level", sa.Integer(), nullable=False),
+        sa.Column("peaks", sa.LargeBinary(), nullable=False),
+        sa.Column("etag", sa.String(length=64), nullable=False),
+        sa.Column("sound_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["sound_id"], ["sound.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("sound_id", "level", name="unique_sound_waveform_level"),
+    )
+
+
+def downgrade():
+    op.drop_table("sound_waveform")
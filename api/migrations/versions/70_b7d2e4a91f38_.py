@@ -0,0 +1,23 @@
+"""Index Sound and Album flake_id for keyset pagination
+
+Revision ID: b7d2e4a91f38
+Revises: 3e8b5f0a6c12
+Create Date: 2026-10-18 13:05:51.774193
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "b7d2e4a91f38"
+down_revision = "3e8b5f0a6c12"
+
+from alembic import op  # noqa: E402
+
+
+def upgrade():
+    op.create_index(op.f("ix_sound_flake_id"), "sound", ["flake_id"], unique=False)
+    op.create_index(op.f("ix_album_flake_id"), "album", ["flake_id"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_album_flake_id"), table_name="album")
+    op.drop_index(op.f("ix_sound_flake_id"), table_name="sound")
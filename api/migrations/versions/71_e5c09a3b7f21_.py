@@ -0,0 +1,28 @@
+"""Add Activity object_type and is_public extracted from the payload
+
+Revision ID: e5c09a3b7f21
+Revises: b7d2e4a91f38
+Create Date: 2026-10-18 13:48:12.603981
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "e5c09a3b7f21"
+down_revision = "b7d2e4a91f38"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+
+
+def upgrade():
+    op.add_column("activity", sa.Column("object_type", sa.String(length=100), nullable=True))
+    op.add_column("activity", sa.Column("is_public", sa.Boolean(), server_default="false", nullable=False))
+    op.create_index(
+        "ix_activity_timeline", "activity", ["type", "object_type", "is_public", "creation_date"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("ix_activity_timeline", table_name="activity")
+    op.drop_column("activity", "is_public")
+    op.drop_column("activity", "object_type")
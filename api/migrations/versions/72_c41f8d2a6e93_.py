@@ -0,0 +1,36 @@
+"""Add home_timeline, materialized users home timelines
+
+Revision ID: c41f8d2a6e93
+Revises: e5c09a3b7f21
+Create Date: 2026-10-18 14:21:37.118402
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "c41f8d2a6e93"
+down_revision = "e5c09a3b7f21"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+from sqlalchemy.dialects import postgresql  # noqa: E402
+
+
+def upgrade():
+    op.create_table(
+        "home_timeline",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("sound_id", sa.Integer(), nullable=False),
+        sa.Column("flake_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("creation_date", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["sound_id"], ["sound.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("user_id", "sound_id", name="unique_home_timeline_sound"),
+    )
+    op.create_index("ix_home_timeline_user_flake_id", "home_timeline", ["user_id", "flake_id"], unique=False)
+
+
+def downgrade():
+    op.drop_index("ix_home_timeline_user_flake_id", table_name="home_timeline")
+    op.drop_table("home_timeline")
@@ -0,0 +1,35 @@
+"""Add sound_rendition, renditions ladder of the tracks
+
+Revision ID: 9a3e1f6c2b48
+Revises: c41f8d2a6e93
+Create Date: 2026-10-18 16:02:11.507318
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "9a3e1f6c2b48"
+down_revision = "c41f8d2a6e93"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+
+
+def upgrade():
+    op.create_table(
+        "sound_rendition",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(length=20), nullable=False),
+        sa.Column("codec", sa.String(length=20), nullable=False),
+        sa.Column("bitrate", sa.Integer(), nullable=False),
+        sa.Column("mime_type", sa.String(length=100), nullable=False),
+        sa.Column("filename", sa.String(length=255), nullable=False),
+        sa.Column("file_size", sa.BigInteger(), nullable=True),
+        sa.Column("sound_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["sound_id"], ["sound.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("sound_id", "kind", name="unique_sound_rendition_kind"),
+    )
+
+
+def downgrade():
+    op.drop_table("sound_rendition")
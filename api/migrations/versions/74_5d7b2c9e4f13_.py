@@ -0,0 +1,38 @@
+"""Add sound_blob, content addressed audio files
+
+Revision ID: 5d7b2c9e4f13
+Revises: 9a3e1f6c2b48
+Create Date: 2026-10-18 17:11:45.230841
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "5d7b2c9e4f13"
+down_revision = "9a3e1f6c2b48"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+
+
+def upgrade():
+    op.create_table(
+        "sound_blob",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("filename", sa.String(length=255), nullable=False),
+        sa.Column("file_size", sa.BigInteger(), nullable=True),
+        sa.Column("refcount", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("created", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("sha256"),
+    )
+    op.add_column("sound", sa.Column("blob_id", sa.Integer(), nullable=True))
+    op.create_index(op.f("ix_sound_blob_id"), "sound", ["blob_id"], unique=False)
+    op.create_foreign_key(None, "sound", "sound_blob", ["blob_id"], ["id"])
+
+
+def downgrade():
+    op.drop_constraint("sound_blob_id_fkey", "sound", type_="foreignkey")
+    op.drop_index(op.f("ix_sound_blob_id"), table_name="sound")
+    op.drop_column("sound", "blob_id")
+    op.drop_table("sound_blob")
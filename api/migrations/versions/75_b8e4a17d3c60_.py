@@ -0,0 +1,38 @@
+"""Add sound_upload, resumable uploads
+
+Revision ID: b8e4a17d3c60
+Revises: 5d7b2c9e4f13
+Create Date: 2026-10-18 18:34:02.691250
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "b8e4a17d3c60"
+down_revision = "5d7b2c9e4f13"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+from sqlalchemy.dialects import postgresql  # noqa: E402
+
+
+def upgrade():
+    op.create_table(
+        "sound_upload",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("upload_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("filename", sa.String(length=255), nullable=False),
+        sa.Column("filename_orig", sa.String(length=255), nullable=False),
+        sa.Column("length", sa.BigInteger(), nullable=False),
+        sa.Column("metadatas", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column("created", sa.DateTime(), nullable=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("sound_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["sound_id"], ["sound.id"], ondelete="SET NULL"),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("upload_id"),
+    )
+
+
+def downgrade():
+    op.drop_table("sound_upload")
@@ -0,0 +1,24 @@
+"""Add sound.processing_stage, checkpoint of the upload workflow
+
+Revision ID: e2c61f0a9d57
+Revises: b8e4a17d3c60
+Create Date: 2026-10-18 19:02:13.518204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "e2c61f0a9d57"
+down_revision = "b8e4a17d3c60"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+
+
+def upgrade():
+    op.add_column("sound", sa.Column("processing_stage", sa.String(length=20), nullable=True))
+    # tracks already processed went through the whole workflow
+    op.execute("UPDATE sound SET processing_stage = 'notified' WHERE transcode_state = 2")
+
+
+def downgrade():
+    op.drop_column("sound", "processing_stage")
@@ -0,0 +1,36 @@
+"""Add sound_timing, time spent in the upload workflow stages
+
+Revision ID: 3f8d0b6a1c25
+Revises: e2c61f0a9d57
+Create Date: 2026-10-18 19:48:37.106529
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "3f8d0b6a1c25"
+down_revision = "e2c61f0a9d57"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+
+
+def upgrade():
+    op.create_table(
+        "sound_timing",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("stage", sa.String(length=20), nullable=False),
+        sa.Column("elapsed", sa.Float(), nullable=False),
+        sa.Column("input_size", sa.BigInteger(), nullable=True),
+        sa.Column("duration", sa.Float(), nullable=True),
+        sa.Column("success", sa.Boolean(), nullable=False),
+        sa.Column("created", sa.DateTime(), nullable=True),
+        sa.Column("sound_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["sound_id"], ["sound.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_sound_timing_sound_id"), "sound_timing", ["sound_id"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_sound_timing_sound_id"), table_name="sound_timing")
+    op.drop_table("sound_timing")
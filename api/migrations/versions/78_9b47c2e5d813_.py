@@ -0,0 +1,50 @@
+"""Add delivery and delivery_payload, outgoing activities queued for the delivery worker
+
+Revision ID: 9b47c2e5d813
+Revises: 3f8d0b6a1c25
+Create Date: 2026-10-18 21:12:04.553817
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "9b47c2e5d813"
+down_revision = "3f8d0b6a1c25"
+
+from alembic import op  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+import sqlalchemy_utils  # noqa: E402
+
+
+def upgrade():
+    op.create_table(
+        "delivery_payload",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("actor_id", sa.Integer(), nullable=False),
+        sa.Column("body", sa.UnicodeText(), nullable=False),
+        sa.Column("creation_date", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["actor_id"], ["actor.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "delivery",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("payload_id", sa.Integer(), nullable=False),
+        sa.Column("inbox", sqlalchemy_utils.types.url.URLType(), nullable=False),
+        sa.Column("state", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("next_attempt", sa.DateTime(), nullable=False),
+        sa.Column("last_status", sa.Integer(), nullable=True),
+        sa.Column("last_error", sa.String(length=255), nullable=True),
+        sa.Column("creation_date", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["payload_id"], ["delivery_payload.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_delivery_payload_id"), "delivery", ["payload_id"], unique=False)
+    op.create_index("ix_delivery_due", "delivery", ["state", "next_attempt"], unique=False)
+
+
+def downgrade():
+    op.drop_index("ix_delivery_due", table_name="delivery")
+    op.drop_index(op.f("ix_delivery_payload_id"), table_name="delivery")
+    op.drop_table("delivery")
+    op.drop_table("delivery_payload")
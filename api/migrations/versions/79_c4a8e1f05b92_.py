@@ -0,0 +1,27 @@
+"""Add Activity id to the ix_activity_timeline index, the public timeline keyset
+
+Revision ID: c4a8e1f05b92
+Revises: 9b47c2e5d813
+Create Date: 2026-10-18 22:04:37.118204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "c4a8e1f05b92"
+down_revision = "9b47c2e5d813"
+
+from alembic import op  # noqa: E402
+
+
+def upgrade():
+    op.drop_index("ix_activity_timeline", table_name="activity")
+    op.create_index(
+        "ix_activity_timeline", "activity", ["type", "object_type", "is_public", "creation_date", "id"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("ix_activity_timeline", table_name="activity")
+    op.create_index(
+        "ix_activity_timeline", "activity", ["type", "object_type", "is_public", "creation_date"], unique=False
+    )
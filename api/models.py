@@ -1,18 +1,21 @@
 import datetime
 import os
+import shutil
 
 from flask import current_app, url_for
 from flask_security import SQLAlchemyUserDatastore, UserMixin, RoleMixin
 from flask_security.utils import verify_password
 from flask_sqlalchemy import SQLAlchemy
 from slugify import slugify
-from sqlalchemy import event, UniqueConstraint, PrimaryKeyConstraint, and_
+from sqlalchemy import event, UniqueConstraint, PrimaryKeyConstraint, Index, and_, inspect, select
 from sqlalchemy.ext.hybrid import Comparator, hybrid_property
+from sqlalchemy.orm import Session, object_session
 from sqlalchemy.sql import func
 from sqlalchemy_searchable import make_searchable
 from sqlalchemy_utils.types.choice import ChoiceType
 from sqlalchemy_utils.types.url import URLType
 from little_boxes.key import Key as LittleBoxesKey
+from utils import json_cache
 from activitypub.utils import ap_url
 from activitypub.vars import DEFAULT_CTX
 from sqlalchemy.dialects.postgresql import UUID, JSONB
@@ -114,6 +117,14 @@ class User(db.Model, UserMixin):
 
     local = db.Column(db.Boolean(), default=True)
 
+    # Denormalized counters, kept up to date in the same transaction by the
+    # Follower, Sound and Album events below, `flask users rebuild-counters` recompute them
+    followers_count = db.Column(db.Integer(), nullable=False, default=0, server_default="0")
+    following_count = db.Column(db.Integer(), nullable=False, default=0, server_default="0")
+    # Only public and fully processed tracks, public albums
+    public_tracks_count = db.Column(db.Integer(), nullable=False, default=0, server_default="0")
+    public_albums_count = db.Column(db.Integer(), nullable=False, default=0, server_default="0")
+
     # Relations
 
     roles = db.relationship(
@@ -291,7 +302,11 @@ class SoundInfo(db.Model):
     rate = db.Column(db.String(255), nullable=True)
     channels = db.Column(db.Integer, nullable=True)
     codec = db.Column(db.String(255), nullable=True)
-    waveform = db.Column(db.Text, nullable=True)
+    # legacy JSON waveform, converted to waveform_peaks by db-datas 008-convert-waveforms
+    waveform = db.deferred(db.Column(db.Text, nullable=True))
+    # int8 normalized peaks at full resolution, see utils.various.waveform_peaks()
+    # served by levels from SoundWaveform, never needed when serializing the track
+    waveform_peaks = db.deferred(db.Column(db.LargeBinary, nullable=True))
     waveform_error = db.Column(db.Boolean, default=False)
     bitrate = db.Column(db.Integer, nullable=True)
     bitrate_mode = db.Column(db.String(10), nullable=True)
@@ -305,6 +320,162 @@ class SoundInfo(db.Model):
     sound_id = db.Column(db.Integer(), db.ForeignKey("sound.id"), nullable=False)
 
 
+class SoundWaveform(db.Model):
+    """
+    Precomputed level of the waveform peaks pyramid, level 0 is the overview,
+    each next level has twice more points, the last one is the full resolution.
+    """
+
+    __tablename__ = "sound_waveform"
+
+    id = db.Column(db.Integer, primary_key=True)
+    level = db.Column(db.Integer, nullable=False)
+    # int8 min/max pairs, same encoding as SoundInfo.waveform_peaks
+    peaks = db.Column(db.LargeBinary, nullable=False)
+    etag = db.Column(db.String(64), nullable=False)
+
+    sound_id = db.Column(db.Integer(), db.ForeignKey("sound.id"), nullable=False)
+    __table_args__ = (UniqueConstraint("sound_id", "level", name="unique_sound_waveform_level"),)
+
+
+class SoundRendition(db.Model):
+    """
+    Encoded version of a track from the renditions ladder, see transcoding_utils.rendition_ladder().
+    filename is relative to the user uploads directory, the playlist for HLS.
+    """
+
+    __tablename__ = "sound_rendition"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    codec = db.Column(db.String(20), nullable=False)
+    # bits per second
+    bitrate = db.Column(db.Integer, nullable=False)
+    mime_type = db.Column(db.String(100), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    # bytes, all the segments for HLS
+    file_size = db.Column(db.BigInteger)
+
+    sound_id = db.Column(db.Integer(), db.ForeignKey("sound.id"), nullable=False)
+    __table_args__ = (UniqueConstraint("sound_id", "kind", name="unique_sound_rendition_kind"),)
+
+
+class SoundTiming(db.Model):
+    """
+    Time spent by a track in a stage of the upload workflow, one row per run of the stage,
+    see utils.metrics.record_stage().
+    """
+
+    __tablename__ = "sound_timing"
+
+    id = db.Column(db.Integer, primary_key=True)
+    stage = db.Column(db.String(20), nullable=False)
+    # seconds
+    elapsed = db.Column(db.Float, nullable=False)
+    # bytes of the stage input and seconds of audio, if known
+    input_size = db.Column(db.BigInteger, nullable=True)
+    duration = db.Column(db.Float, nullable=True)
+    success = db.Column(db.Boolean(), default=True, nullable=False)
+    created = db.Column(db.DateTime(timezone=False), default=datetime.datetime.utcnow)
+
+    sound_id = db.Column(db.Integer(), db.ForeignKey("sound.id"), nullable=False, index=True)
+
+
+def blob_dirname(filename):
+    """
+    Directory of a blob, in UPLOADED_SOUNDS_DEST, fanned out on the first hash characters
+    """
+    return os.path.join("blobs", filename[:2])
+
+
+class SoundBlob(db.Model):
+    """
+    Audio file stored once by SHA-256 of its content, whoever uploaded or federated it.
+    The transcoded file and the renditions are stored next to it, and shared too.
+    refcount is the number of tracks referencing it, see utils.blobs.
+    """
+
+    __tablename__ = "sound_blob"
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    # sha256 and the extension of the first file stored
+    filename = db.Column(db.String(255), nullable=False)
+    file_size = db.Column(db.BigInteger)
+    refcount = db.Column(db.Integer, nullable=False, server_default="0")
+    created = db.Column(db.DateTime(timezone=False), default=datetime.datetime.utcnow)
+
+    def path(self):
+        return os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], blob_dirname(self.filename), self.filename)
+
+
+def on_commit(session, callback, *args):
+    """
+    Run callback(*args) once the transaction of the session is committed, dropped if it is rolled back.
+    For the files changes following rows changed in a flush, which can still be rolled back.
+    """
+    session.info.setdefault("on_commit", []).append((callback, args))
+
+
+@event.listens_for(Session, "after_commit")
+def run_on_commit(session):
+    for callback, args in session.info.pop("on_commit", []):
+        try:
+            callback(*args)
+        except OSError:
+            current_app.logger.exception(f"failed to run {callback.__name__} on commit")
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_on_commit(session):
+    session.info.pop("on_commit", None)
+
+
+def delete_blob_files(filename):
+    """
+    Delete the file of a blob, the transcoded file and the renditions made from it
+    """
+    directory = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], blob_dirname(filename))
+    stem, _ = os.path.splitext(filename)
+    for name in {filename, f"{stem}.mp3"}:
+        fname = os.path.join(directory, name)
+        if os.path.isfile(fname):
+            os.unlink(fname)
+    dname = os.path.join(directory, f"{stem}.renditions")
+    if os.path.isdir(dname):
+        shutil.rmtree(dname)
+
+
+class SoundUpload(db.Model):
+    """
+    Resumable upload of a track, the bytes received so far are in filename,
+    the track is created with metadatas once complete, see controllers/api/tracks.py
+    """
+
+    __tablename__ = "sound_upload"
+
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(UUID(as_uuid=True), nullable=False, unique=True, default=uuid.uuid4)
+    # in the user uploads directory
+    filename = db.Column(db.String(255), nullable=False)
+    filename_orig = db.Column(db.String(255), nullable=False)
+    # bytes
+    length = db.Column(db.BigInteger, nullable=False)
+    # fields of the SoundMetadatasForm
+    metadatas = db.Column(JSONB, nullable=False)
+    created = db.Column(db.DateTime(timezone=False), default=datetime.datetime.utcnow)
+
+    user_id = db.Column(db.Integer(), db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    # set once complete
+    sound_id = db.Column(db.Integer(), db.ForeignKey("sound.id", ondelete="SET NULL"), nullable=True)
+
+    user = db.relationship("User")
+    sound = db.relationship("Sound")
+
+    def path(self):
+        return os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], self.user.slug, self.filename)
+
+
 # Table for association between Sound and SoundTag
 sound_tags = db.Table(
     "sound_tags",
@@ -334,6 +505,15 @@ class Sound(db.Model):
     TRANSCODE_DONE = 2
     TRANSCODE_ERROR = 3
 
+    # Checkpoints of upload_workflow, in order, processing_stage is the last one completed
+    STAGE_FETCHED = "fetched"
+    STAGE_METADATAS = "metadatas"
+    STAGE_WAVEFORM = "waveform"
+    STAGE_TRANSCODED = "transcoded"
+    STAGE_FEDERATED = "federated"
+    STAGE_NOTIFIED = "notified"
+    STAGES = [STAGE_FETCHED, STAGE_METADATAS, STAGE_WAVEFORM, STAGE_TRANSCODED, STAGE_FEDERATED, STAGE_NOTIFIED]
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=True)
     uploaded = db.Column(db.DateTime(timezone=False), default=datetime.datetime.utcnow)
@@ -359,19 +539,26 @@ class Sound(db.Model):
     transcode_needed = db.Column(db.Boolean(), default=False, nullable=True)
     transcode_state = db.Column(db.Integer(), default=0, nullable=False)
     # 0 nothing / default / waiting, 1 processing, 2 done, 3 error
+    processing_stage = db.Column(db.String(20), nullable=True)
+    # null nothing done yet, else one of STAGES
 
     # both are bytes
     file_size = db.Column(db.BigInteger)
     transcode_file_size = db.Column(db.BigInteger)
 
-    flake_id = db.Column(UUID(as_uuid=True), unique=False, nullable=True)
+    flake_id = db.Column(UUID(as_uuid=True), unique=False, nullable=True, index=True)
 
     # relations
     user_id = db.Column(db.Integer(), db.ForeignKey("user.id"), nullable=False)
     album_id = db.Column(db.Integer(), db.ForeignKey("album.id"), nullable=True)
     activity_id = db.Column(db.Integer(), db.ForeignKey("activity.id"), nullable=True)
+    # content addressed audio file, null for the tracks stored before the blobs
+    blob_id = db.Column(db.Integer(), db.ForeignKey("sound_blob.id"), nullable=True, index=True)
 
     sound_infos = db.relationship("SoundInfo", backref="sound_info", lazy="dynamic", cascade="delete")
+    waveforms = db.relationship("SoundWaveform", lazy="dynamic", cascade="delete")
+    renditions = db.relationship("SoundRendition", lazy="dynamic", cascade="delete", order_by="SoundRendition.id")
+    timings = db.relationship("SoundTiming", lazy="dynamic", cascade="delete", order_by="SoundTiming.id")
     activity = db.relationship("Activity")
 
     __mapper_args__ = {"order_by": uploaded.desc()}
@@ -380,10 +567,24 @@ class Sound(db.Model):
         el = datetime.datetime.utcnow() - self.uploaded
         return el.total_seconds()
 
-    def path_sound(self, orig=False):
-        username = self.user.slug
+    def uploads_dirname(self):
+        if self.blob_id:
+            return blob_dirname(self.filename)
         if self.remote_uri:
-            username = f"remote_{self.user.slug}"
+            return f"remote_{self.user.slug}"
+        return self.user.slug
+
+    def renditions_dirname(self):
+        """
+        Directory of the renditions, in the user uploads directory
+        """
+        return "{0}.renditions".format(os.path.splitext(self.filename)[0])
+
+    def path_rendition(self, rendition):
+        return os.path.join(self.uploads_dirname(), rendition.filename)
+
+    def path_sound(self, orig=False):
+        username = self.uploads_dirname()
         filename = self.filename
         if self.transcode_needed and self.transcode_state == self.TRANSCODE_DONE and not orig:
             filename = self.filename_transcoded
@@ -413,6 +614,21 @@ class Sound(db.Model):
     def processing_done(self):
         return self.transcode_state == self.TRANSCODE_DONE
 
+    def stage_done(self, stage):
+        """
+        If upload_workflow already went through stage
+        """
+        if not self.processing_stage:
+            return False
+        return self.STAGES.index(self.processing_stage) >= self.STAGES.index(stage)
+
+    def checkpoint(self, stage):
+        """
+        Record stage as completed, never going backward, doesn't commit
+        """
+        if not self.stage_done(stage):
+            self.processing_stage = stage
+
     def is_ready(self):
         infos = self.sound_infos.first()
         if not infos:
@@ -422,22 +638,31 @@ class Sound(db.Model):
     # Delete files file when COMMIT DELETE
     def __commit_delete__(self):
         print("COMMIT DELETE: Deleting files")
-        path_sound = self.path_sound(orig=True)
-        if path_sound:
-            fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], path_sound)
-            if os.path.isfile(fname):
-                os.unlink(fname)
-            else:
-                print(f"!!! COMMIT DELETE SOUND cannot delete orig file {fname}")
-
-        if self.transcode_needed:
-            path_sound = self.path_sound(orig=False)
+        # the files of a blob are shared, deleted with its last track by release_sound_blob()
+        if not self.blob_id:
+            path_sound = self.path_sound(orig=True)
             if path_sound:
                 fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], path_sound)
                 if os.path.isfile(fname):
                     os.unlink(fname)
                 else:
-                    print(f"!!! COMMIT DELETE SOUND cannot delete transcoded file {fname}")
+                    print(f"!!! COMMIT DELETE SOUND cannot delete orig file {fname}")
+
+            if self.transcode_needed:
+                path_sound = self.path_sound(orig=False)
+                if path_sound:
+                    fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], path_sound)
+                    if os.path.isfile(fname):
+                        os.unlink(fname)
+                    else:
+                        print(f"!!! COMMIT DELETE SOUND cannot delete transcoded file {fname}")
+
+            if self.filename:
+                dname = os.path.join(
+                    current_app.config["UPLOADED_SOUNDS_DEST"], self.uploads_dirname(), self.renditions_dirname()
+                )
+                if os.path.isdir(dname):
+                    shutil.rmtree(dname)
 
         if self.artwork_filename:
             fname = os.path.join(current_app.config["UPLOADED_ARTWORKSOUNDS_DEST"], self.path_artwork())
@@ -464,7 +689,7 @@ class Album(db.Model):
 
     artwork_filename = db.Column(db.String(255), unique=False, nullable=True)
 
-    flake_id = db.Column(UUID(as_uuid=True), unique=False, nullable=True)
+    flake_id = db.Column(UUID(as_uuid=True), unique=False, nullable=True, index=True)
 
     # relations
     user_id = db.Column(db.Integer(), db.ForeignKey("user.id"), nullable=False)
@@ -514,6 +739,25 @@ def generate_sound_flakeid(mapper, connection, target):
         connection.execute(Sound.__table__.update().where(Sound.__table__.c.id == target.id).values(flake_id=flake_id))
 
 
+@event.listens_for(Sound, "after_delete")
+def release_sound_blob(mapper, connection, target):
+    """
+    Drop the reference of the track on its blob, the last one deletes the blob and its files.
+    The blob row stays locked until the commit, a concurrent upload of the same audio waits for it,
+    the files are deleted once committed.
+    """
+    if not target.blob_id:
+        return
+    blobs = SoundBlob.__table__
+    connection.execute(blobs.update().where(blobs.c.id == target.blob_id).values(refcount=blobs.c.refcount - 1))
+    deleted = connection.execute(
+        blobs.delete().where(and_(blobs.c.id == target.blob_id, blobs.c.refcount <= 0)).returning(blobs.c.filename)
+    ).first()
+    if deleted:
+        print(f"COMMIT DELETE: Deleting blob {deleted.filename}")
+        on_commit(object_session(target), delete_blob_files, deleted.filename)
+
+
 @event.listens_for(Sound, "after_delete")
 @event.listens_for(Album, "after_delete")
 def delete_files(mapper, connection, target):
@@ -542,6 +786,105 @@ def update_user_actor(mapper, connection, target):
     )
 
 
+# #### Users counters ####
+
+
+def bump_user_counter(connection, user_id, counter, delta):
+    """
+    Atomically add delta to one of the User denormalized counters
+    user_id can also be a scalar subquery
+    """
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id == user_id).values({counter: users.c[counter] + delta}))
+
+
+def attribute_was_is(target, attribute):
+    """
+    :return: (value before the flush, value after) of an attribute
+    """
+    history = inspect(target).attrs[attribute].history
+    now = getattr(target, attribute)
+    return (history.deleted[0] if history.deleted else now), now
+
+
+def is_public_track(private, transcode_state):
+    return private is False and transcode_state == Sound.TRANSCODE_DONE
+
+
+@event.listens_for(Sound, "after_insert")
+def count_inserted_sound(mapper, connection, target):
+    if is_public_track(target.private, target.transcode_state):
+        bump_user_counter(connection, target.user_id, "public_tracks_count", 1)
+
+
+@event.listens_for(Sound, "after_update")
+def count_updated_sound(mapper, connection, target):
+    private_was, private_is = attribute_was_is(target, "private")
+    state_was, state_is = attribute_was_is(target, "transcode_state")
+    delta = int(is_public_track(private_is, state_is)) - int(is_public_track(private_was, state_was))
+    if delta:
+        bump_user_counter(connection, target.user_id, "public_tracks_count", delta)
+
+
+@event.listens_for(Sound, "after_delete")
+def count_deleted_sound(mapper, connection, target):
+    private_was, _ = attribute_was_is(target, "private")
+    state_was, _ = attribute_was_is(target, "transcode_state")
+    if is_public_track(private_was, state_was):
+        bump_user_counter(connection, target.user_id, "public_tracks_count", -1)
+
+
+@event.listens_for(Album, "after_insert")
+def count_inserted_album(mapper, connection, target):
+    if target.private is False:
+        bump_user_counter(connection, target.user_id, "public_albums_count", 1)
+
+
+@event.listens_for(Album, "after_update")
+def count_updated_album(mapper, connection, target):
+    private_was, private_is = attribute_was_is(target, "private")
+    delta = int(private_is is False) - int(private_was is False)
+    if delta:
+        bump_user_counter(connection, target.user_id, "public_albums_count", delta)
+
+
+@event.listens_for(Album, "after_delete")
+def count_deleted_album(mapper, connection, target):
+    private_was, _ = attribute_was_is(target, "private")
+    if private_was is False:
+        bump_user_counter(connection, target.user_id, "public_albums_count", -1)
+
+
+# #### Serialization cache ####
+# cached entries are versioned on updated (and transcode_state for tracks, count and last update of
+# their tracks for albums), this also catches what doesn't bump them in this process: tags and SoundInfo
+
+
+@event.listens_for(Sound, "after_update")
+@event.listens_for(Sound, "after_delete")
+def invalidate_sound_json(mapper, connection, target):
+    json_cache.invalidate("track", target.id)
+    for album_id in set(attribute_was_is(target, "album_id")):
+        if album_id:
+            json_cache.invalidate("album", album_id)
+
+
+@event.listens_for(Album, "after_update")
+@event.listens_for(Album, "after_delete")
+def invalidate_album_json(mapper, connection, target):
+    json_cache.invalidate("album", target.id)
+
+
+@event.listens_for(SoundInfo, "after_insert")
+@event.listens_for(SoundInfo, "after_update")
+@event.listens_for(SoundInfo, "after_delete")
+def invalidate_sound_info_json(mapper, connection, target):
+    json_cache.invalidate("track", target.sound_id)
+    album_id = connection.execute(select([Sound.album_id]).where(Sound.id == target.sound_id)).scalar()
+    if album_id:
+        json_cache.invalidate("album", album_id)
+
+
 # #### Federation ####
 
 ACTOR_TYPE_CHOICES = [
@@ -584,6 +927,22 @@ class Follower(db.Model):
         return f
 
 
+def actor_user_id(actor_id):
+    return select([Actor.__table__.c.user_id]).where(Actor.__table__.c.id == actor_id).as_scalar()
+
+
+@event.listens_for(Follower, "after_insert")
+def count_inserted_follower(mapper, connection, target):
+    bump_user_counter(connection, actor_user_id(target.target_id), "followers_count", 1)
+    bump_user_counter(connection, actor_user_id(target.actor_id), "following_count", 1)
+
+
+@event.listens_for(Follower, "after_delete")
+def count_deleted_follower(mapper, connection, target):
+    bump_user_counter(connection, actor_user_id(target.target_id), "followers_count", -1)
+    bump_user_counter(connection, actor_user_id(target.actor_id), "following_count", -1)
+
+
 class Actor(db.Model):
     __tablename__ = "actor"
     ap_type = "Actor"
@@ -659,11 +1018,11 @@ class Actor(db.Model):
             db.session.commit()
 
     def is_followed_by(self, target):
-        print(f"is {self.preferred_username} followed by {target.preferred_username} ?")
+        current_app.logger.debug(f"is {self.preferred_username} followed by {target.preferred_username} ?")
         return self.followers.filter(Follower.actor_id == target.id).first()
 
     def is_following(self, target):
-        print(f"is {self.preferred_username} following {target.preferred_username} ?")
+        current_app.logger.debug(f"is {self.preferred_username} following {target.preferred_username} ?")
         return self.followings.filter(Follower.target_id == target.id).first()
 
     def to_dict(self):
@@ -708,6 +1067,92 @@ class Activity(db.Model):
     meta_deleted = db.Column(db.Boolean, default=False)
     meta_undo = db.Column(db.Boolean, default=False)
     meta_pinned = db.Column(db.Boolean, default=False)
+    # extracted from the payload for the timelines, see set_payload_meta()
+    object_type = db.Column(db.String(100), nullable=True)
+    is_public = db.Column(db.Boolean, nullable=False, default=False, server_default="false")
+
+    __table_args__ = (Index("ix_activity_timeline", "type", "object_type", "is_public", "creation_date", "id"),)
+
+    def set_payload_meta(self):
+        """
+        Fill the columns extracted from the payload,
+        object_type is the embedded object type, is_public when addressed "to" Public.
+        """
+        obj = self.payload.get("object")
+        self.object_type = obj.get("type") if isinstance(obj, dict) else None
+        to = self.payload.get("to") or []
+        if isinstance(to, str):
+            to = [to]
+        self.is_public = ap.AS_PUBLIC in to
+
+
+class HomeTimeline(db.Model):
+    """
+    Materialized home timelines, filled on publish for the author and its local followers,
+    see utils.home_timeline
+    """
+
+    __tablename__ = "home_timeline"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer(), db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    sound_id = db.Column(db.Integer(), db.ForeignKey("sound.id", ondelete="CASCADE"), nullable=False)
+    # the track flake_id, entries are ordered and paginated on it
+    flake_id = db.Column(UUID(as_uuid=True), nullable=False)
+    creation_date = db.Column(db.DateTime(timezone=False), default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "sound_id", name="unique_home_timeline_sound"),
+        Index("ix_home_timeline_user_flake_id", "user_id", "flake_id"),
+    )
+
+    def __repr__(self):
+        return f"<HomeTimeline(id='{self.id}', user_id='{self.user_id}', sound_id='{self.sound_id}')>"
+
+
+class DeliveryPayload(db.Model):
+    """
+    Body of an outgoing activity, with its linked data signature, posted to all its inboxes
+    by the delivery worker, see activitypub.delivery.queue_deliveries()
+    """
+
+    __tablename__ = "delivery_payload"
+
+    id = db.Column(db.Integer, primary_key=True)
+    actor_id = db.Column(db.Integer(), db.ForeignKey("actor.id", ondelete="CASCADE"), nullable=False)
+    body = db.Column(db.UnicodeText(), nullable=False)
+    creation_date = db.Column(db.DateTime(timezone=False), default=datetime.datetime.utcnow)
+
+
+class Delivery(db.Model):
+    """
+    Post of an outgoing activity to a remote inbox, waiting for the delivery worker or given up,
+    the delivered ones are deleted.
+    """
+
+    __tablename__ = "delivery"
+
+    STATE_PENDING = 0
+    STATE_FAILED = 1
+
+    id = db.Column(db.Integer, primary_key=True)
+    payload_id = db.Column(
+        db.Integer(), db.ForeignKey("delivery_payload.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    inbox = db.Column(URLType(), nullable=False)
+    state = db.Column(db.Integer(), nullable=False, default=STATE_PENDING, server_default="0")
+    attempts = db.Column(db.Integer(), nullable=False, default=0, server_default="0")
+    # posted once past it, pushed back while a worker is posting it
+    next_attempt = db.Column(db.DateTime(timezone=False), nullable=False, default=datetime.datetime.utcnow)
+    # of the last failed attempt, no status if the inbox was unreachable
+    last_status = db.Column(db.Integer(), nullable=True)
+    last_error = db.Column(db.String(255), nullable=True)
+    creation_date = db.Column(db.DateTime(timezone=False), default=datetime.datetime.utcnow)
+
+    __table_args__ = (Index("ix_delivery_due", "state", "next_attempt"),)
+
+    def __repr__(self):
+        return f"<Delivery(id='{self.id}', inbox='{self.inbox}', state='{self.state}')>"
 
 
 def create_actor(user):
@@ -21,9 +21,9 @@ setup(
         "Flask-Migrate==2.7.0",
         "Flask-Reuploaded==0.5.0",
         "bcrypt==3.2.0",
-        "pydub==0.24.1",
         "psycopg2-binary==2.8.6",
         "mutagen==1.45.1",
+        "numpy==1.19.5",
         "unidecode==1.2.0",
         "Flask_Babel==2.0.0",
         "texttable==1.6.3",
@@ -32,6 +32,9 @@ setup(
         "redis==3.5.3",
         "celery==5.0.5",
         "flask-accept==0.0.6",
+        "prometheus_client==0.9.0",
+        "aiohttp==3.7.4",
+        "cryptography>=3.2",
     ],
     setup_requires=["pytest-runner"],
     tests_require=["pytest==6.2.2", "pytest-cov==2.11.1", "jsonschema==3.2.0", "pytest-sugar==0.9.4"],
@@ -0,0 +1,192 @@
+"""
+Streaming API server, Server-Sent Events relayed from the Redis pub/sub events, see utils/streaming.py
+
+Runs next to the web app, an aiohttp server on its own asyncio loop,
+/api/v1/streaming needs to be proxied to it, without buffering (see deploy/docker.nginx.template):
+    python streaming.py
+Each client is a coroutine waiting on its queue, an idle connection only costs some memory.
+One Redis connection per process receives all the events and dispatch them to the clients of each stream.
+
+Streams, like Mastodon:
+    /api/v1/streaming/public
+    /api/v1/streaming/public/local
+    /api/v1/streaming/user (needs a token, Authorization header or access_token argument)
+    /api/v1/streaming?stream=public|public:local|user
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import redis
+from aiohttp import web
+
+from app import create_app
+from models import db, OAuth2Token
+from utils.streaming import CHANNEL_PREFIX
+
+# seconds between two comments keeping the idle connections open and detecting the closed ones
+HEARTBEAT = 15
+# events waiting for a slow client, newer ones are dropped for it
+QUEUE_SIZE = 100
+
+PATHS = {
+    "/api/v1/streaming/public": "public",
+    "/api/v1/streaming/public/local": "public:local",
+    "/api/v1/streaming/user": "user",
+}
+CORS_HEADERS = {"Access-Control-Allow-Origin": "*"}
+SSE_HEADERS = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def stream_of(path, args):
+    """
+    :return: the stream name asked by the request, or None
+    """
+    path = path.rstrip("/")
+    if path == "/api/v1/streaming":
+        stream = args.get("stream")
+        return stream if stream in PATHS.values() else None
+    return PATHS.get(path)
+
+
+def sse_event(data):
+    """
+    Format a published event as a SSE message
+    """
+    message = json.loads(data)
+    return f"event: {message['event']}\ndata: {json.dumps(message['payload'])}\n\n".encode()
+
+
+def authenticate(app, access_token):
+    """
+    Blocking, run in an executor
+    :return: the user id of a valid token with the read scope, or None
+    """
+    if not access_token:
+        return None
+    with app.app_context():
+        try:
+            token = OAuth2Token.query.filter(OAuth2Token.access_token == access_token).first()
+            if not token or token.revoked or "read" not in token.get_scope().split():
+                return None
+            if token.get_expires_in() and token.get_expires_at() < time.time():
+                return None
+            return token.user_id
+        finally:
+            db.session.remove()
+
+
+class Hub(object):
+    """
+    Clients queues by stream, fed from the Redis listener thread
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.clients = defaultdict(set)
+
+    def subscribe(self, stream):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.clients[stream].add(queue)
+        return queue
+
+    def unsubscribe(self, stream, queue):
+        self.clients[stream].discard(queue)
+        if not self.clients[stream]:
+            del self.clients[stream]
+
+    def dispatch(self, stream, data):
+        for queue in self.clients.get(stream, ()):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                pass
+
+    def listen(self, url):
+        """
+        Blocking, run in a thread: relay the events to the loop, reconnecting if Redis goes away
+        """
+        while True:
+            try:
+                pubsub = redis.Redis.from_url(url).pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                start = len(CHANNEL_PREFIX)
+                for message in pubsub.listen():
+                    stream = message["channel"].decode()[start:]
+                    self.loop.call_soon_threadsafe(self.dispatch, stream, message["data"].decode())
+            except redis.exceptions.RedisError as e:
+                print(f"Streaming: redis unavailable, retrying: {e}")
+                time.sleep(1)
+
+
+async def health(request):
+    return web.Response(text="OK", headers=CORS_HEADERS)
+
+
+async def events(request):
+    stream = stream_of(request.path, request.query)
+    if not stream:
+        return web.Response(status=404, headers=CORS_HEADERS)
+
+    if stream == "user":
+        access_token = request.query.get("access_token")
+        authorization = request.headers.get("Authorization", "")
+        if authorization.lower().startswith("bearer "):
+            access_token = authorization.split(" ", 1)[1].strip()
+        user_id = await asyncio.get_event_loop().run_in_executor(
+            None, authenticate, request.app["flask_app"], access_token
+        )
+        if not user_id:
+            return web.Response(status=401, headers=CORS_HEADERS)
+        stream = f"user:{user_id}"
+
+    hub = request.app["hub"]
+    queue = hub.subscribe(stream)
+    resp = web.StreamResponse(headers=dict(CORS_HEADERS, **SSE_HEADERS))
+    try:
+        await resp.prepare(request)
+        await resp.write(b":)\n\n")
+        while True:
+            try:
+                data = await asyncio.wait_for(queue.get(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                await resp.write(b":thump\n\n")
+            else:
+                await resp.write(sse_event(data))
+    except ConnectionError:
+        # client gone, noticed at the latest by the next heartbeat
+        pass
+    finally:
+        hub.unsubscribe(stream, queue)
+    return resp
+
+
+def make_application(app, hub):
+    application = web.Application()
+    application["flask_app"] = app
+    application["hub"] = hub
+    application.router.add_get("/api/v1/streaming/health", health)
+    application.router.add_get("/api/v1/streaming{path:(/.*)?}", events)
+    return application
+
+
+def main():
+    app = create_app(register_blueprints=False)
+    url = app.config["STREAMING_REDIS_URL"]
+    if not url:
+        raise SystemExit("STREAMING_REDIS_URL is not set")
+    host = os.getenv("REEL2BITS_STREAMING_IP", "127.0.0.1")
+    port = int(os.getenv("REEL2BITS_STREAMING_PORT", 8001))
+
+    hub = Hub(asyncio.get_event_loop())
+    threading.Thread(target=hub.listen, args=(url,), daemon=True).start()
+
+    print(f" * Streaming API on {host}:{port}")
+    web.run_app(make_application(app, hub), host=host, port=port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ from models import db, Sound, User, Config, SoundTag
 from flask_mail import Message
 from flask import render_template, url_for
 from app import create_app, make_celery
-from transcoding_utils import work_transcode, work_metadatas
+from transcoding_utils import work_transcode, work_metadatas, reuse_processing
 from little_boxes import activitypub as ap
 from little_boxes.linked_data_sig import generate_signature
 from little_boxes.httpsig import HTTPSigAuth
@@ -18,8 +18,12 @@ from little_boxes.errors import NotAnActivityError
 from little_boxes.key import Key
 from models import Activity, Actor
 from activitypub.vars import HEADERS, Box, DEFAULT_CTX
+from activitypub.delivery import resolve_inboxes, queue_deliveries
 import smtplib
 from utils.various import add_log, add_user_log
+from utils import home_timeline, streaming, blobs, metrics, http_client
+from utils.locks import advisory_lock, LOCK_UPLOAD_WORKFLOW
+from utils.metrics import stage_timer
 import urllib
 import os
 
@@ -31,6 +35,14 @@ app = create_app(register_blueprints=False)
 app.config["SERVER_NAME"] = app.config["AP_DOMAIN"]
 celery = make_celery(app)
 
+# Queues, each one consumed by workers with their own concurrency and prefetch, see deploy/reel2bits-worker*.service
+# "celery", the default one, processes the inbox
+QUEUE_FETCH = "fetch"  # I/O bound, remote tracks and artworks downloads
+QUEUE_TRANSCODE = "transcode"  # CPU bound, decoding and encoding
+QUEUE_FEDERATION = "federation"  # network bound, deliveries and emails
+
+metrics.init_celery(celery, ["celery", QUEUE_FETCH, QUEUE_TRANSCODE, QUEUE_FEDERATION])
+
 
 @celery.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
@@ -159,7 +171,7 @@ def create_sound_for_remote_track(activity: Activity) -> int:
     return sound.id
 
 
-@celery.task(bind=True, max_retries=3)
+@celery.task(bind=True, max_retries=3, queue=QUEUE_FETCH)
 def fetch_remote_track(self, sound_id: int):
     print(f"Started fetching remote track {sound_id}")
     sound = Sound.query.get(sound_id)
@@ -167,6 +179,9 @@ def fetch_remote_track(self, sound_id: int):
     if not sound.remote_uri:
         print(f"ERROR: cannot fetch track {sound.id!r} because of no remote_uri")
         return False
+    if sound.blob_id:
+        print(f"Track {sound.id} already fetched")
+        return
 
     track_url_path = urllib.parse.urlparse(sound.remote_uri).path
     track_filename = os.path.basename(os.path.normpath(track_url_path))
@@ -177,20 +192,23 @@ def fetch_remote_track(self, sound_id: int):
         current_app.config["UPLOADED_SOUNDS_DEST"], f"remote_{sound.user.slug}", f"remote_{track_filename}"
     )
 
-    track_resp = requests.get(sound.remote_uri, stream=True)
-
-    # maybe we should try except and handle that...
-    track_resp.raise_for_status()
+    # closed once read, giving back its connection to the pool
+    with http_client.get(sound.remote_uri, stream=True) as track_resp:
+        # maybe we should try except and handle that...
+        track_resp.raise_for_status()
 
-    with open(final_track_filename, "wb") as handle:
-        for block in track_resp.iter_content(1024):
-            handle.write(block)
+        with open(final_track_filename, "wb") as handle:
+            for block in track_resp.iter_content(65536):
+                handle.write(block)
 
-    sound.filename = f"remote_{track_filename}"
+    # the same audio can already be there, uploaded locally or federated by another instance
+    blob = blobs.store(final_track_filename)
+    sound.blob_id = blob.id
+    sound.filename = blob.filename
     db.session.commit()
 
 
-@celery.task(bind=True, max_retries=3)
+@celery.task(bind=True, max_retries=3, queue=QUEUE_FETCH)
 def fetch_remote_artwork(self, sound_id: int, update=False):
     print(f"Started fetching remote artwork {sound_id}")
     sound = Sound.query.get(sound_id)
@@ -218,14 +236,14 @@ def fetch_remote_artwork(self, sound_id: int, update=False):
         current_app.config["UPLOADED_ARTWORKSOUNDS_DEST"], f"remote_{sound.user.slug}", f"remote_{artwork_filename}"
     )
 
-    artwork_resp = requests.get(sound.remote_artwork_uri, stream=True)
+    # closed once read, giving back its connection to the pool
+    with http_client.get(sound.remote_artwork_uri, stream=True) as artwork_resp:
+        # maybe we should try except and handle that...
+        artwork_resp.raise_for_status()
 
-    # maybe we should try except and handle that...
-    artwork_resp.raise_for_status()
-
-    with open(final_artwork_filename, "wb") as handle:
-        for block in artwork_resp.iter_content(1024):
-            handle.write(block)
+        with open(final_artwork_filename, "wb") as handle:
+            for block in artwork_resp.iter_content(65536):
+                handle.write(block)
 
     sound.artwork_filename = f"remote_{artwork_filename}"
     db.session.commit()
@@ -233,90 +251,186 @@ def fetch_remote_artwork(self, sound_id: int, update=False):
     print(f"Finished fetching remote artwork {sound.id}")
 
 
-@celery.task(bind=True, max_retries=3)
+@celery.task(bind=True, max_retries=3, queue=QUEUE_FETCH)
 def upload_workflow(self, sound_id):
+    """
+    Processing of an uploaded or remote track, in stages routed to their queue:
+    fetch (here) -> upload_process -> upload_publish, each stage enqueues the next one.
+    Each stage is checkpointed in Sound.processing_stage, running the workflow again resumes it
+    after the last completed stage, and holds the advisory lock of the track, see utils.locks.
+    """
     print("UPLOAD WORKFLOW started")
 
-    sound = Sound.query.get(sound_id)
-    if not sound:
-        print("- Cant find sound ID {id} in database".format(id=sound_id))
-        return
+    with advisory_lock(LOCK_UPLOAD_WORKFLOW, sound_id):
+        sound = Sound.query.get(sound_id)
+        if not sound:
+            print("- Cant find sound ID {id} in database".format(id=sound_id))
+            return
 
-    # First, if the sound isn't local, we need to fetch it
-    if sound.activity and not sound.activity.local:
-        fetch_remote_track(sound_id)
-        fetch_remote_artwork(sound_id)
-        if not sound.filename.startswith("remote_"):
-            print("UPLOAD WORKFLOW had errors")
-            add_log("global", "ERROR", f"Error fetching remote track {sound.id}")
+        # First, if the sound isn't local, we need to fetch it
+        if not sound.stage_done(Sound.STAGE_FETCHED):
+            if sound.activity and not sound.activity.local:
+                with stage_timer(sound, "fetch") as timer:
+                    fetch_remote_track(sound_id)
+                    fetch_remote_artwork(sound_id)
+                    if not sound.blob_id:
+                        timer.failed()
+                if not sound.blob_id:
+                    print("UPLOAD WORKFLOW had errors")
+                    add_log("global", "ERROR", f"Error fetching remote track {sound.id}")
+                    return
+            sound.checkpoint(Sound.STAGE_FETCHED)
+            db.session.commit()
+
+    # enqueued once the lock released, the next stage takes it
+    if not sound.stage_done(Sound.STAGE_TRANSCODED):
+        upload_process.delay(sound_id)
+    elif not sound.stage_done(Sound.STAGE_NOTIFIED):
+        print(f"UPLOAD WORKFLOW resumed after {sound.processing_stage}")
+        upload_publish.delay(sound_id)
+    else:
+        print("UPLOAD WORKFLOW already finished")
+
+
+@celery.task(bind=True, max_retries=3, queue=QUEUE_TRANSCODE)
+def upload_process(self, sound_id):
+    """
+    Metadatas, waveform and transcoding stage of upload_workflow
+    """
+    with advisory_lock(LOCK_UPLOAD_WORKFLOW, sound_id):
+        sound = Sound.query.get(sound_id)
+        if not sound:
+            print("- Cant find sound ID {id} in database".format(id=sound_id))
+            return
+        if sound.stage_done(Sound.STAGE_TRANSCODED):
+            # a concurrent run of the workflow did it and enqueued the next stage
+            print(f"PROCESSING already done for {sound.id}")
             return
 
-    print("METADATAS started")
-    metadatas = work_metadatas(sound_id)
-    print("METADATAS finished")
+        # the same audio was already processed for another track
+        reused = reuse_processing(sound_id)
+        if reused:
+            print("PROCESSING reused")
+        elif sound.stage_done(Sound.STAGE_METADATAS):
+            print(f"METADATAS already done for {sound.id}")
+        else:
+            print("METADATAS started")
+            metadatas = work_metadatas(sound_id)
+            print("METADATAS finished")
+
+            if not metadatas:
+                # cannot process further
+                sound.transcode_state = Sound.TRANSCODE_ERROR
+                db.session.commit()
+                print("UPLOAD WORKFLOW had errors")
+                add_log("global", "ERROR", f"Error processing track {sound.id}")
+                add_user_log(sound.id, sound.user_id, "sounds", "error", "An error occured while processing your track")
+                streaming.publish_processing(sound, "workflow", "error")
+                return
+
+        if not reused:
+            print("TRANSCODE started")
+            transcoded = work_transcode(sound_id)
+            print("TRANSCODE finished")
+
+            if transcoded is False:
+                print("UPLOAD WORKFLOW had errors")
+                add_log("global", "ERROR", f"Error transcoding track {sound.id}")
+                streaming.publish_processing(sound, "workflow", "error")
+                return
+
+        if not sound.stage_done(Sound.STAGE_TRANSCODED):
+            # not in TRANSCODE_WAITING, the transcoding didn't run
+            print(f"UPLOAD WORKFLOW cannot transcode {sound.id} in state {sound.transcode_state}")
+            return
 
-    if not metadatas:
-        # cannot process further
-        sound.transcode_state = Sound.TRANSCODE_ERROR
-        db.session.commit()
-        print("UPLOAD WORKFLOW had errors")
-        add_log("global", "ERROR", f"Error processing track {sound.id}")
-        add_user_log(sound.id, sound.user_id, "sounds", "error", "An error occured while processing your track")
-        return
+    upload_publish.delay(sound_id)
 
-    if metadatas:
-        print("TRANSCODE started")
-        work_transcode(sound_id)
-        print("TRANSCODE finished")
 
-    # The rest only applies if the track is local
-    if not sound.remote_uri:
-        # Federate if public
-        if not sound.private:
-            print("UPLOAD WORKFLOW federating sound")
-            # Federate only if sound is public
-            sound.activity_id = federate_new_sound(sound)
+@celery.task(bind=True, max_retries=3, queue=QUEUE_FEDERATION)
+def upload_publish(self, sound_id):
+    """
+    Federation, timelines and email stage of upload_workflow
+    """
+    with advisory_lock(LOCK_UPLOAD_WORKFLOW, sound_id):
+        sound = Sound.query.get(sound_id)
+        if not sound:
+            print("- Cant find sound ID {id} in database".format(id=sound_id))
+            return
+        if sound.stage_done(Sound.STAGE_NOTIFIED):
+            print(f"PUBLISHING already done for {sound.id}")
+            return
+
+        if not sound.stage_done(Sound.STAGE_FEDERATED):
+            # Federate only if sound is local and public
+            if not sound.remote_uri and not sound.private:
+                with stage_timer(sound, "federation"):
+                    if not sound.activity_id:
+                        print("UPLOAD WORKFLOW federating sound")
+                        sound.activity_id = federate_new_sound(sound)
+                        db.session.commit()
+                    home_timeline.fanout(sound)
+            sound.checkpoint(Sound.STAGE_FEDERATED)
             db.session.commit()
 
-        track_url = f"https://{current_app.config['AP_DOMAIN']}/{sound.user.name}/track/{sound.slug}"
+        # The email only applies if the track is local
+        if not sound.remote_uri:
+            with stage_timer(sound, "email") as timer:
+                if not send_processed_email(sound):
+                    timer.failed()
 
-        msg = Message(
-            subject="Song processing finished",
-            recipients=[sound.user.email],
-            sender=current_app.config["MAIL_DEFAULT_SENDER"],
-        )
+        sound.checkpoint(Sound.STAGE_NOTIFIED)
+        db.session.commit()
+        # once notified, a streaming failure cannot send the email again on a retry
+        streaming.publish_processing(sound, "workflow", "done")
+        streaming.publish_new_track(sound)
+    print("UPLOAD WORKFLOW finished")
 
-        _config = Config.query.first()
-        if not _config:
-            print("ERROR: cannot get instance Config from database")
-        instance = {"name": None, "url": None}
-        if _config:
-            instance["name"] = _config.app_name
-        instance["url"] = current_app.config["REEL2BITS_URL"]
-        msg.body = render_template("email/song_processed.txt", sound=sound, track_url=track_url, instance=instance)
-        msg.html = render_template("email/song_processed.html", sound=sound, track_url=track_url, instance=instance)
-        err = None
-        mail = current_app.extensions.get("mail")
-        if not mail:
-            err = "mail extension is none"
-        else:
-            try:
-                mail.send(msg)
-            except ConnectionRefusedError as e:
-                # TODO: do something about that maybe
-                print(f"Error sending mail: {e}")
-                err = e
-            except smtplib.SMTPRecipientsRefused as e:
-                print(f"Error sending mail: {e}")
-                err = e
-            except smtplib.SMTPException as e:
-                print(f"Error sending mail: {e}")
-                err = e
-        if err:
-            add_log("global", "ERROR", f"Error sending email for track {sound.id}: {err}")
-            add_user_log(sound.id, sound.user.id, "sounds", "error", "An error occured while sending email")
 
-    print("UPLOAD WORKFLOW finished")
+def send_processed_email(sound: Sound) -> bool:
+    """
+    Notify the author of a local track that its processing is finished
+    :return: False if the email cannot be sent
+    """
+    track_url = f"https://{current_app.config['AP_DOMAIN']}/{sound.user.name}/track/{sound.slug}"
+
+    msg = Message(
+        subject="Song processing finished",
+        recipients=[sound.user.email],
+        sender=current_app.config["MAIL_DEFAULT_SENDER"],
+    )
+
+    _config = Config.query.first()
+    if not _config:
+        print("ERROR: cannot get instance Config from database")
+    instance = {"name": None, "url": None}
+    if _config:
+        instance["name"] = _config.app_name
+    instance["url"] = current_app.config["REEL2BITS_URL"]
+    msg.body = render_template("email/song_processed.txt", sound=sound, track_url=track_url, instance=instance)
+    msg.html = render_template("email/song_processed.html", sound=sound, track_url=track_url, instance=instance)
+    err = None
+    mail = current_app.extensions.get("mail")
+    if not mail:
+        err = "mail extension is none"
+    else:
+        try:
+            mail.send(msg)
+        except ConnectionRefusedError as e:
+            # TODO: do something about that maybe
+            print(f"Error sending mail: {e}")
+            err = e
+        except smtplib.SMTPRecipientsRefused as e:
+            print(f"Error sending mail: {e}")
+            err = e
+        except smtplib.SMTPException as e:
+            print(f"Error sending mail: {e}")
+            err = e
+    if err:
+        add_log("global", "ERROR", f"Error sending email for track {sound.id}: {err}")
+        add_user_log(sound.id, sound.user.id, "sounds", "error", "An error occured while sending email")
+        return False
+    return True
 
 
 # ACTIVITYPUB
@@ -471,7 +585,7 @@ def finish_inbox_processing(self, iri: str) -> None:
         current_app.logger.exception(f"failed to cache attachments for" f" {iri}")
 
 
-@celery.task(bind=True, max_retries=3)
+@celery.task(bind=True, max_retries=3, queue=QUEUE_FEDERATION)
 def finish_post_to_outbox(self, iri: str) -> None:
     try:
         activity = ap.fetch_remote_activity(iri)
@@ -479,9 +593,9 @@ def finish_post_to_outbox(self, iri: str) -> None:
 
         current_app.logger.info(f"finish_post_to_outbox {activity!r}")
 
-        recipients = activity.recipients()
-
         actor = activity.get_actor()
+        # followers resolved from the database, delivered once per shared inbox
+        recipients = resolve_inboxes(activity, actor.id)
         current_app.logger.debug(f"finish_post_to_outbox actor {actor!r}")
 
         if activity.has_type(ap.ActivityType.DELETE):
@@ -506,6 +620,11 @@ def finish_post_to_outbox(self, iri: str) -> None:
         current_app.logger.info(f"recipients={recipients}")
         activity = ap.clean_activity(activity.to_dict())
 
+        if current_app.config["DELIVERY_WORKER"]:
+            # posted by delivery_worker.py
+            queue_deliveries(activity, recipients)
+            return
+
         payload = json.dumps(activity)
         for recp in recipients:
             current_app.logger.debug(f"posting to {recp}")
@@ -516,7 +635,7 @@ def finish_post_to_outbox(self, iri: str) -> None:
         current_app.logger.exception(f"failed to post " f"to remote inbox for {iri}")
 
 
-@celery.task(bind=True, max_retries=3)
+@celery.task(bind=True, max_retries=3, queue=QUEUE_FEDERATION)
 def post_to_remote_inbox(self, payload: str, to: str) -> None:
     if not current_app.config["AP_ENABLED"]:
         return  # not federating if not enabled
@@ -548,7 +667,7 @@ def post_to_remote_inbox(self, payload: str, to: str) -> None:
             generate_signature(signed_payload, key)
 
         current_app.logger.info("to=%s", to)
-        resp = requests.post(
+        resp = http_client.post(
             to,
             data=json.dumps(signed_payload),
             auth=signature_auth,
@@ -557,14 +676,21 @@ def post_to_remote_inbox(self, payload: str, to: str) -> None:
         current_app.logger.info("resp=%s", resp)
         current_app.logger.info("resp_body=%s", resp.text)
         resp.raise_for_status()
+        metrics.delivery_outcome(to, "delivered")
     except HTTPError as err:
         current_app.logger.exception("request failed")
-        if 400 >= err.response.status_code >= 499:
+        metrics.delivery_outcome(to, "client_error" if err.response.status_code < 500 else "server_error")
+        if 400 <= err.response.status_code < 500:
             current_app.logger.info("client error, no retry")
+            return
+        raise
+    except requests.RequestException:
+        metrics.delivery_outcome(to, "unreachable")
+        raise
     return
 
 
-@celery.task(bind=True, max_retries=3)
+@celery.task(bind=True, max_retries=3, queue=QUEUE_FEDERATION)
 def forward_activity(self, iri: str) -> None:
     if not current_app.config["AP_ENABLED"]:
         return  # not federating if not enabled
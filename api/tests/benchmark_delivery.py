@@ -0,0 +1,119 @@
+"""
+Benchmark of the delivery worker against a local stand-in inbox server, not collected by pytest:
+    python tests/benchmark_delivery.py [deliveries] [hosts]
+
+The deliveries are claimed from memory instead of the database, each stand-in instance is a port
+of a local aiohttp server answering 202 like Mastodon, the posts are signed like the real ones.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # noqa: E402
+from cryptography.hazmat.backends import default_backend  # noqa: E402
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+
+from delivery_worker import Worker, load_payload, signed_headers  # noqa: E402
+
+FIRST_PORT = 18100
+ACTOR = "http://127.0.0.1/user/benchmark"
+CONFIG = {
+    "DELIVERY_BATCH_SIZE": 500,
+    "DELIVERY_CONCURRENCY": 1000,
+    "DELIVERY_PER_HOST": 8,
+    "DELIVERY_MAX_ATTEMPTS": 4,
+    "HTTP_CONNECT_TIMEOUT": 5,
+    "HTTP_READ_TIMEOUT": 30,
+}
+
+
+class MemoryWorker(Worker):
+    def __init__(self, deliveries, payload):
+        super().__init__(types.SimpleNamespace(config=CONFIG), "reel2bits benchmark")
+        self.pending = deliveries
+        self.payload = payload
+        self.total = len(deliveries)
+        self.done = 0
+        self.accepted = 0
+        self.finished = None
+
+    async def claim(self, limit):
+        batch, self.pending = self.pending[:limit], self.pending[limit:]
+        if not batch:
+            self.stop()
+        return [delivery + (self.payload,) for delivery in batch]
+
+    async def deliver(self, *args):
+        await super().deliver(*args)
+        self.done += 1
+        if self.done == self.total:
+            self.finished = time.perf_counter()
+
+    async def report(self):
+        results, self.results = self.results, []
+        self.accepted += sum(1 for result in results if result.status == 202)
+
+
+async def inbox(request):
+    await request.read()
+    return web.Response(status=202)
+
+
+def serve_inboxes(hosts, ready):
+    """
+    The stand-in instances, in their own process
+    """
+
+    async def start():
+        app = web.Application()
+        app.router.add_post("/inbox", inbox)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        for port in range(FIRST_PORT, FIRST_PORT + hosts):
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start())
+    ready.set()
+    loop.run_forever()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    hosts = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode("utf-8")
+    body = json.dumps({"type": "Create", "actor": ACTOR, "object": {"type": "Audio", "content": "x" * 2000}})
+    payload = load_payload(body, ACTOR, pem)
+    inboxes = [f"http://127.0.0.1:{FIRST_PORT + i % hosts}/inbox" for i in range(count)]
+
+    start = time.perf_counter()
+    for inbox in inboxes[:1000]:
+        signed_headers(payload, inbox, "reel2bits benchmark")
+    print(f"signatures: {1000 / (time.perf_counter() - start):.0f}/s on one thread, {os.cpu_count()} CPUs")
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve_inboxes, args=(hosts, ready), daemon=True)
+    server.start()
+    ready.wait()
+    worker = MemoryWorker([(i, 1, inbox, 1) for i, inbox in enumerate(inboxes)], payload)
+    start = time.perf_counter()
+    asyncio.get_event_loop().run_until_complete(worker.run())
+    elapsed = worker.finished - start
+    server.terminate()
+
+    print(f"{count} deliveries to {hosts} hosts, {worker.accepted} accepted")
+    print(f"{elapsed:.2f}s, {count / elapsed:.0f} deliveries/s")
+
+
+if __name__ == "__main__":
+    main()
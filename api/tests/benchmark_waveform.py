@@ -0,0 +1,63 @@
+"""
+Benchmark of the waveform peaks extraction, not collected by pytest:
+    python tests/benchmark_waveform.py [seconds of audio]
+
+Compares the previous per-pair Python loop over the PCM samples with the NumPy one
+used by WaveformAccumulator, fed by 64KiB chunks like the ffmpeg pipe of process_audio.
+"""
+import array
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.various import WaveformAccumulator  # noqa: E402
+
+RATE = 44100
+MAX_POINTS = 16384
+CHUNK = 65536
+
+
+def python_peaks(pcm, samples_per_peak):
+    """The previous implementation, min() and max() of each pair slice then a normalization loop"""
+    samples = array.array("h")
+    samples.frombytes(pcm)
+    data = []
+    for start in range(0, len(samples), samples_per_peak):
+        stop = start + samples_per_peak
+        bucket = samples[start:stop]
+        data.append(min(bucket))
+        data.append(max(bucket))
+    ratio = 127 / max(abs(x) for x in data)
+    return array.array("b", (round(x * ratio) for x in data)).tobytes()
+
+
+def numpy_peaks(pcm, samples_per_peak):
+    accumulator = WaveformAccumulator(samples_per_peak)
+    for start in range(0, len(pcm), CHUNK):
+        stop = start + CHUNK
+        accumulator.feed(pcm[start:stop])
+    return accumulator.peaks()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    pcm = os.urandom(seconds * RATE * 2)
+    samples_per_peak = max(1, round(seconds * RATE / MAX_POINTS))
+
+    print(f"{seconds}s of mono 16 bits PCM at {RATE}Hz, {samples_per_peak} samples per peak")
+    python_time = timed(python_peaks, pcm, samples_per_peak)
+    numpy_time = timed(numpy_peaks, pcm, samples_per_peak)
+    print(f"python: {python_time:.3f}s")
+    print(f"numpy:  {numpy_time:.3f}s ({python_time / numpy_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
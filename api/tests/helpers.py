@@ -1,6 +1,10 @@
 import json
 from os.path import join, dirname
 from jsonschema import validate
+from contextlib import contextmanager
+from flask_security.utils import hash_password
+from sqlalchemy import event
+from models import db, Role, create_actor, user_datastore
 import datetime
 
 
@@ -90,3 +94,43 @@ def _load_json_schema(filename):
 
     with open(absolute_path) as schema_file:
         return json.loads(schema_file.read())
+
+
+def create_user_with_actor(session, name):
+    """Creates a local user and its actor directly in database"""
+    role = Role.query.filter(Role.name == "user").first()
+    u = user_datastore.create_user(name=name, email=f"{name}@localhost", password=hash_password(name), roles=[role])
+    session.commit()
+    actor = create_actor(u)
+    actor.user = u
+    actor.user_id = u.id
+    session.add(actor)
+    session.commit()
+    return u
+
+
+@contextmanager
+def count_queries():
+    """Counts the SQL statements executed inside the block, yields a list of them"""
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(budget):
+    """Fails if the block executes more than budget SQL statements, listing them"""
+
+    with count_queries() as statements:
+        yield statements
+    assert len(statements) <= budget, "{0} queries, budget {1}:\n{2}".format(
+        len(statements), budget, "\n".join(statements)
+    )
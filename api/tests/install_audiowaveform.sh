@@ -1,72 +0,0 @@
-#!/bin/bash
-
-# Quick and dirty AudioWaveform build with cache logic for speedup
-
-if [ -z "$DRONE_RUNNER_PLATFORM" ]; then
-    # CircleCI
-    RUNNER="$(uname -s)"
-    BINPATH=/home/circleci/projects/audiowaveform/${RUNNER}/audiowaveform
-    CACHEPATH=~/projects
-    CI="CircleCI"
-    SUDO="sudo"
-else
-    # Drone
-    RUNNER=$DRONE_RUNNER_PLATFORM
-    BINPATH="${PWD}/.cache/audiowaveform/${RUNNER}/audiowaveform"
-    CACHEPATH=~/.cache
-    CI="DroneCI"
-fi
-
-echo "-- debug start"
-echo "-- CI detected: ${CI}"
-echo "-- runner: ${RUNNER}"
-echo "-- ls cachepath (${CACHEPATH}): $(ls -la ${CACHEPATH})"
-echo "-- file: $(file ${BINPATH})"
-echo "-- debug end"
-
-# Build function
-build() {
-    echo "-- build audiowaveform; building AudioWaveform..."
-    git clone https://github.com/bbcrd/audiowaveform.git /tmp/audiowaveform
-    cd /tmp/audiowaveform
-    wget https://github.com/google/googletest/archive/release-1.10.0.tar.gz -O gmock-1.10.0.tar.gz
-    tar xzf gmock-1.10.0.tar.gz
-    ln -s googletest-release-1.10.0/googletest googletest
-    ln -s googletest-release-1.10.0/googlemock googlemock
-    mkdir build
-    cd build
-    cmake ..
-    make
-    ${SUDO} mkdir -pv /usr/local/bin
-    ${SUDO} cp -fv audiowaveform /usr/local/bin/audiowaveform
-}
-
-# Cache logic : test if we have an executable already built, and working
-if [[ -d $CACHEPATH ]]; then
-    echo "-- build audiowaveform; cache available"
-    # We have a cache dir, create struct
-    mkdir -pv "${CACHEPATH}/audiowaveform/${RUNNER}"
-
-    # Check if a binary exists
-    if [[ -x ${BINPATH} ]]; then
-        echo "-- build audiowaveform; binary exist"
-        # Can we run it ?
-        if ${BINPATH} --help|grep "AudioWaveform v"; then
-            echo "-- build audiowaveform; and can run; copying it"
-            # can run
-            ${SUDO} cp -fv ${BINPATH} /usr/local/bin/audiowaveform
-        else
-            # can't run
-            build
-            cp -fv /usr/local/bin/audiowaveform ${BINPATH}
-        fi
-    else
-        # Can't run it, build it
-        build
-        cp -fv /usr/local/bin/audiowaveform ${BINPATH}
-    fi
-else
-    # No cache, build it
-    build
-    cp -fv /usr/local/bin/audiowaveform ${BINPATH}
-fi
@@ -0,0 +1,39 @@
+import types
+
+from little_boxes import activitypub as ap
+from little_boxes.activitypub import AS_PUBLIC
+
+from helpers import create_user_with_actor
+from models import Activity, Sound
+
+
+def test_activity_payload_meta():
+    act = Activity(payload={"type": "Create", "to": [AS_PUBLIC], "object": {"type": "Audio"}})
+    act.set_payload_meta()
+    assert act.object_type == "Audio"
+    assert act.is_public
+
+    # unlisted
+    act = Activity(payload={"type": "Create", "to": [], "cc": [AS_PUBLIC], "object": {"type": "Audio"}})
+    act.set_payload_meta()
+    assert not act.is_public
+
+    act = Activity(payload={"type": "Follow", "to": "https://example.com/users/a", "object": "https://example.com/b"})
+    act.set_payload_meta()
+    assert act.object_type is None
+    assert not act.is_public
+
+
+def test_inbox_create_audio_without_file(session):
+    actor = create_user_with_actor(session, "inboxnofile").actor[0]
+    url = "https://remote.example/outbox/nofile/activity"
+    payload = {"type": "Create", "id": url, "to": [AS_PUBLIC], "object": {"type": "Audio", "name": "no file"}}
+    act = Activity(url=url, type="Create", box="inbox", local=False, actor_id=actor.id, payload=payload)
+    session.add(act)
+    session.commit()
+
+    audio = types.SimpleNamespace(ACTIVITY_TYPE=ap.ActivityType.AUDIO, inReplyTo=None)
+    create = types.SimpleNamespace(id=url, get_object=lambda: audio)
+    # rejected, neither fanned out nor fetched
+    ap.get_backend().inbox_create(None, create)
+    assert Sound.query.filter(Sound.activity_id == act.id).count() == 0
@@ -0,0 +1,117 @@
+import os
+
+from helpers import create_user_with_actor
+from models import Sound, SoundBlob, SoundInfo, SoundWaveform
+from transcoding_utils import reuse_processing
+from utils import blobs
+from utils.various import save_waveform_levels
+
+
+def upload_file(directory, name, content):
+    path = os.path.join(str(directory), name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def create_blob_track(session, user, blob, **kwargs):
+    sound = Sound(user_id=user.id, title=f"blob {blob.id}", blob_id=blob.id, filename=blob.filename, **kwargs)
+    session.add(sound)
+    session.commit()
+    return sound
+
+
+def test_store_deduplicates(app, session, tmpdir, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOADED_SOUNDS_DEST", str(tmpdir))
+    user = create_user_with_actor(session, "blobsstore")
+
+    first = blobs.store(upload_file(tmpdir, "first.MP3", b"same audio"))
+    first_track = create_blob_track(session, user, first)
+    second = blobs.store(upload_file(tmpdir, "second.mp3", b"same audio"))
+    second_track = create_blob_track(session, user, second)
+    other = blobs.store(upload_file(tmpdir, "other.mp3", b"other audio"))
+    other_track = create_blob_track(session, user, other)
+
+    assert first.id == second.id
+    assert first.filename == f"{first.sha256}.mp3"
+    assert SoundBlob.query.get(first.id).refcount == 2
+    assert other.id != first.id
+    # moved or dropped
+    assert not tmpdir.join("first.MP3").check()
+    assert not tmpdir.join("second.mp3").check()
+    assert os.path.isfile(first.path())
+    assert first_track.path_sound() == os.path.join("blobs", first.sha256[:2], first.filename)
+
+    # the last reference deletes the file
+    session.delete(first_track)
+    session.commit()
+    assert SoundBlob.query.get(first.id).refcount == 1
+    assert os.path.isfile(first.path())
+    path = first.path()
+    session.delete(second_track)
+    session.commit()
+    assert not SoundBlob.query.get(first.id)
+    assert not os.path.isfile(path)
+
+    session.delete(other_track)
+    session.commit()
+
+
+def test_store_rolled_back(app, session, tmpdir, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOADED_SOUNDS_DEST", str(tmpdir))
+    user = create_user_with_actor(session, "blobsrollback")
+    blob = blobs.store(upload_file(tmpdir, "kept.mp3", b"kept audio"))
+    track = create_blob_track(session, user, blob)
+    path = blob.path()
+
+    # moved once committed only
+    dropped = blobs.store(upload_file(tmpdir, "dropped.mp3", b"dropped audio")).path()
+    assert tmpdir.join("dropped.mp3").check()
+    session.rollback()
+    assert tmpdir.join("dropped.mp3").check()
+    assert not os.path.isfile(dropped)
+
+    # deleted once committed only
+    session.delete(track)
+    session.flush()
+    assert os.path.isfile(path)
+    session.rollback()
+    assert os.path.isfile(path)
+
+
+def test_reuse_processing(app, session, tmpdir, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOADED_SOUNDS_DEST", str(tmpdir))
+    user = create_user_with_actor(session, "blobsreuse")
+
+    blob = blobs.store(upload_file(tmpdir, "track.flac", b"flac audio"))
+    processed = create_blob_track(
+        session,
+        user,
+        blob,
+        transcode_needed=True,
+        transcode_state=Sound.TRANSCODE_DONE,
+        filename_transcoded=f"{blob.sha256}.mp3",
+        transcode_file_size=42,
+    )
+    peaks = bytes([0x81, 0x7F] * 1000)
+    session.add(
+        SoundInfo(sound_id=processed.id, duration=12.5, waveform_peaks=peaks, done_basic=True, done_waveform=True)
+    )
+    save_waveform_levels(processed.id, peaks)
+    session.commit()
+
+    blob = blobs.store(upload_file(tmpdir, "again.flac", b"flac audio"))
+    again = create_blob_track(session, user, blob, transcode_needed=True, transcode_state=Sound.TRANSCODE_WAITING)
+    assert reuse_processing(again.id)
+
+    again = Sound.query.get(again.id)
+    assert again.transcode_state == Sound.TRANSCODE_DONE
+    assert again.processing_stage == Sound.STAGE_TRANSCODED
+    assert again.filename_transcoded == processed.filename_transcoded
+    assert again.sound_infos.first().duration == 12.5
+    assert again.waveforms.count() == SoundWaveform.query.filter(SoundWaveform.sound_id == processed.id).count()
+
+    # nothing to reuse
+    blob = blobs.store(upload_file(tmpdir, "new.flac", b"new audio"))
+    new = create_blob_track(session, user, blob, transcode_needed=True, transcode_state=Sound.TRANSCODE_WAITING)
+    assert not reuse_processing(new.id)
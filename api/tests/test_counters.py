@@ -0,0 +1,50 @@
+from helpers import create_user_with_actor
+from models import db, User, Sound, Album
+
+
+def test_follow_counters(client, session):
+    alice = create_user_with_actor(session, "counteralice")
+    bob = create_user_with_actor(session, "counterbob")
+
+    alice.actor[0].follow(None, bob.actor[0])
+    db.session.expire_all()
+    assert bob.followers_count == 1
+    assert bob.following_count == 0
+    assert alice.following_count == 1
+    assert alice.followers_count == 0
+
+    alice.actor[0].unfollow(bob.actor[0])
+    db.session.expire_all()
+    assert bob.followers_count == 0
+    assert alice.following_count == 0
+
+
+def test_tracks_and_albums_counters(client, session):
+    carol = create_user_with_actor(session, "countercarol")
+
+    sound = Sound(user_id=carol.id, title="counter", private=False, transcode_state=Sound.TRANSCODE_WAITING)
+    album = Album(user_id=carol.id, title="counter", private=True)
+    session.add(sound)
+    session.add(album)
+    session.commit()
+    db.session.expire_all()
+    # not processed yet and private album
+    assert carol.public_tracks_count == 0
+    assert carol.public_albums_count == 0
+
+    sound.transcode_state = Sound.TRANSCODE_DONE
+    album.private = False
+    session.commit()
+    db.session.expire_all()
+    assert carol.public_tracks_count == 1
+    assert carol.public_albums_count == 1
+
+    sound.private = True
+    session.commit()
+    db.session.expire_all()
+    assert carol.public_tracks_count == 0
+
+    session.delete(album)
+    session.commit()
+    db.session.expire_all()
+    assert User.query.get(carol.id).public_albums_count == 0
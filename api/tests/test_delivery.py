@@ -0,0 +1,56 @@
+from little_boxes.activitypub import AS_PUBLIC
+from prometheus_client import REGISTRY
+
+from activitypub.delivery import addresses, resolve_inboxes
+from helpers import create_user_with_actor
+from models import Actor, Follower
+
+
+def create_remote_actor(session, domain, name, shared=True):
+    actor = Actor(
+        url=f"https://{domain}/users/{name}",
+        inbox_url=f"https://{domain}/users/{name}/inbox",
+        shared_inbox_url=f"https://{domain}/inbox" if shared else None,
+        domain=domain,
+        preferred_username=name,
+    )
+    session.add(actor)
+    session.commit()
+    return actor
+
+
+def test_addresses_deduplicated():
+    activity = {
+        "to": [AS_PUBLIC, "https://a.example/u/1"],
+        "cc": ["https://a.example/u/1"],
+        "bcc": "https://b.example/u/2",
+    }
+    assert addresses(activity) == [AS_PUBLIC, "https://a.example/u/1", "https://b.example/u/2"]
+
+
+def test_resolve_inboxes_shared(app, session):
+    author = create_user_with_actor(session, "deliveryauthor").actor[0]
+    followers = [create_remote_actor(session, "mastodon.example", f"fan{i}") for i in range(5)]
+    followers.append(create_remote_actor(session, "solo.example", "alone", shared=False))
+    for follower in followers:
+        session.add(Follower(actor_id=follower.id, target_id=author.id))
+    session.commit()
+    mentioned = create_remote_actor(session, "other.example", "mentioned")
+
+    recipients_before = REGISTRY.get_sample_value("reel2bits_federation_fanout_recipients_total") or 0
+    inboxes_before = REGISTRY.get_sample_value("reel2bits_federation_fanout_inboxes_total") or 0
+
+    activity = {
+        "to": [AS_PUBLIC],
+        # a follower also mentioned is delivered once
+        "cc": [author.followers_url, followers[0].url, mentioned.url, author.url],
+    }
+    inboxes = resolve_inboxes(activity, author.url)
+
+    assert sorted(inboxes) == [
+        "https://mastodon.example/inbox",
+        "https://other.example/inbox",
+        "https://solo.example/users/alone/inbox",
+    ]
+    assert REGISTRY.get_sample_value("reel2bits_federation_fanout_recipients_total") == recipients_before + 7
+    assert REGISTRY.get_sample_value("reel2bits_federation_fanout_inboxes_total") == inboxes_before + 3
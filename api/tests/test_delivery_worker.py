@@ -0,0 +1,145 @@
+import asyncio
+import base64
+import datetime
+import hashlib
+import json
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+from activitypub.delivery import DeliveryResult, queue_deliveries, claim_deliveries, report_deliveries, retry_delay
+from activitypub.delivery import purge_failed_deliveries
+import delivery_worker
+from delivery_worker import Worker, load_payload, signed_headers, SIGNED_HEADERS
+from helpers import create_user_with_actor
+from models import Delivery, DeliveryPayload
+
+INBOXES = ["https://mastodon.example/inbox", "https://funkwhale.example/federation/shared/inbox"]
+
+
+def queue(session, name, inboxes=INBOXES):
+    actor = create_user_with_actor(session, name).actor[0]
+    # already signed, not signed again
+    activity = {"type": "Create", "actor": actor.url, "signature": {"type": "RsaSignature2017"}}
+    assert queue_deliveries(activity, inboxes) == len(inboxes)
+    return actor
+
+
+def test_signed_headers(session):
+    actor = create_user_with_actor(session, "deliverysigner").actor[0]
+    payload = load_payload('{"type": "Create"}', actor.url, actor.private_key)
+    headers = signed_headers(payload, INBOXES[1], "reel2bits test")
+
+    assert headers["Host"] == "funkwhale.example"
+    assert headers["Digest"] == "SHA-256=" + base64.b64encode(hashlib.sha256(payload.body).digest()).decode()
+    params = dict(item.split("=", 1) for item in headers["Signature"].split(","))
+    assert params["keyId"] == f'"{actor.private_key_id()}"'
+    assert params["headers"] == f'"{SIGNED_HEADERS}"'
+    signed = "\n".join(
+        ["(request-target): post /federation/shared/inbox"]
+        + [f"{name}: {headers[name.title()]}" for name in SIGNED_HEADERS.split()[1:]]
+    )
+    public_key = serialization.load_pem_public_key(actor.public_key.encode(), backend=default_backend())
+    # raises if invalid
+    public_key.verify(
+        base64.b64decode(params["signature"].strip('"')), signed.encode(), padding.PKCS1v15(), hashes.SHA256()
+    )
+
+
+def test_claim_deliveries(session):
+    actor = queue(session, "deliveryclaim")
+
+    deliveries, payloads = claim_deliveries(100, 300)
+    assert sorted(d[2] for d in deliveries) == sorted(INBOXES)
+    assert all(d[3] == 1 for d in deliveries)
+    body, actor_url, private_key = payloads[deliveries[0][1]]
+    assert len(payloads) == 1
+    assert json.loads(body)["signature"] == {"type": "RsaSignature2017"}
+    assert (actor_url, private_key) == (actor.url, actor.private_key)
+    # leased
+    assert claim_deliveries(100, 300) == ([], {})
+
+    Delivery.query.update({"next_attempt": datetime.datetime.utcnow()})
+    deliveries, payloads = claim_deliveries(100, 300, known_payloads=[deliveries[0][1]])
+    assert all(d[3] == 2 for d in deliveries)
+    assert payloads == {}
+
+
+def test_report_deliveries(session):
+    queue(session, "deliveryreport", INBOXES + ["https://gone.example/inbox"])
+    deliveries, _ = claim_deliveries(100, 300)
+    by_inbox = {inbox: (id, payload_id, attempts) for id, payload_id, inbox, attempts in deliveries}
+
+    report_deliveries(
+        [
+            DeliveryResult(*by_inbox[INBOXES[0]], 202, None),
+            DeliveryResult(*by_inbox[INBOXES[1]], None, "ClientConnectorError: refused"),
+            DeliveryResult(*by_inbox["https://gone.example/inbox"], 410, None),
+        ],
+        4,
+    )
+    assert Delivery.query.get(by_inbox[INBOXES[0]][0]) is None
+    retried = Delivery.query.get(by_inbox[INBOXES[1]][0])
+    assert retried.state == Delivery.STATE_PENDING
+    assert retried.last_error == "ClientConnectorError: refused"
+    assert retried.next_attempt > datetime.datetime.utcnow() + datetime.timedelta(seconds=30)
+    given_up = Delivery.query.get(by_inbox["https://gone.example/inbox"][0])
+    assert given_up.state == Delivery.STATE_FAILED
+    assert given_up.last_status == 410
+    # still to deliver
+    payload_id = retried.payload_id
+    assert DeliveryPayload.query.get(payload_id)
+
+    session.delete(given_up)
+    session.commit()
+    report_deliveries([DeliveryResult(*by_inbox[INBOXES[1]], 202, None)], 4)
+    assert DeliveryPayload.query.get(payload_id) is None
+
+
+def test_retry_delay():
+    assert retry_delay(None, 1, 4) == 60
+    assert retry_delay(503, 2, 4) == 240
+    assert retry_delay(429, 1, 4) == 60
+    assert retry_delay(404, 1, 4) is None
+    assert retry_delay(500, 4, 4) is None
+
+
+def test_purge_failed_deliveries(session):
+    queue(session, "deliverypurge")
+    deliveries, _ = claim_deliveries(100, 300)
+    report_deliveries([DeliveryResult(d[0], d[1], d[3], 410, None) for d in deliveries[:1]], 4)
+    payload_id = deliveries[0][1]
+
+    # too recent
+    assert purge_failed_deliveries(datetime.datetime.utcnow() - datetime.timedelta(days=7)) == 0
+    assert purge_failed_deliveries(datetime.datetime.utcnow() + datetime.timedelta(seconds=1)) == 1
+    assert Delivery.query.filter(Delivery.payload_id == payload_id).count() == 1
+    # still to deliver
+    assert DeliveryPayload.query.get(payload_id)
+
+    report_deliveries([DeliveryResult(d[0], d[1], d[3], 404, None) for d in deliveries[1:]], 4)
+    assert purge_failed_deliveries(datetime.datetime.utcnow() + datetime.timedelta(seconds=1)) == 1
+    assert DeliveryPayload.query.get(payload_id) is None
+
+
+class FailingClaimWorker(Worker):
+    def __init__(self, app):
+        super().__init__(app, "reel2bits test")
+        self.claims = 0
+
+    async def claim(self, limit):
+        self.claims += 1
+        if self.claims == 1:
+            raise ConnectionError("database unavailable")
+        self.stop()
+        return []
+
+
+def test_worker_claim_failure(app, monkeypatch):
+    monkeypatch.setattr(delivery_worker, "CLAIM_RETRY", 0)
+    monkeypatch.setattr(delivery_worker, "POLL_INTERVAL", 0)
+    worker = FailingClaimWorker(app)
+    # logged and claimed again
+    asyncio.get_event_loop().run_until_complete(worker.run())
+    assert worker.claims == 2
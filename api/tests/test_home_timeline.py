@@ -0,0 +1,37 @@
+from helpers import create_user_with_actor
+from models import Sound, HomeTimeline
+from utils import home_timeline
+
+
+def publish(session, user, title):
+    sound = Sound(user_id=user.id, title=title, private=False, transcode_state=Sound.TRANSCODE_DONE)
+    session.add(sound)
+    session.commit()
+    home_timeline.fanout(sound)
+    return sound
+
+
+def home_of(user):
+    q = HomeTimeline.query.filter(HomeTimeline.user_id == user.id).order_by(HomeTimeline.flake_id.desc())
+    return [entry.sound_id for entry in q]
+
+
+def test_home_timeline_fanout(app, client, session, monkeypatch):
+    author = create_user_with_actor(session, "hometlauthor")
+    follower = create_user_with_actor(session, "hometlfollower")
+    other = create_user_with_actor(session, "hometlother")
+    follower.actor[0].follow(None, author.actor[0])
+
+    sound = publish(session, author, "home timeline")
+    assert home_of(author) == [sound.id]
+    assert home_of(follower) == [sound.id]
+    assert home_of(other) == []
+
+    # the newest entries are kept
+    monkeypatch.setitem(app.config, "HOME_TIMELINE_MAX_LENGTH", 2)
+    sounds = [publish(session, author, f"home timeline {i}") for i in range(3)]
+    assert home_of(follower) == [sounds[2].id, sounds[1].id]
+
+    other.actor[0].follow(None, author.actor[0])
+    home_timeline.rebuild(other)
+    assert home_of(other) == [sounds[2].id, sounds[1].id]
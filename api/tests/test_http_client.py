@@ -0,0 +1,17 @@
+from utils import http_client
+
+
+def test_session_pooled(app):
+    session = http_client.session()
+    assert http_client.session() is session
+
+    adapter = session.get_adapter("https://mastodon.example/inbox")
+    assert adapter is session.get_adapter("http://other.example/")
+    assert adapter._pool_connections == int(app.config["HTTP_POOL_HOSTS"])
+    assert adapter._pool_maxsize == int(app.config["HTTP_POOL_SIZE"])
+
+
+def test_timeout(app):
+    connect, read = http_client.timeout()
+    assert connect == float(app.config["HTTP_CONNECT_TIMEOUT"])
+    assert read == float(app.config["HTTP_READ_TIMEOUT"])
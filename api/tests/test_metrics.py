@@ -0,0 +1,32 @@
+from flask import current_app
+from prometheus_client import REGISTRY
+
+from utils import metrics
+
+
+def test_metrics_endpoint(client, session):
+    client.get(f"/.well-known/webfinger?resource=acct:nobody@{current_app.config['AP_DOMAIN']}")
+
+    rv = client.get("/metrics")
+    assert rv.status_code == 200
+    body = rv.data.decode("utf-8")
+    assert 'reel2bits_http_request_seconds_count{endpoint="bp_wellknown.webfinger",method="GET"' in body
+    assert 'reel2bits_http_request_queries_count{endpoint="bp_wellknown.webfinger"}' in body
+    assert "reel2bits_http_request_db_seconds_sum" in body
+
+
+def test_metrics_token(client, session):
+    current_app.config["METRICS_TOKEN"] = "scrapeme"
+    try:
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer nope"}).status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer scrapeme"}).status_code == 200
+    finally:
+        current_app.config["METRICS_TOKEN"] = None
+
+
+def test_delivery_outcome():
+    labels = {"host": "mastodon.example", "outcome": "delivered"}
+    before = REGISTRY.get_sample_value("reel2bits_federation_deliveries_total", labels) or 0
+    metrics.delivery_outcome("https://mastodon.example/inbox", "delivered")
+    assert REGISTRY.get_sample_value("reel2bits_federation_deliveries_total", labels) == before + 1
@@ -0,0 +1,97 @@
+import datetime
+import uuid
+
+from flask import current_app
+
+from helpers import create_user_with_actor
+from models import Activity, Sound
+from utils.pagination import paginate, keyset_paginate, link_header
+
+
+def create_sounds(session, user, count):
+    for i in range(count):
+        session.add(Sound(user_id=user.id, title=f"pagination {i}", private=True))
+        session.commit()
+    return Sound.query.filter(Sound.user_id == user.id).order_by(Sound.flake_id.desc()).all()
+
+
+def test_keyset_paginate(app, client, session):
+    user = create_user_with_actor(session, "paginationkeyset")
+    sounds = create_sounds(session, user, 5)
+    q = Sound.query.filter(Sound.user_id == user.id)
+
+    with app.test_request_context("/api/v1/timelines/drafts"):
+        assert keyset_paginate(q, Sound.flake_id, 2) == sounds[:2]
+
+    with app.test_request_context(f"/api/v1/timelines/drafts?max_id={sounds[1].flake_id}"):
+        assert keyset_paginate(q, Sound.flake_id, 2) == sounds[2:4]
+        link = link_header(sounds[2].flake_id, sounds[3].flake_id)
+        assert f"max_id={sounds[3].flake_id}" in link
+        assert f"min_id={sounds[2].flake_id}" in link
+
+    with app.test_request_context(f"/api/v1/timelines/drafts?since_id={sounds[3].flake_id}"):
+        assert keyset_paginate(q, Sound.flake_id, 2) == sounds[:2]
+
+    with app.test_request_context(f"/api/v1/timelines/drafts?min_id={sounds[3].flake_id}"):
+        assert keyset_paginate(q, Sound.flake_id, 2) == sounds[1:3]
+
+
+def test_public_timeline_keyset_follows_activities(app, client, session):
+    user = create_user_with_actor(session, "paginationpublic")
+    now = datetime.datetime.utcnow()
+    for i in range(4):
+        # the tracks are created in the opposite order of their activities
+        activity = Activity(
+            type="Create",
+            object_type="Audio",
+            box="outbox",
+            local=True,
+            is_public=True,
+            actor_id=user.actor[0].id,
+            creation_date=now - datetime.timedelta(minutes=i),
+        )
+        session.add(activity)
+        session.commit()
+        session.add(
+            Sound(
+                user_id=user.id,
+                title=f"pagination public {i}",
+                filename=f"pagination_public_{i}.mp3",
+                private=False,
+                transcode_state=Sound.TRANSCODE_DONE,
+                flake_id=uuid.UUID(int=current_app.flake_id.get()),
+                activity_id=activity.id,
+            )
+        )
+        session.commit()
+
+    paginated = [t["id"] for t in client.get("/api/v1/timelines/public?paginated=true&count=4").json["items"]]
+    assert len(paginated) == 4
+    first = client.get("/api/v1/timelines/public?count=2").json
+    assert [t["id"] for t in first] == paginated[:2]
+    rv = client.get(f"/api/v1/timelines/public?count=2&max_id={paginated[1]}")
+    assert [t["id"] for t in rv.json] == paginated[2:]
+    rv = client.get(f"/api/v1/timelines/public?count=2&min_id={paginated[3]}")
+    assert [t["id"] for t in rv.json] == paginated[1:3]
+    rv = client.get(f"/api/v1/timelines/public?count=2&max_id={uuid.uuid4()}")
+    assert rv.status_code == 400
+
+
+def test_paginate_without_count(app, client, session):
+    user = create_user_with_actor(session, "paginationoffset")
+    create_sounds(session, user, 5)
+    q = Sound.query.filter(Sound.user_id == user.id).order_by(Sound.flake_id.desc())
+
+    with app.test_request_context("/api/v1/timelines/drafts"):
+        page = paginate(q, 1, 2)
+        assert len(page.items) == 2
+        assert page.total is None
+        assert page.pages == 2
+        page = paginate(q, 3, 2)
+        assert len(page.items) == 1
+        assert page.pages == 3
+
+    with app.test_request_context("/api/v1/timelines/drafts?with_total=true"):
+        page = paginate(q, 1, 2)
+        assert page.total == 5
+        assert page.pages == 3
@@ -0,0 +1,82 @@
+import uuid
+
+from flask import current_app
+
+from helpers import create_user_with_actor, assert_max_queries
+from models import Sound, Activity
+from utils import json_cache
+from utils.metrics import statement_fingerprint
+
+# Queries of the key endpoints, a N+1 regression makes them grow with the number of tracks
+TIMELINE_BUDGET = 20
+TRACK_SHOW_BUDGET = 20
+
+
+def publish_tracks(session, user, count):
+    sounds = []
+    for i in range(count):
+        activity = Activity(
+            type="Create", object_type="Audio", box="outbox", local=True, is_public=True, actor_id=user.actor[0].id
+        )
+        session.add(activity)
+        session.commit()
+        sound = Sound(
+            user_id=user.id,
+            title=f"budget {i}",
+            slug=f"{user.name}-budget-{i}",
+            filename=f"budget_{user.id}_{i}.mp3",
+            private=False,
+            transcode_state=Sound.TRANSCODE_DONE,
+            flake_id=uuid.UUID(int=current_app.flake_id.get()),
+            activity_id=activity.id,
+        )
+        session.add(sound)
+        session.commit()
+        sounds.append(sound)
+    return sounds
+
+
+def public_timeline_queries(client, count):
+    # rendered, not from the json cache
+    json_cache._local().clear()
+    with assert_max_queries(TIMELINE_BUDGET) as statements:
+        rv = client.get("/api/v1/timelines/public?count=20")
+    assert rv.status_code == 200
+    assert len(rv.json) == count
+    return len(statements)
+
+
+def test_public_timeline_queries(client, session):
+    user = create_user_with_actor(session, "budgettimeline")
+    publish_tracks(session, user, 2)
+    few = public_timeline_queries(client, 2)
+    publish_tracks(session, create_user_with_actor(session, "budgettimeline2"), 8)
+    assert public_timeline_queries(client, 10) == few
+
+
+def test_track_show_queries(client, session):
+    user = create_user_with_actor(session, "budgetshow")
+    sound = publish_tracks(session, user, 1)[0]
+    json_cache._local().clear()
+    with assert_max_queries(TRACK_SHOW_BUDGET):
+        rv = client.get(f"/api/tracks/{user.name}/{sound.slug}")
+    assert rv.status_code == 200
+
+
+def test_server_timing(client, session):
+    rv = client.get(f"/.well-known/webfinger?resource=acct:nobody@{current_app.config['AP_DOMAIN']}")
+    timing = rv.headers["Server-Timing"]
+    assert timing.startswith("db;dur=")
+    assert "queries" in timing
+    assert "app;dur=" in timing
+
+
+def test_statement_fingerprint():
+    statement = (
+        "SELECT sound.id_1 FROM sound\nWHERE sound.id IN (%(id_1)s, %(id_2)s) AND sound.title = 'it''s' LIMIT 10"
+    )
+    assert (
+        statement_fingerprint(statement)
+        == "SELECT sound.id_1 FROM sound WHERE sound.id IN (?) AND sound.title = ? LIMIT ?"
+    )
+    assert statement_fingerprint(statement.replace("10", "20")) == statement_fingerprint(statement)
@@ -0,0 +1,69 @@
+import json
+import uuid
+
+from datas_helpers import to_json_relationships
+from helpers import create_user_with_actor, register
+from models import User
+
+
+def create_relations(session, me):
+    """
+    me follows followed and mutual, follower and mutual follow me, other is not related
+    """
+    users = {
+        name: create_user_with_actor(session, f"rel{name}{me.id}")
+        for name in ["followed", "follower", "mutual", "other"]
+    }
+    me.actor[0].follow(None, users["followed"].actor[0])
+    me.actor[0].follow(None, users["mutual"].actor[0])
+    users["follower"].actor[0].follow(None, me.actor[0])
+    users["mutual"].actor[0].follow(None, me.actor[0])
+    return users
+
+
+def test_to_json_relationships(session):
+    me = create_user_with_actor(session, "relme")
+    users = create_relations(session, me)
+
+    rels = to_json_relationships(me, list(users.values()))
+    assert {id: (rel["following"], rel["followed_by"]) for id, rel in rels.items()} == {
+        users["followed"].id: (True, False),
+        users["follower"].id: (False, True),
+        users["mutual"].id: (True, True),
+        users["other"].id: (False, False),
+    }
+    assert to_json_relationships(me, []) == {}
+
+
+def test_relationships(client, session):
+    resp = register(client, "dashie+relationships@sigpipe.me", "fluttershy", "UserRelationships", "User Relationships")
+    assert resp.status_code == 200
+    bearer = json.loads(resp.data)["access_token"]
+    me = User.query.filter(User.name == "UserRelationships").first()
+    users = create_relations(session, me)
+
+    # unknown and invalid ids are skipped, the known ones answered in the requested order
+    ids = [
+        users["other"].flake_id,
+        uuid.uuid4(),
+        users["mutual"].flake_id,
+        "invalid",
+        users["followed"].flake_id,
+        users["follower"].flake_id,
+    ]
+    resp = client.get(
+        "/api/v1/accounts/relationships",
+        query_string=[("id", str(id)) for id in ids],
+        headers={"Authorization": f"Bearer {bearer}"},
+    )
+    assert resp.status_code == 200
+    assert [(rel["id"], rel["following"], rel["followed_by"]) for rel in resp.json] == [
+        (users["other"].id, False, False),
+        (users["mutual"].id, True, True),
+        (users["followed"].id, True, False),
+        (users["follower"].id, False, True),
+    ]
+
+    resp = client.get("/api/v1/accounts/relationships?id=invalid", headers={"Authorization": f"Bearer {bearer}"})
+    assert resp.status_code == 200
+    assert resp.json == []
@@ -0,0 +1,50 @@
+from helpers import create_user_with_actor
+from models import Sound, SoundInfo
+from datas_helpers import to_json_tracks, tracks_load_options
+from transcoding_utils import bitrate_bps, rendition_ladder, rendition_output, save_renditions
+
+
+def test_bitrate_bps():
+    assert bitrate_bps("64k") == 64000
+    assert bitrate_bps("96K") == 96000
+    assert bitrate_bps(128000) == 128000
+
+
+def test_rendition_ladder(app, tmpdir):
+    with app.app_context():
+        app.config["RENDITIONS"] = "hls, opus,unknown"
+        ladder = rendition_ladder()
+        assert [rendition["kind"] for rendition in ladder] == ["opus", "hls"]
+
+        cmd = rendition_output(ladder[1], str(tmpdir))
+        assert cmd[-1] == str(tmpdir.join("hls", "index.m3u8"))
+        assert "-hls_time" in cmd
+        assert tmpdir.join("hls").check(dir=True)
+
+        app.config["RENDITIONS"] = ""
+        assert rendition_ladder() == []
+        app.config["RENDITIONS"] = "opus,mp3,hls"
+
+
+def test_renditions_json(app, session):
+    user = create_user_with_actor(session, "renditions")
+    sound = Sound(
+        user_id=user.id,
+        title="renditions",
+        filename="renditions.flac",
+        private=False,
+        transcode_state=Sound.TRANSCODE_DONE,
+    )
+    session.add(sound)
+    session.commit()
+    session.add(SoundInfo(sound_id=sound.id, done_basic=True))
+    with app.test_request_context():
+        save_renditions(sound, [dict(rendition, file_size=1024) for rendition in rendition_ladder()])
+        session.commit()
+
+        q = Sound.query.options(*tracks_load_options()).filter(Sound.id == sound.id)
+        renditions = to_json_tracks(q.all())[0]["reel2bits"]["renditions"]
+    assert [r["kind"] for r in renditions] == ["opus", "mp3", "hls"]
+    assert renditions[0]["bitrate"] == 64000
+    assert renditions[0]["mime_type"] == "audio/ogg"
+    assert renditions[2]["url"].endswith(f"/uploads/sounds/{user.slug}/renditions.renditions/hls/index.m3u8")
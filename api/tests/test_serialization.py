@@ -0,0 +1,137 @@
+import datetime
+import json
+import uuid
+
+from helpers import create_user_with_actor, count_queries
+from models import Sound, SoundInfo, SoundTag, Album
+from datas_helpers import to_json_tracks, tracks_load_options, to_json_albums, albums_load_options
+from utils import json_cache
+
+
+def create_tracks(session, user, album, count):
+    tag = SoundTag.query.filter(SoundTag.name == f"serialization{user.id}").first()
+    if not tag:
+        tag = SoundTag(name=f"serialization{user.id}")
+        session.add(tag)
+    for i in range(count):
+        sound = Sound(
+            user_id=user.id,
+            album_id=album.id,
+            title=f"serialization {album.title} {i}",
+            filename=f"serialization_{album.id}_{i}.mp3",
+            private=True,
+            transcode_state=Sound.TRANSCODE_DONE,
+        )
+        sound.tags.append(tag)
+        session.add(sound)
+        session.commit()
+        session.add(SoundInfo(sound_id=sound.id, waveform_peaks=b"\x00\x7f", done_basic=True, done_waveform=True))
+    session.commit()
+
+
+def serialize_tracks_page(app, user, count):
+    with app.test_request_context():
+        with count_queries() as statements:
+            q = Sound.query.options(*tracks_load_options()).filter(Sound.user_id == user.id).limit(count)
+            tracks = to_json_tracks(q.all(), user)
+    assert len(tracks) == count
+    assert tracks[0]["reel2bits"]["waveform"].endswith(f"/api/tracks/{tracks[0]['id']}/waveform")
+    assert tracks[0]["reel2bits"]["tags"] == [f"serialization{user.id}"]
+    return len(statements)
+
+
+def serialize_albums_page(app, user):
+    with app.test_request_context():
+        with count_queries() as statements:
+            q = Album.query.options(*albums_load_options()).filter(Album.user_id == user.id)
+            albums = to_json_albums(q.all(), user)
+    return albums, len(statements)
+
+
+def test_tracks_queries_count_is_flat(app, client, session):
+    small = create_user_with_actor(session, "serializationsmall")
+    big = create_user_with_actor(session, "serializationbig")
+    for user, count in ((small, 2), (big, 10)):
+        album = Album(user_id=user.id, title="serialization", private=True)
+        session.add(album)
+        session.commit()
+        create_tracks(session, user, album, count)
+    session.expire_all()
+
+    assert serialize_tracks_page(app, small, 2) == serialize_tracks_page(app, big, 10)
+
+
+def test_albums_queries_count_is_flat(app, client, session):
+    small = create_user_with_actor(session, "serializationalbsmall")
+    big = create_user_with_actor(session, "serializationalbbig")
+    for user, albums_count in ((small, 1), (big, 4)):
+        for i in range(albums_count):
+            album = Album(user_id=user.id, title=f"serialization {i}", private=True)
+            session.add(album)
+            session.commit()
+            create_tracks(session, user, album, 2)
+    session.expire_all()
+
+    small_albums, small_queries = serialize_albums_page(app, small)
+    big_albums, big_queries = serialize_albums_page(app, big)
+    assert len(small_albums) == 1
+    assert len(big_albums) == 4
+    assert [album["reel2bits"]["tracks_count"] for album in big_albums] == [2, 2, 2, 2]
+    assert small_queries == big_queries
+
+
+def test_tracks_json_cache(app, client, session):
+    user = create_user_with_actor(session, "serializationcache")
+    album = Album(user_id=user.id, title="serialization cache", private=True)
+    session.add(album)
+    session.commit()
+    create_tracks(session, user, album, 3)
+    session.expire_all()
+
+    first = serialize_tracks_page(app, user, 3)
+    # SoundInfo are not fetched anymore
+    assert serialize_tracks_page(app, user, 3) < first
+
+    track = Sound.query.filter(Sound.user_id == user.id).first()
+    track.title = "serialization cache renamed"
+    session.commit()
+    with app.test_request_context():
+        tracks = to_json_tracks([track], user)
+    assert tracks[0]["reel2bits"]["title"] == "serialization cache renamed"
+    assert tracks[0]["account"]["id"] == user.id
+
+    albums, _ = serialize_albums_page(app, user)
+    assert "serialization cache renamed" in [t["reel2bits"]["title"] for t in albums[0]["reel2bits"]["tracks"]]
+
+
+def test_albums_json_cache_tracks_version(app, client, session):
+    user = create_user_with_actor(session, "serializationalbcache")
+    album = Album(user_id=user.id, title="serialization album cache", private=True)
+    session.add(album)
+    session.commit()
+    create_tracks(session, user, album, 2)
+    session.expire_all()
+    serialize_albums_page(app, user)
+
+    # written by another process, the cache of this one is not invalidated
+    track = Sound.query.filter(Sound.album_id == album.id).first()
+    session.execute(
+        Sound.__table__.update()
+        .where(Sound.__table__.c.id == track.id)
+        .values(title="serialization album cache processed", updated=datetime.datetime.utcnow())
+    )
+    session.expire_all()
+    albums, _ = serialize_albums_page(app, user)
+    assert "serialization album cache processed" in [t["reel2bits"]["title"] for t in albums[0]["reel2bits"]["tracks"]]
+
+
+def test_json_cache_entries(app):
+    created = datetime.datetime(2020, 1, 2, 3, 4, 5, 678)
+    flake_id = uuid.uuid4()
+    json_cache.set_many("track", {-1: ((created, 2), {"id": flake_id, "created_at": created})})
+
+    # plain JSON, nothing executable
+    assert json.loads(json_cache._local()[json_cache.cache_key("track", -1)])
+    hits = json_cache.get_many("track", {-1: (created, 2)})
+    assert hits == {-1: {"id": flake_id, "created_at": created.replace(microsecond=0)}}
+    assert json_cache.get_many("track", {-1: (created + datetime.timedelta(microseconds=1), 2)}) == {}
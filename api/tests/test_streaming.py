@@ -0,0 +1,47 @@
+import asyncio
+import json
+
+from datas_helpers import to_json_tracks
+from helpers import create_user_with_actor
+from models import Sound
+from streaming import Hub, stream_of, sse_event
+from utils import streaming
+
+
+def test_stream_of():
+    assert stream_of("/api/v1/streaming/public", {}) == "public"
+    assert stream_of("/api/v1/streaming/public/local/", {}) == "public:local"
+    assert stream_of("/api/v1/streaming", {"stream": "user"}) == "user"
+    assert stream_of("/api/v1/streaming", {"stream": "direct"}) is None
+    assert stream_of("/api/v1/streaming/direct", {}) is None
+
+
+def test_hub_dispatch():
+    loop = asyncio.new_event_loop()
+    hub = Hub(loop)
+    queue = hub.subscribe("user:1")
+    data = json.dumps({"event": "processing", "payload": {"id": "abc", "status": "done"}})
+    hub.dispatch("user:1", data)
+    hub.dispatch("user:2", data)
+    assert queue.qsize() == 1
+    assert sse_event(queue.get_nowait()) == b'event: processing\ndata: {"id": "abc", "status": "done"}\n\n'
+
+    hub.unsubscribe("user:1", queue)
+    assert not hub.clients
+    loop.close()
+
+
+def test_track_event(app, session):
+    user = create_user_with_actor(session, "streamingtrack")
+    sound = Sound(user_id=user.id, title="streaming", private=False, transcode_state=Sound.TRANSCODE_DONE)
+    session.add(sound)
+    session.commit()
+
+    with app.test_request_context():
+        # dates and UUIDs
+        data = streaming.message("update", to_json_tracks([sound])[0])
+    event, payload = sse_event(data).decode().split("\n")[:2]
+    assert event == "event: update"
+    track = json.loads(payload.partition("data: ")[2])
+    assert track["id"] == str(sound.flake_id)
+    assert track["created_at"]
@@ -0,0 +1,44 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from helpers import create_user_with_actor
+from models import Sound, SoundInfo
+from utils.metrics import stage_timer
+
+
+def sample(name, stage):
+    return REGISTRY.get_sample_value(name, {"stage": stage}) or 0
+
+
+def test_stage_timer(app, session):
+    user = create_user_with_actor(session, "timingsstages")
+    sound = Sound(user_id=user.id, title="timings", file_size=4096)
+    session.add(sound)
+    session.commit()
+    session.add(SoundInfo(sound_id=sound.id, duration=120.0))
+    session.commit()
+
+    count = sample("reel2bits_track_stage_seconds_count", "waveform")
+    failures = sample("reel2bits_track_stage_failures_total", "transcode")
+
+    with stage_timer(sound, "waveform"):
+        pass
+    with stage_timer(sound, "transcode") as timer:
+        timer.failed()
+    with pytest.raises(RuntimeError):
+        with stage_timer(sound, "transcode"):
+            raise RuntimeError("ffmpeg died")
+    session.commit()
+
+    timings = sound.timings.all()
+    assert [(t.stage, t.success) for t in timings] == [("waveform", True), ("transcode", False)]
+    assert timings[0].input_size == 4096
+    assert timings[0].duration == 120.0
+    assert timings[0].elapsed >= 0
+
+    assert sample("reel2bits_track_stage_seconds_count", "waveform") == count + 1
+    assert sample("reel2bits_track_stage_realtime_ratio_count", "waveform") >= 1
+    assert sample("reel2bits_track_stage_failures_total", "transcode") == failures + 2
+
+    session.delete(sound)
+    session.commit()
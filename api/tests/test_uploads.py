@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import json
+
+from helpers import register
+from utils import uploads
+
+
+def tus_headers(bearer, **kwargs):
+    headers = {"Authorization": f"Bearer {bearer}", "Tus-Resumable": uploads.TUS_VERSION}
+    headers.update({name.replace("_", "-"): str(value) for name, value in kwargs.items()})
+    return headers
+
+
+def test_parse_metadata():
+    header = "filename {0},title {1},private".format(
+        base64.b64encode(b"track.flac").decode(), base64.b64encode("Pâté".encode()).decode()
+    )
+    metadata = uploads.parse_metadata(header)
+    assert metadata["filename"] == "track.flac"
+    assert metadata["title"] == "Pâté"
+    assert metadata["private"] == ""
+
+
+def test_resume_hasher(tmpdir):
+    path = tmpdir.join("upload.part")
+    path.write_binary(b"0123456789")
+
+    # another process received the first bytes
+    hasher = uploads.resume_hasher("resumed", str(path), 4)
+    assert hasher.hexdigest() == hashlib.sha256(b"0123").hexdigest()
+
+    hasher.update(b"4567")
+    uploads.keep_hasher("resumed", 8, hasher)
+    assert uploads.resume_hasher("resumed", str(path), 8) is hasher
+
+    # the cached one is at another offset
+    uploads.keep_hasher("resumed", 8, hasher)
+    assert uploads.resume_hasher("resumed", str(path), 10).hexdigest() == hashlib.sha256(b"0123456789").hexdigest()
+
+
+def test_resumable_upload(app, client, session, tmpdir, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOADED_SOUNDS_DEST", str(tmpdir))
+    resp = register(client, "dashie+uploads@sigpipe.me", "fluttershy", "UserUploads", "User Uploads")
+    assert resp.status_code == 200
+    bearer = json.loads(resp.data)["access_token"]
+
+    metadata = ",".join(
+        f"{key} {base64.b64encode(value.encode()).decode()}"
+        for key, value in {"filename": "track.flac", "title": "resumable", "licence": "0"}.items()
+    )
+    resp = client.post("/api/tracks/uploads", headers=tus_headers(bearer, Upload_Length=10, Upload_Metadata=metadata))
+    assert resp.status_code == 201
+    assert resp.headers["Upload-Offset"] == "0"
+    location = resp.headers["Location"]
+    assert location.endswith(f"/api/tracks/uploads/{resp.json['upload_id']}")
+
+    patch_headers = tus_headers(bearer, Content_Type="application/offset+octet-stream", Upload_Offset=0)
+    resp = client.patch(location, data=b"01234", headers=patch_headers)
+    assert resp.status_code == 204
+    assert resp.headers["Upload-Offset"] == "5"
+
+    # resumes where it was
+    resp = client.patch(location, data=b"01234", headers=patch_headers)
+    assert resp.status_code == 409
+    assert resp.headers["Upload-Offset"] == "5"
+    resp = client.head(location, headers=tus_headers(bearer))
+    assert resp.status_code == 200
+    assert resp.headers["Upload-Offset"] == "5"
+    assert resp.headers["Upload-Length"] == "10"
+
+    patch_headers["Upload-Offset"] = "5"
+    resp = client.patch(location, data=b"56789ABCDEF", headers=patch_headers)
+    assert resp.status_code == 413
+
+    resp = client.delete(location, headers=tus_headers(bearer))
+    assert resp.status_code == 204
+    resp = client.head(location, headers=tus_headers(bearer))
+    assert resp.status_code == 404
+
+
+def test_resumable_upload_invalid(app, client, session):
+    resp = register(client, "dashie+uploadsinvalid@sigpipe.me", "fluttershy", "UserUploadsInvalid", "User")
+    bearer = json.loads(resp.data)["access_token"]
+
+    resp = client.post("/api/tracks/uploads", headers=tus_headers(bearer))
+    assert resp.status_code == 400
+
+    metadata = f"filename {base64.b64encode(b'notes.txt').decode()}"
+    resp = client.post("/api/tracks/uploads", headers=tus_headers(bearer, Upload_Length=10, Upload_Metadata=metadata))
+    assert resp.status_code == 400
@@ -1,4 +1,7 @@
 from utils.various import duration_human, get_hashed_filename, strip_end
+from utils.various import waveform_peaks, waveform_from_json, waveform_to_json, waveform_pyramid
+from utils.various import WaveformAccumulator, waveform_minmax
+import array
 import time
 
 
@@ -37,3 +40,45 @@ def test_strip_end():
     ]
     for i in t:
         assert strip_end(i["text"], i["suffix"]) == i["result"]
+
+
+def test_waveform_peaks():
+    peaks = waveform_peaks([-12, 64, -128, 127, 0, 32])
+    assert peaks == bytes([0xF4, 0x40, 0x81, 0x7E, 0x00, 0x20])
+    assert waveform_peaks([0, 0]) == b"\x00\x00"
+    assert waveform_peaks([]) == b""
+
+
+def test_waveform_legacy_json():
+    peaks = waveform_from_json('{"version": 1, "bits": 8, "data": [-0.5, 1.0, 0.25, 0.0]}')
+    assert peaks == bytes([0xC0, 0x7F, 0x20, 0x00])
+    assert waveform_to_json(peaks) == {"level": 0, "bits": 8, "scale": 127, "data": "wH8gAA=="}
+
+
+def test_waveform_pyramid():
+    # 5 min/max pairs
+    peaks = bytes([0xF6, 0x0A, 0xEC, 0x14, 0xFB, 0x05, 0xE2, 0x1E, 0xFF, 0x01])
+    levels = waveform_pyramid(peaks, 2)
+    assert levels[-1] == peaks
+    assert levels[1] == bytes([0xEC, 0x14, 0xE2, 0x1E, 0xFF, 0x01])
+    assert levels[0] == bytes([0xE2, 0x1E, 0xFF, 0x01])
+    assert len(levels) == 3
+    assert waveform_pyramid(peaks, 5) == [peaks]
+
+
+def test_waveform_accumulator():
+    pcm = array.array("h", [0, 100, -200, 50, 32767, -32768, 10]).tobytes()
+    accumulator = WaveformAccumulator(2)
+    # chunks cutting the samples and the pairs
+    for start in range(0, len(pcm), 3):
+        stop = start + 3
+        accumulator.feed(pcm[start:stop])
+    peaks = accumulator.peaks()
+    assert accumulator.samples == 7
+    assert list(array.array("b", peaks)) == [0, 0, -1, 0, -127, 127, 0, 0]
+
+
+def test_waveform_minmax():
+    samples = array.array("h", [1, -2, 3, 4, -5, 6, 7])
+    assert list(waveform_minmax(samples, 3)) == [-2, 3, -5, 6, 7, 7]
+    assert list(waveform_minmax(samples, 7)) == [-5, 7]
@@ -0,0 +1,52 @@
+from helpers import create_user_with_actor
+from models import Sound, SoundInfo
+from utils.various import save_waveform_levels
+
+
+def create_track_with_waveform(session, user, private):
+    sound = Sound(
+        user_id=user.id,
+        title=f"waveform {private}",
+        filename=f"waveform_{private}.mp3",
+        private=private,
+        transcode_state=Sound.TRANSCODE_DONE,
+    )
+    session.add(sound)
+    session.commit()
+    # 1000 min/max pairs
+    peaks = bytes([0x81, 0x7F] * 1000)
+    session.add(SoundInfo(sound_id=sound.id, waveform_peaks=peaks, done_basic=True, done_waveform=True))
+    save_waveform_levels(sound.id, peaks)
+    session.commit()
+    return sound
+
+
+def test_waveform_levels(client, session):
+    user = create_user_with_actor(session, "waveformlevels")
+    sound = create_track_with_waveform(session, user, False)
+
+    resp = client.get(f"/api/tracks/{sound.flake_id}/waveform")
+    assert resp.status_code == 200
+    assert resp.json["level"] == 0
+    assert "public" in resp.headers["Cache-Control"]
+    etag = resp.headers["ETag"]
+
+    resp = client.get(f"/api/tracks/{sound.flake_id}/waveform", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+    # too big levels gives the full resolution
+    resp = client.get(f"/api/tracks/{sound.flake_id}/waveform?level=99")
+    assert resp.status_code == 200
+    assert resp.json["level"] == sound.waveforms.count() - 1
+    assert resp.headers["ETag"] != etag
+
+    resp = client.get(f"/api/tracks/{sound.flake_id}/waveform?level=-1")
+    assert resp.status_code == 400
+
+
+def test_waveform_private(client, session):
+    user = create_user_with_actor(session, "waveformprivate")
+    sound = create_track_with_waveform(session, user, True)
+
+    resp = client.get(f"/api/tracks/{sound.flake_id}/waveform")
+    assert resp.status_code == 403
@@ -0,0 +1,65 @@
+from sqlalchemy import func, select, text
+
+from helpers import create_user_with_actor
+from models import db, Sound
+from utils.locks import advisory_lock, LOCK_UPLOAD_WORKFLOW
+
+
+def test_stages_checkpoint(app, session):
+    user = create_user_with_actor(session, "workflowstages")
+    sound = Sound(user_id=user.id, title="stages")
+    session.add(sound)
+    session.commit()
+
+    assert not sound.stage_done(Sound.STAGE_FETCHED)
+
+    # the waveform can be done with the metadatas
+    sound.checkpoint(Sound.STAGE_WAVEFORM)
+    assert sound.stage_done(Sound.STAGE_FETCHED)
+    assert sound.stage_done(Sound.STAGE_METADATAS)
+    assert sound.stage_done(Sound.STAGE_WAVEFORM)
+    assert not sound.stage_done(Sound.STAGE_TRANSCODED)
+
+    # never backward
+    sound.checkpoint(Sound.STAGE_METADATAS)
+    assert sound.processing_stage == Sound.STAGE_WAVEFORM
+
+    sound.checkpoint(Sound.STAGE_NOTIFIED)
+    session.commit()
+    assert Sound.query.get(sound.id).stage_done(Sound.STAGE_FEDERATED)
+
+    session.delete(sound)
+    session.commit()
+
+
+def try_lock(key):
+    connection = db.engine.connect()
+    try:
+        locked = connection.execute(select([func.pg_try_advisory_lock(LOCK_UPLOAD_WORKFLOW, key)])).scalar()
+        if locked:
+            connection.execute(select([func.pg_advisory_unlock(LOCK_UPLOAD_WORKFLOW, key)]))
+        return locked
+    finally:
+        connection.close()
+
+
+def lock_holder_state(key):
+    query = text(
+        "SELECT a.state FROM pg_locks l JOIN pg_stat_activity a ON a.pid = l.pid"
+        " WHERE l.locktype = 'advisory' AND l.classid = :namespace AND l.objid = :key AND l.granted"
+    )
+    with db.engine.connect() as connection:
+        return connection.execute(query, namespace=LOCK_UPLOAD_WORKFLOW, key=key).scalar()
+
+
+def test_advisory_lock(app, session):
+    with advisory_lock(LOCK_UPLOAD_WORKFLOW, 4242):
+        assert not try_lock(4242)
+        # held without a transaction left open
+        assert lock_holder_state(4242) == "idle"
+        # per track
+        assert try_lock(4243)
+        # the session commits don't release it
+        session.commit()
+        assert not try_lock(4242)
+    assert try_lock(4242)
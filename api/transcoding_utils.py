@@ -1,17 +1,24 @@
 from __future__ import print_function
 
 import contextlib
+import functools
 import os
+import shutil
+import subprocess
+import tempfile
 import wave
 import time
+import uuid
 
 import mutagen
 from pymediainfo import MediaInfo
 
-from models import db, SoundInfo, Sound
-from utils.various import get_waveform, duration_human, add_user_log, generate_audio_dat_file, add_log
-from pydub import AudioSegment
-from os.path import splitext
+from models import db, SoundInfo, Sound, SoundRendition, SoundWaveform
+from utils.various import duration_human, add_user_log, add_log, determine_pps
+from utils.various import save_waveform_levels, WaveformAccumulator
+from utils import streaming, blobs
+from utils.metrics import stage_timer
+from os.path import splitext, dirname
 from flask import current_app
 
 
@@ -111,14 +118,245 @@ def get_basic_infos(fname):
     return infos
 
 
+# Known renditions: public codec name, ffmpeg encoder and muxer, and file in the renditions directory
+RENDITIONS = {
+    "opus": {"codec": "opus", "encoder": "libopus", "format": "ogg", "path": "low.ogg", "mime_type": "audio/ogg"},
+    "mp3": {"codec": "mp3", "encoder": "libmp3lame", "format": "mp3", "path": "mid.mp3", "mime_type": "audio/mpeg"},
+    "hls": {
+        "codec": "aac",
+        "encoder": "aac",
+        "format": "hls",
+        "path": "hls/index.m3u8",
+        "mime_type": "application/vnd.apple.mpegurl",
+    },
+}
+
+
+def bitrate_bps(bitrate):
+    """
+    "64k" -> 64000
+    """
+    bitrate = str(bitrate).strip().lower()
+    if bitrate.endswith("k"):
+        return int(float(bitrate[:-1]) * 1000)
+    return int(bitrate)
+
+
+def rendition_ladder():
+    """
+    The renditions enabled by the RENDITIONS config, lowest bitrate first
+    :return: a list of dicts, see RENDITIONS, with the kind and bitrate
+    """
+    ladder = []
+    for kind in current_app.config["RENDITIONS"].split(","):
+        kind = kind.strip()
+        if not kind:
+            continue
+        if kind not in RENDITIONS:
+            print(f"! Unknown rendition {kind}, ignored")
+            continue
+        bitrate = current_app.config[f"RENDITION_{kind.upper()}_BITRATE"]
+        ladder.append(dict(RENDITIONS[kind], kind=kind, bitrate=bitrate))
+    return sorted(ladder, key=lambda rendition: bitrate_bps(rendition["bitrate"]))
+
+
+def renditions_for(sound):
+    """
+    Only the local tracks get renditions, the remote ones are served as fetched
+    """
+    if sound.remote_uri:
+        return []
+    return rendition_ladder()
+
+
+def rendition_output(rendition, directory):
+    """
+    ffmpeg output options of a rendition in directory
+    """
+    path = os.path.join(directory, rendition["path"])
+    os.makedirs(dirname(path), exist_ok=True)
+    cmd = ["-vn", "-codec:a", rendition["encoder"], "-b:a", rendition["bitrate"], "-f", rendition["format"]]
+    if rendition["format"] == "hls":
+        cmd += [
+            "-hls_time",
+            str(current_app.config["RENDITION_HLS_SEGMENT"]),
+            "-hls_playlist_type",
+            "vod",
+            "-hls_segment_filename",
+            os.path.join(dirname(path), "segment_%05d.ts"),
+        ]
+    return cmd + [path]
+
+
+def rendition_size(rendition, directory):
+    """
+    Size in bytes of a rendition, with all its segments for HLS
+    """
+    path = os.path.join(directory, rendition["path"])
+    if rendition["format"] != "hls":
+        return os.path.getsize(path)
+    segments = dirname(path)
+    return sum(os.path.getsize(os.path.join(segments, name)) for name in os.listdir(segments))
+
+
+def remove_parts(tmp, tmp_dir):
+    """
+    Remove the part file and directory of a failed process_audio()
+    """
+    if tmp and os.path.exists(tmp):
+        os.unlink(tmp)
+    if tmp_dir:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def process_audio(src, rate, duration, dst=None, renditions=None, renditions_dir=None):
+    """
+    Decode src once with ffmpeg, and tee the decoded audio into:
+    - the MP3 encoder writing dst, if given, through a part file renamed on success
+    - the encoders of the renditions, if given, writing renditions_dir through a part directory
+    - a mono PCM stream read here, feeding the waveform peaks and the stats
+    Memory is bounded whatever the duration.
+    :param rate: sample rate of the PCM stream, usually the source one
+    :param duration: approximative duration in seconds, to have WAVEFORM_MAX_POINTS peaks
+    :param renditions: a list of renditions from rendition_ladder()
+    :return: a dict with the peaks, the decoded duration, the elapsed seconds,
+    the ffmpeg peak RSS in KiB and the renditions with their file_size, or None on error
+    """
+    binary = current_app.config["FFMPEG_BIN"]
+    rate = int(rate or 44100)
+    samples_per_peak = max(1, round(rate / determine_pps(duration or 0)))
+    accumulator = WaveformAccumulator(samples_per_peak)
+
+    cmd = [binary, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-i", src]
+    # unique, the tracks with the same audio (blob) can be processed at the same time
+    part = uuid.uuid4().hex
+    tmp = f"{dst}.{part}.part" if dst else None
+    if dst:
+        cmd += [
+            "-vn",
+            "-codec:a",
+            current_app.config["TRANSCODE_CODEC"],
+            "-b:a",
+            current_app.config["TRANSCODE_BITRATE"],
+            "-f",
+            "mp3",
+            tmp,
+        ]
+    tmp_dir = f"{renditions_dir}.{part}.part" if renditions else None
+    if renditions:
+        for rendition in renditions:
+            cmd += rendition_output(rendition, tmp_dir)
+    cmd += ["-vn", "-ac", "1", "-ar", str(rate), "-f", "s16le", "pipe:1"]
+
+    _start = time.time()
+    # stderr goes to a file, a full pipe would block ffmpeg while we only read stdout
+    with tempfile.TemporaryFile() as errors:
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        except OSError as e:
+            add_log("FFMPEG", "ERROR", "Cannot run {0}: {1}".format(binary, e))
+            return None
+        reaped = False
+        try:
+            for chunk in iter(functools.partial(process.stdout.read, 65536), b""):
+                accumulator.feed(chunk)
+            process.stdout.close()
+            # wait4 gives the resource usage of this child only
+            _, status, rusage = os.wait4(process.pid, 0)
+            reaped = True
+        finally:
+            if not reaped:
+                # failed while reading, ffmpeg would go on writing the part files
+                process.kill()
+                process.wait()
+                process.stdout.close()
+                remove_parts(tmp, tmp_dir)
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        errors.seek(0)
+        error_output = errors.read().decode(errors="replace")
+    elapsed = time.time() - _start
+
+    if process.returncode != 0:
+        add_log("FFMPEG", "ERROR", "Process error ({0}): {1}".format(process.returncode, error_output))
+        remove_parts(tmp, tmp_dir)
+        return None
+
+    if dst:
+        os.replace(tmp, dst)
+    if renditions:
+        # a previous processing of the track
+        shutil.rmtree(renditions_dir, ignore_errors=True)
+        os.replace(tmp_dir, renditions_dir)
+    return {
+        "peaks": accumulator.peaks(),
+        "duration": accumulator.samples / float(rate),
+        "elapsed": elapsed,
+        # ru_maxrss is in KiB on Linux
+        "max_rss": rusage.ru_maxrss,
+        "renditions": [
+            dict(rendition, file_size=rendition_size(rendition, renditions_dir)) for rendition in renditions or []
+        ],
+    }
+
+
+def save_waveform(sound, infos, peaks):
+    """
+    Store the waveform peaks and levels of the track, doesn't commit
+    """
+    print("- Our file got waveform infos: {0} peaks".format(len(peaks or b"")))
+    infos.waveform_peaks = peaks
+    save_waveform_levels(sound.id, peaks)
+    infos.waveform_error = not peaks
+    if not peaks:
+        add_user_log(
+            sound.id,
+            sound.user.id,
+            "sounds",
+            "info",
+            "Got an error when generating waveform" " for: {0} -- {1}".format(sound.id, sound.title),
+        )
+    infos.done_waveform = True
+
+
+def save_renditions(sound, renditions):
+    """
+    Replace the SoundRendition of the track, doesn't commit
+    :param renditions: the renditions returned by process_audio()
+    """
+    SoundRendition.query.filter(SoundRendition.sound_id == sound.id).delete()
+    for rendition in renditions:
+        db.session.add(
+            SoundRendition(
+                sound_id=sound.id,
+                kind=rendition["kind"],
+                codec=rendition["codec"],
+                bitrate=bitrate_bps(rendition["bitrate"]),
+                mime_type=rendition["mime_type"],
+                filename=os.path.join(sound.renditions_dirname(), rendition["path"]),
+                file_size=rendition["file_size"],
+            )
+        )
+
+
+def decoded_by_transcode(sound):
+    """
+    If work_transcode will decode the track, for the transcoding or the renditions
+    """
+    if sound.transcode_state != Sound.TRANSCODE_WAITING:
+        return False
+    return bool(sound.transcode_needed or renditions_for(sound))
+
+
 def work_transcode(sound_id):
     sound = Sound.query.get(sound_id)
     if not sound:
         print("- Cant find sound ID {id} in database".format(id=sound_id))
         return
-    if not sound.transcode_needed:
+    renditions = renditions_for(sound)
+    if not sound.transcode_needed and not renditions:
         print("- Sound ID {id} doesn't need transcoding".format(id=sound_id))
         sound.transcode_state = Sound.TRANSCODE_DONE
+        sound.checkpoint(Sound.STAGE_TRANSCODED)
         db.session.commit()
         add_user_log(
             sound.id,
@@ -127,6 +365,7 @@ def work_transcode(sound_id):
             "info",
             "Transcoding not needed for: {0} -- {1}".format(sound.id, sound.title),
         )
+        streaming.publish_processing(sound, "transcode", "done")
         return
     if not sound.transcode_state == Sound.TRANSCODE_WAITING:
         print("- Sound ID {id} transcoding != TRANSCODE_WAITING".format(id=sound_id))
@@ -136,38 +375,156 @@ def work_transcode(sound_id):
     add_user_log(
         sound.id, sound.user.id, "sounds", "info", "Transcoding started for: {0} -- {1}".format(sound.id, sound.title)
     )
+    streaming.publish_processing(sound, "transcode", "started")
 
-    fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], sound.user.slug, sound.filename)
+    fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], sound.uploads_dirname(), sound.filename)
     _file, _ext = splitext(fname)
+    dst = "{0}.mp3".format(_file) if sound.transcode_needed else None
+    renditions_dir = os.path.join(dirname(fname), sound.renditions_dirname())
 
-    _start = time.time()
-
-    a = AudioSegment.from_file(fname)
-    a.export("{0}.mp3".format(_file), format="mp3", bitrate="196k")
+    info = sound.sound_infos.first()
 
-    print("From: {0}".format(fname))
-    print("Transcoded: {0}.mp3".format(_file))
-    elapsed = time.time() - _start
-    print("Transcoding done: ({0}) {1}".format(elapsed, duration_human(elapsed)))
+    # the waveform, the decoded duration and the renditions come from the same decoding
+    with stage_timer(sound, "transcode") as timer:
+        stats = process_audio(
+            fname, info.rate, info.duration, dst=dst, renditions=renditions, renditions_dir=renditions_dir
+        )
+        if not stats and renditions:
+            # the renditions are optional, the track is still playable without them
+            add_user_log(
+                sound.id,
+                sound.user.id,
+                "sounds",
+                "error",
+                "Renditions failed for: {0} -- {1}".format(sound.id, sound.title),
+            )
+            stats = process_audio(fname, info.rate, info.duration, dst=dst)
+        if not stats:
+            timer.failed()
+    if not stats and sound.transcode_needed:
+        sound.transcode_state = Sound.TRANSCODE_ERROR
+        db.session.commit()
+        add_user_log(
+            sound.id,
+            sound.user.id,
+            "sounds",
+            "error",
+            "Transcoding failed for: {0} -- {1}".format(sound.id, sound.title),
+        )
+        streaming.publish_processing(sound, "transcode", "error")
+        return False
 
-    sound.transcode_state = Sound.TRANSCODE_DONE
+    if stats:
+        elapsed = stats["elapsed"]
+        print("From: {0}".format(fname))
+        print("Renditions: {0}".format(", ".join(r["kind"] for r in stats["renditions"]) or "none"))
+        print(
+            "Transcoding done: ({0}) {1}, peak RSS {2} KiB".format(elapsed, duration_human(elapsed), stats["max_rss"])
+        )
+        info.duration = stats["duration"]
+    save_waveform(sound, info, stats["peaks"] if stats else None)
+    save_renditions(sound, stats["renditions"] if stats else [])
 
-    info = sound.sound_infos.first()
-    info.done_waveform = False
+    if sound.transcode_needed:
+        print("Transcoded: {0}".format(dst))
+        _a, _b = splitext(sound.filename)
+        sound.filename_transcoded = "{0}.mp3".format(_a)
 
-    _a, _b = splitext(sound.filename)
-    sound.filename_transcoded = "{0}.mp3".format(_a)
+        sound.transcode_file_size = os.path.getsize(dst)
 
-    sound.transcode_file_size = os.path.getsize(f"{_file}.mp3")
+        # recompute user quota
+        sound.user.quota_count = sound.user.quota_count + sound.transcode_file_size
 
-    # recompute user quota
-    sound.user.quota_count = sound.user.quota_count + sound.transcode_file_size
+    sound.transcode_state = Sound.TRANSCODE_DONE
+    # in the same transaction than the quota, a resumed workflow doesn't account it twice
+    sound.checkpoint(Sound.STAGE_TRANSCODED)
 
     db.session.commit()
 
     add_user_log(
         sound.id, sound.user.id, "sounds", "info", "Transcoding finished for: {0} -- {1}".format(sound.id, sound.title)
     )
+    streaming.publish_processing(sound, "transcode", "done")
+
+
+# SoundInfo columns of a track copied to the tracks with the same audio
+REUSED_INFOS = [
+    "duration",
+    "format",
+    "rate",
+    "channels",
+    "codec",
+    "waveform_peaks",
+    "waveform_error",
+    "bitrate",
+    "bitrate_mode",
+    "type",
+    "type_human",
+    "done_basic",
+    "done_waveform",
+]
+
+
+def reuse_processing(sound_id):
+    """
+    Copy the processing of another track with the same audio (blob): infos, waveform, transcoding
+    and renditions, instead of decoding it again.
+    :return: True if reused, False if there is no processed track with the same audio
+    """
+    sound = Sound.query.get(sound_id)
+    if not sound:
+        print("- Cant find sound ID {id} in database".format(id=sound_id))
+        return False
+    twin = blobs.processed_twin(sound)
+    twin_infos = twin.sound_infos.first() if twin else None
+    if not twin_infos or not twin_infos.done_basic:
+        return False
+
+    print("- Same audio as sound ID {id}, reusing its processing".format(id=twin.id))
+    infos = sound.sound_infos.first()
+    if not infos:
+        infos = SoundInfo(sound_id=sound.id)
+    for column in REUSED_INFOS:
+        setattr(infos, column, getattr(twin_infos, column))
+    db.session.add(infos)
+
+    SoundWaveform.query.filter(SoundWaveform.sound_id == sound.id).delete()
+    for level in twin.waveforms:
+        db.session.add(SoundWaveform(sound_id=sound.id, level=level.level, peaks=level.peaks, etag=level.etag))
+
+    SoundRendition.query.filter(SoundRendition.sound_id == sound.id).delete()
+    for rendition in twin.renditions:
+        db.session.add(
+            SoundRendition(
+                sound_id=sound.id,
+                kind=rendition.kind,
+                codec=rendition.codec,
+                bitrate=rendition.bitrate,
+                mime_type=rendition.mime_type,
+                filename=rendition.filename,
+                file_size=rendition.file_size,
+            )
+        )
+
+    sound.transcode_needed = twin.transcode_needed
+    if twin.transcode_needed:
+        sound.filename_transcoded = twin.filename_transcoded
+        sound.transcode_file_size = twin.transcode_file_size
+        # recompute user quota, the transcoded file is shared but accounted to each user
+        sound.user.quota_count = sound.user.quota_count + sound.transcode_file_size
+    sound.transcode_state = Sound.TRANSCODE_DONE
+    sound.checkpoint(Sound.STAGE_TRANSCODED)
+    db.session.commit()
+
+    add_user_log(
+        sound.id,
+        sound.user.id,
+        "sounds",
+        "info",
+        "Processing reused from the same audio for: {0} -- {1}".format(sound.id, sound.title),
+    )
+    streaming.publish_processing(sound, "transcode", "done")
+    return True
 
 
 def work_metadatas(sound_id, force=False):
@@ -184,6 +541,7 @@ def work_metadatas(sound_id, force=False):
         "info",
         "Metadatas gathering started for: {0} -- {1}".format(sound.id, sound.title),
     )
+    streaming.publish_processing(sound, "metadatas", "started")
 
     _infos = sound.sound_infos.first()
 
@@ -193,18 +551,19 @@ def work_metadatas(sound_id, force=False):
 
     # Generate Basic infos
 
-    if not sound.remote_uri:
-        fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], sound.user.slug, sound.filename)
-    else:
-        fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], f"remote_{sound.user.slug}", sound.filename)
+    fname = os.path.join(current_app.config["UPLOADED_SOUNDS_DEST"], sound.uploads_dirname(), sound.filename)
 
     basic_infos = None
     if not _infos.done_basic:
-        basic_infos = get_basic_infos(fname)
-        if type(basic_infos) != dict:
+        with stage_timer(sound, "probe") as timer:
+            basic_infos = get_basic_infos(fname)
+            if not isinstance(basic_infos, dict):
+                timer.failed()
+        if not isinstance(basic_infos, dict):
             # cannot process further
             print(f"- MIME: '{basic_infos}' is not supported")
             add_log("global", "ERROR", f"Unsupported audio format: {basic_infos}")
+            streaming.publish_processing(sound, "metadatas", "error")
             return False
 
     if not _infos.done_basic or force:
@@ -222,36 +581,20 @@ def work_metadatas(sound_id, force=False):
         _infos.type_human = basic_infos["type_human"]
 
     if not _infos.done_waveform or force:
-        if sound.transcode_state == Sound.TRANSCODE_DONE:
-            _f, _e = splitext(fname)
-            fname_t = "{0}.mp3".format(_f)
-            print("- WORKING ON TRANSCODED FOR WAVEFORM")
+        if decoded_by_transcode(sound):
+            # generated by work_transcode, decoding only once
+            print("- WAVEFORM WILL BE GENERATED WHILE TRANSCODING")
         else:
-            fname_t = fname
-
-        print("- GENERATING AUDIO DAT FILE")
-        dat_file_name = generate_audio_dat_file(fname_t, _infos.duration)
-
-        print("- WORKING WAVEFORM on {0}, {1}".format(sound.id, sound.filename))
-        waveform_infos = get_waveform(dat_file_name, _infos.duration)
-        print("- Our file got waveform infos: {0}".format(waveform_infos))
-        _infos.waveform = waveform_infos
-        if not waveform_infos:
-            _infos.waveform_error = True
-            add_user_log(
-                sound.id,
-                sound.user.id,
-                "sounds",
-                "info",
-                "Got an error when generating waveform" " for: {0} -- {1}".format(sound.id, sound.title),
-            )
-
-        # Delete the temporary dat file
-        os.unlink(dat_file_name)
-
-        _infos.done_waveform = True
+            print("- WORKING WAVEFORM on {0}, {1}".format(sound.id, sound.filename))
+            with stage_timer(sound, "waveform") as timer:
+                stats = process_audio(fname, _infos.rate, _infos.duration)
+                if not stats:
+                    timer.failed()
+            save_waveform(sound, _infos, stats["peaks"] if stats else None)
 
     db.session.add(_infos)
+    # the waveform is deferred to work_transcode when it decodes the track
+    sound.checkpoint(Sound.STAGE_WAVEFORM if _infos.done_waveform else Sound.STAGE_METADATAS)
     db.session.commit()
 
     add_user_log(
@@ -261,4 +604,5 @@ def work_metadatas(sound_id, force=False):
         "info",
         "Metadatas gathering finished for: {0} -- {1}".format(sound.id, sound.title),
     )
+    streaming.publish_processing(sound, "metadatas", "done")
     return True
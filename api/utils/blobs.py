@@ -0,0 +1,65 @@
+# Content addressed store of the audio files, by SHA-256, see models.SoundBlob
+# The same audio uploaded or federated twice is stored, processed and transcoded once.
+import functools
+import hashlib
+import os
+from os.path import splitext
+
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, on_commit, Sound, SoundBlob
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, 1048576), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store(path, sha256=None):
+    """
+    Move an audio file into the store, or drop it if the same audio is already stored,
+    and take a reference on its blob, doesn't commit, the file is moved once committed.
+    The reference is dropped when the track is deleted, see models.release_sound_blob()
+    :param sha256: the hash of the file if already known
+    :return: the SoundBlob
+    """
+    sha256 = sha256 or file_sha256(path)
+    _, ext = splitext(path)
+    blobs = SoundBlob.__table__
+    # the row stays locked until the commit, a concurrent release of the blob waits for it
+    stmt = insert(blobs).values(
+        sha256=sha256, filename=f"{sha256}{ext.lower()}", file_size=os.path.getsize(path), refcount=1
+    )
+    stmt = stmt.on_conflict_do_update(index_elements=[blobs.c.sha256], set_={"refcount": blobs.c.refcount + 1})
+    blob_id = db.session.execute(stmt.returning(blobs.c.id)).scalar()
+    blob = SoundBlob.query.populate_existing().get(blob_id)
+
+    on_commit(db.session, move_into_store, path, blob.path())
+    return blob
+
+
+def move_into_store(path, target):
+    if os.path.isfile(target):
+        print(f"- Same audio already stored as {os.path.basename(target)}")
+        os.unlink(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+
+def processed_twin(sound):
+    """
+    :return: another track of the same blob, already processed, or None
+    """
+    if not sound.blob_id:
+        return None
+    return (
+        Sound.query.filter(
+            Sound.blob_id == sound.blob_id, Sound.id != sound.id, Sound.transcode_state == Sound.TRANSCODE_DONE
+        )
+        .order_by(Sound.id.asc())
+        .first()
+    )
@@ -0,0 +1,93 @@
+# Home timelines are materialized on write: a published track is pushed to the
+# home timeline of its author and of every local follower of the author,
+# each timeline is trimmed to HOME_TIMELINE_MAX_LENGTH tracks.
+# Reading one is a range scan on (user_id, flake_id).
+from flask import current_app
+from sqlalchemy import text as sa_text
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, Actor, Follower, HomeTimeline, Sound, User
+
+
+def _max_length():
+    return int(current_app.config["HOME_TIMELINE_MAX_LENGTH"])
+
+
+def local_followers_ids(actor_id):
+    """
+    :return: ids of the local users following actor_id
+    """
+    q = (
+        db.session.query(User.id)
+        .join(Actor, Actor.user_id == User.id)
+        .join(Follower, Follower.actor_id == Actor.id)
+        .filter(Follower.target_id == actor_id, User.local.is_(True))
+    )
+    return [user_id for user_id, in q]
+
+
+def trim(user_ids):
+    """
+    Keep only the HOME_TIMELINE_MAX_LENGTH newest entries of each user timeline
+    """
+    if not user_ids:
+        return
+    db.session.execute(
+        sa_text(
+            "DELETE FROM home_timeline h USING ("
+            "SELECT u.id AS user_id, (SELECT t.flake_id FROM home_timeline t WHERE t.user_id = u.id "
+            "ORDER BY t.flake_id DESC OFFSET :length LIMIT 1) AS oldest "
+            "FROM unnest(CAST(:user_ids AS integer[])) AS u(id)"
+            ") c WHERE h.user_id = c.user_id AND h.flake_id <= c.oldest"
+        ),
+        {"length": _max_length(), "user_ids": list(user_ids)},
+    )
+
+
+def fanout(sound):
+    """
+    Push a track to the home timelines of its author, if local, and of the local followers of its author
+    Commits.
+    """
+    if sound.private:
+        return
+    author = sound.user
+    user_ids = set(local_followers_ids(author.actor[0].id)) if author.actor else set()
+    if author.local:
+        user_ids.add(author.id)
+    if not user_ids:
+        return
+
+    entries = [{"user_id": user_id, "sound_id": sound.id, "flake_id": sound.flake_id} for user_id in user_ids]
+    db.session.execute(insert(HomeTimeline.__table__).values(entries).on_conflict_do_nothing())
+    trim(user_ids)
+    db.session.commit()
+
+
+def rebuild(user):
+    """
+    Rebuild the home timeline of an user from the tracks of itself and of the actors it follows,
+    needed after a new follow or unfollow.
+    Commits.
+    """
+    followed_users = (
+        db.session.query(Actor.user_id)
+        .join(Follower, Follower.target_id == Actor.id)
+        .filter(Follower.actor_id.in_(db.session.query(Actor.id).filter(Actor.user_id == user.id)))
+    )
+    tracks = (
+        db.session.query(Sound.id, Sound.flake_id)
+        .filter(
+            db.or_(Sound.user_id == user.id, Sound.user_id.in_(followed_users)),
+            Sound.private.is_(False),
+            Sound.transcode_state == Sound.TRANSCODE_DONE,
+        )
+        .order_by(Sound.flake_id.desc())
+        .limit(_max_length())
+    )
+
+    HomeTimeline.query.filter(HomeTimeline.user_id == user.id).delete(synchronize_session=False)
+    entries = [{"user_id": user.id, "sound_id": sound_id, "flake_id": flake_id} for sound_id, flake_id in tracks]
+    if entries:
+        db.session.execute(insert(HomeTimeline.__table__).values(entries))
+    db.session.commit()
@@ -0,0 +1,60 @@
+# Process-wide HTTP client of the federation deliveries and the remote fetches
+# One requests Session per process, its connection pools are kept per host with keep-alive,
+# so the deliveries to the same instance reuse the TCP and TLS connections.
+import os
+import threading
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """
+    The Session of this process, created again after a fork (Celery prefork workers)
+    since the connections cannot be shared between processes.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                adapter = HTTPAdapter(
+                    # hosts with a pool kept, least recently used ones are closed
+                    pool_connections=int(current_app.config["HTTP_POOL_HOSTS"]),
+                    # idle connections kept per host
+                    pool_maxsize=int(current_app.config["HTTP_POOL_SIZE"]),
+                )
+                new_session = requests.Session()
+                new_session.mount("https://", adapter)
+                new_session.mount("http://", adapter)
+                _session, _session_pid = new_session, pid
+    return _session
+
+
+def timeout():
+    """
+    (connect, read) timeouts in seconds, the read one is between two received bytes, not for the whole response
+    """
+    return float(current_app.config["HTTP_CONNECT_TIMEOUT"]), float(current_app.config["HTTP_READ_TIMEOUT"])
+
+
+def get(url, **kwargs):
+    """
+    requests.get() through the pooled session, with the default timeouts.
+    A stream=True response must be closed to give back its connection, use it as a context manager.
+    """
+    kwargs.setdefault("timeout", timeout())
+    return session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    """
+    requests.post() through the pooled session, with the default timeouts
+    """
+    kwargs.setdefault("timeout", timeout())
+    return session().post(url, **kwargs)
@@ -0,0 +1,113 @@
+# Cache of the viewer independent part of serialized tracks and albums
+# Stored in Redis if JSON_CACHE_REDIS_URL is set, else in a per-process LRU,
+# which is also used as a fallback if Redis is unreachable.
+# Entries are stored with the version of the row they were rendered from,
+# a cached object with another version is a miss.
+# Stored as tagged JSON [version, body], like the Flask session, keeping the datetimes and UUIDs of the bodies,
+# the version as a string since the tagged datetimes are to the second.
+import json
+
+import redis
+from cachetools import TTLCache
+from flask import current_app
+from flask.json.tag import TaggedJSONSerializer
+
+_local_cache = None
+_redis_client = None
+_serializer = TaggedJSONSerializer()
+
+
+def _local():
+    global _local_cache
+    if _local_cache is None:
+        _local_cache = TTLCache(
+            maxsize=int(current_app.config["JSON_CACHE_LOCAL_SIZE"]), ttl=int(current_app.config["JSON_CACHE_TTL"])
+        )
+    return _local_cache
+
+
+def _redis():
+    global _redis_client
+    url = current_app.config["JSON_CACHE_REDIS_URL"]
+    if not url:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis_client
+
+
+def cache_key(kind, obj_id):
+    return f"reel2bits:json:{kind}:{obj_id}"
+
+
+def version_key(version):
+    return json.dumps(version, default=str)
+
+
+def get_many(kind, versions):
+    """
+    Fetch cached objects in one round-trip
+    :param versions: a dict of {obj_id: version}
+    :return: a dict of {obj_id: obj} of the hits, objects are fresh copies
+    """
+    if not versions:
+        return {}
+    keys = [cache_key(kind, obj_id) for obj_id in versions]
+    client = _redis()
+    raws = None
+    if client:
+        try:
+            raws = client.mget(keys)
+        except redis.exceptions.RedisError as e:
+            current_app.logger.warning(f"json cache: redis unavailable, using local cache: {e}")
+    if raws is None:
+        local = _local()
+        raws = [local.get(key) for key in keys]
+
+    hits = {}
+    for obj_id, raw in zip(versions, raws):
+        if raw is None:
+            continue
+        try:
+            version, obj = _serializer.loads(raw)
+        except ValueError:
+            # entry of a previous format
+            continue
+        if version == version_key(versions[obj_id]):
+            hits[obj_id] = obj
+    return hits
+
+
+def set_many(kind, objs):
+    """
+    Store objects
+    :param objs: a dict of {obj_id: (version, obj)}
+    """
+    if not objs:
+        return
+    raws = {
+        cache_key(kind, obj_id): _serializer.dumps([version_key(version), obj])
+        for obj_id, (version, obj) in objs.items()
+    }
+    client = _redis()
+    if client:
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, raw in raws.items():
+                pipe.set(key, raw, ex=int(current_app.config["JSON_CACHE_TTL"]))
+            pipe.execute()
+            return
+        except redis.exceptions.RedisError as e:
+            current_app.logger.warning(f"json cache: redis unavailable, using local cache: {e}")
+    _local().update(raws)
+
+
+def invalidate(kind, obj_id):
+    key = cache_key(kind, obj_id)
+    _local().pop(key, None)
+    client = _redis()
+    if client:
+        try:
+            client.delete(key)
+        except redis.exceptions.RedisError as e:
+            current_app.logger.warning(f"json cache: cannot invalidate {key}: {e}")
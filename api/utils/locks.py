@@ -0,0 +1,28 @@
+# PostgreSQL advisory locks, serializing work between the workers without locking any row
+from contextlib import contextmanager
+
+from sqlalchemy import func, select
+
+from models import db
+
+# first key of the two-keys locks, the second one is the id of the locked object
+LOCK_UPLOAD_WORKFLOW = 1
+
+
+@contextmanager
+def advisory_lock(namespace, key):
+    """
+    Hold a session advisory lock, waiting for the worker holding it if any.
+    It has its own connection since the session commits (and releases its connection) in between,
+    the lock is also released by PostgreSQL if the worker dies.
+    The connection is in autocommit, not left idle in a transaction while the lock is held.
+    """
+    connection = db.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        connection.execute(select([func.pg_advisory_lock(namespace, key)]))
+        try:
+            yield
+        finally:
+            connection.execute(select([func.pg_advisory_unlock(namespace, key)]))
+    finally:
+        connection.close()
@@ -0,0 +1,331 @@
+# Prometheus metrics of the app, the workers and the upload workflow stages
+# Served by /metrics for the web app and by an exporter in each Celery worker, see init_app() and init_celery().
+# Workers with several processes need the prometheus_multiproc_dir environment variable, an empty directory
+# where each process writes its metrics, merged by the exporter.
+import collections
+import hmac
+import os
+import re
+import time
+from urllib.parse import urlparse
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context, current_app, Response
+import redis
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST
+from prometheus_client import generate_latest, start_http_server, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import db, SoundBlob, SoundTiming
+
+# seconds, from a small probe to the transcoding of a long DJ mix
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+# seconds of processing per second of audio, way above 1 is a pathological file
+RATIO_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# bytes
+SIZE_BUCKETS = (1 << 20, 5 << 20, 10 << 20, 25 << 20, 50 << 20, 100 << 20, 250 << 20, 500 << 20, 1 << 30)
+# queries per request
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# values in the statements, bound parameters, quoted strings and numbers, then lists of them
+FINGERPRINT_VALUES = re.compile(r"%\(\w+\)s|%s|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+FINGERPRINT_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+track_stage_seconds = Histogram(
+    "reel2bits_track_stage_seconds",
+    "Time spent by a track in an upload workflow stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+track_stage_realtime_ratio = Histogram(
+    "reel2bits_track_stage_realtime_ratio",
+    "Time spent by a track in an upload workflow stage per second of audio",
+    ["stage"],
+    buckets=RATIO_BUCKETS,
+)
+track_stage_input_bytes = Histogram(
+    "reel2bits_track_stage_input_bytes",
+    "Size of the track processed by an upload workflow stage",
+    ["stage"],
+    buckets=SIZE_BUCKETS,
+)
+track_stage_failures = Counter("reel2bits_track_stage_failures_total", "Upload workflow stages which failed", ["stage"])
+
+http_request_seconds = Histogram(
+    "reel2bits_http_request_seconds", "Time spent handling a request", ["method", "endpoint", "status"]
+)
+http_request_queries = Histogram(
+    "reel2bits_http_request_queries", "Database queries of a request", ["endpoint"], buckets=QUERIES_BUCKETS
+)
+http_request_db_seconds = Histogram(
+    "reel2bits_http_request_db_seconds", "Time spent in the database queries of a request", ["endpoint"]
+)
+
+celery_task_seconds = Histogram(
+    "reel2bits_celery_task_seconds", "Time spent running a Celery task", ["task", "state"], buckets=STAGE_BUCKETS
+)
+celery_task_failures = Counter("reel2bits_celery_task_failures_total", "Celery tasks which raised", ["task"])
+celery_task_retries = Counter("reel2bits_celery_task_retries_total", "Celery tasks retried", ["task"])
+
+federation_deliveries = Counter(
+    "reel2bits_federation_deliveries_total", "Activities posted to remote inboxes", ["host", "outcome"]
+)
+# posts of the delivery worker, signature included
+federation_delivery_seconds = Histogram(
+    "reel2bits_federation_delivery_seconds",
+    "Time spent posting an activity to a remote inbox",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+# the ratio of both is the fan-out reduction of the shared inboxes
+federation_fanout_recipients = Counter(
+    "reel2bits_federation_fanout_recipients_total", "Remote actors addressed by the outgoing activities"
+)
+federation_fanout_inboxes = Counter(
+    "reel2bits_federation_fanout_inboxes_total", "Inboxes posted to for the outgoing activities, shared ones collapsed"
+)
+
+
+def registry():
+    """
+    The registry to expose, merging the metrics files of all the processes in multiprocess mode
+    """
+    if "prometheus_multiproc_dir" not in os.environ:
+        return REGISTRY
+    merged = CollectorRegistry()
+    multiprocess.MultiProcessCollector(merged)
+    return merged
+
+
+# Database queries, counted and timed for the request being handled if any
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop(-1)
+    if has_request_context() and "db_queries" in g:
+        g.db_queries += 1
+        g.db_time += elapsed
+        if "db_statements" in g:
+            g.db_statements.append(statement)
+
+
+def statement_fingerprint(statement):
+    """
+    Statement without its values, the same query with other parameters has the same fingerprint
+    """
+    fingerprint = FINGERPRINT_VALUES.sub("?", statement)
+    fingerprint = FINGERPRINT_LISTS.sub("(?)", fingerprint)
+    return " ".join(fingerprint.split())
+
+
+def server_timing(elapsed, queries, db_time):
+    """
+    Server-Timing header value of the request, durations in milliseconds
+    """
+    return f'db;dur={db_time * 1000:.1f};desc="{queries} queries", app;dur={elapsed * 1000:.1f}'
+
+
+def check_query_budget(queries, db_time, statements):
+    """
+    Log the fingerprints of the statements of a request over QUERY_BUDGET, the most repeated first
+    """
+    budget = int(current_app.config["QUERY_BUDGET"])
+    if queries <= budget:
+        return
+    fingerprints = collections.Counter(statement_fingerprint(statement) for statement in statements)
+    current_app.logger.warning(
+        "Query budget exceeded by %s %s: %d queries (budget %d) in %.1fms\n%s",
+        request.method,
+        request.path,
+        queries,
+        budget,
+        db_time * 1000,
+        "\n".join(f"{count} x {fingerprint}" for fingerprint, count in fingerprints.most_common()),
+    )
+
+
+def start_request():
+    g.request_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_time = 0.0
+    if current_app.config["QUERY_BUDGET_ENABLED"]:
+        g.db_statements = []
+
+
+def end_request(response):
+    if "request_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    if current_app.config["METRICS_ENABLED"]:
+        endpoint = request.endpoint or "none"
+        http_request_seconds.labels(request.method, endpoint, response.status_code).observe(elapsed)
+        http_request_queries.labels(endpoint).observe(g.db_queries)
+        http_request_db_seconds.labels(endpoint).observe(g.db_time)
+    if "db_statements" in g:
+        response.headers.add("Server-Timing", server_timing(elapsed, g.db_queries, g.db_time))
+        check_query_budget(g.db_queries, g.db_time, g.db_statements)
+    return response
+
+
+def metrics():
+    token = current_app.config["METRICS_TOKEN"]
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return Response("unauthorized", status=401)
+    return Response(generate_latest(registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """
+    Time the requests and serve /metrics if METRICS_ENABLED,
+    count their queries against QUERY_BUDGET and add a Server-Timing header if QUERY_BUDGET_ENABLED
+    """
+    if not app.config["METRICS_ENABLED"] and not app.config["QUERY_BUDGET_ENABLED"]:
+        return
+    # first and last hooks, to include the other ones
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+    app.after_request(end_request)
+    if app.config["METRICS_ENABLED"]:
+        app.add_url_rule("/metrics", "metrics", metrics)
+
+
+class QueuesCollector(object):
+    """
+    Pending messages of the Celery queues, read from the Redis broker at each scrape
+    """
+
+    def __init__(self, broker_url, queues):
+        self.redis = redis.Redis.from_url(broker_url)
+        self.queues = queues
+
+    def collect(self):
+        depth = GaugeMetricFamily(
+            "reel2bits_celery_queue_depth", "Messages waiting in a Celery queue", labels=["queue"]
+        )
+        for queue in self.queues:
+            depth.add_metric([queue], self.redis.llen(queue))
+        yield depth
+
+
+def init_celery(celery, queues):
+    """
+    Time the tasks and start the exporter of the worker on METRICS_WORKER_PORT, if set
+    """
+    from celery import signals
+
+    started = {}
+
+    @signals.task_prerun.connect(weak=False)
+    def task_prerun(task_id=None, **kwargs):
+        started[task_id] = time.perf_counter()
+
+    @signals.task_postrun.connect(weak=False)
+    def task_postrun(task_id=None, task=None, state=None, **kwargs):
+        start = started.pop(task_id, None)
+        if start is not None:
+            celery_task_seconds.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - start)
+
+    @signals.task_failure.connect(weak=False)
+    def task_failure(sender=None, **kwargs):
+        celery_task_failures.labels(sender.name).inc()
+
+    @signals.task_retry.connect(weak=False)
+    def task_retry(sender=None, **kwargs):
+        celery_task_retries.labels(sender.name).inc()
+
+    @signals.worker_init.connect(weak=False)
+    def start_exporter(**kwargs):
+        port = int(celery.conf.get("METRICS_WORKER_PORT") or 0)
+        if not port:
+            return
+        directory = os.environ.get("prometheus_multiproc_dir")
+        if directory:
+            # files of the previous run
+            for name in os.listdir(directory):
+                if name.endswith(".db"):
+                    os.unlink(os.path.join(directory, name))
+        exported = registry()
+        broker_url = celery.conf.get("CELERY_BROKER_URL") or ""
+        if broker_url.startswith("redis"):
+            exported.register(QueuesCollector(broker_url, queues))
+        start_http_server(port, registry=exported)
+        print(f" * Metrics exporter listening on port {port}")
+
+    @signals.worker_process_shutdown.connect(weak=False)
+    def process_shutdown(pid=None, **kwargs):
+        if "prometheus_multiproc_dir" in os.environ:
+            multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def delivery_outcome(to, outcome):
+    """
+    Count an activity posted to a remote inbox, by remote host
+    """
+    federation_deliveries.labels(urlparse(to).netloc, outcome).inc()
+
+
+def sound_input_size(sound):
+    """
+    Size of the original audio file of a track, the remote ones only have it on their blob
+    """
+    if sound.file_size:
+        return sound.file_size
+    if sound.blob_id:
+        return SoundBlob.query.get(sound.blob_id).file_size
+    return None
+
+
+def sound_duration(sound):
+    infos = sound.sound_infos.first()
+    return infos.duration if infos else None
+
+
+def record_stage(sound, stage, elapsed, success=True):
+    """
+    Store the timing of a stage for the track and observe the histograms, doesn't commit.
+    """
+    timing = SoundTiming(
+        sound_id=sound.id,
+        stage=stage,
+        elapsed=elapsed,
+        input_size=sound_input_size(sound),
+        duration=sound_duration(sound),
+        success=success,
+    )
+    db.session.add(timing)
+
+    track_stage_seconds.labels(stage).observe(elapsed)
+    if timing.input_size:
+        track_stage_input_bytes.labels(stage).observe(timing.input_size)
+    if timing.duration:
+        track_stage_realtime_ratio.labels(stage).observe(elapsed / timing.duration)
+    if not success:
+        track_stage_failures.labels(stage).inc()
+    return timing
+
+
+class StageTimer(object):
+    success = True
+
+    def failed(self):
+        self.success = False
+
+
+@contextmanager
+def stage_timer(sound, stage):
+    """
+    Time the block as a stage of the track, see record_stage(), the block flags a failure with timer.failed().
+    An exception is only counted, the session may not be usable anymore.
+    """
+    timer = StageTimer()
+    start = time.perf_counter()
+    try:
+        yield timer
+    except Exception:
+        track_stage_failures.labels(stage).inc()
+        raise
+    record_stage(sound, stage, time.perf_counter() - start, timer.success)
@@ -0,0 +1,121 @@
+import math
+import uuid
+
+from flask import abort, jsonify, request, url_for
+from sqlalchemy import tuple_
+
+# Mastodon-like cursors, the items are newest first
+# max_id: older than, since_id: newer than, min_id: immediately newer than
+CURSORS = ("max_id", "min_id", "since_id")
+
+
+class Page(object):
+    """
+    Same interface as the flask_sqlalchemy Pagination, without the COUNT(*).
+    If total is unknown, pages is approximated: one more page as long as there are items after this one.
+    """
+
+    def __init__(self, items, page, per_page, total, has_next):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.has_next = has_next
+
+    @property
+    def pages(self):
+        if self.total is not None:
+            return int(math.ceil(self.total / float(self.per_page))) if self.per_page else 0
+        return self.page + 1 if self.has_next else self.page
+
+
+def paginate(q, page, per_page, total=None):
+    """
+    OFFSET pagination fetching one more row to know if there is a next page instead of counting.
+    total can be given when known from a counter, or computed with a COUNT(*) with ?with_total=true
+    """
+    if total is None and request.args.get("with_total", "false").lower() in ["true", "1"]:
+        total = q.order_by(None).count()
+    items = q.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return Page(items[:per_page], page, per_page, total, len(items) > per_page)
+
+
+def has_cursors():
+    return any(request.args.get(name) for name in CURSORS)
+
+
+def keyset_cursors(cursor_type=uuid.UUID):
+    """
+    :return: the cursors of the request, by name
+    """
+    cursors = {}
+    for name in CURSORS:
+        value = request.args.get(name)
+        if value:
+            try:
+                cursors[name] = cursor_type(value)
+            except ValueError:
+                abort(400)
+    return cursors
+
+
+def keyset_paginate(q, column, count, cursor_type=uuid.UUID):
+    """
+    Keyset pagination on column, which must be unique and sortable like the items ids (flake_id)
+    :return: the items, newest first
+    """
+    cursors = keyset_cursors(cursor_type)
+
+    if "max_id" in cursors:
+        q = q.filter(column < cursors["max_id"])
+    if "since_id" in cursors:
+        q = q.filter(column > cursors["since_id"])
+    if "min_id" in cursors:
+        q = q.filter(column > cursors["min_id"])
+        return q.order_by(column.asc()).limit(count).all()[::-1]
+    return q.order_by(column.desc()).limit(count).all()
+
+
+def keyset_paginate_by(q, columns, count, key_of, cursor_type=uuid.UUID):
+    """
+    Keyset pagination on a sort key other than the cursors, like (creation_date, id) for items with ids cursors.
+    The columns, together, must be unique. key_of(cursor) returns the values of the columns for a cursor,
+    None if unknown.
+    :return: the items, newest first
+    """
+    keys = {}
+    for name, cursor in keyset_cursors(cursor_type).items():
+        keys[name] = key_of(cursor)
+        if keys[name] is None:
+            abort(400)
+
+    sort_key = tuple_(*columns)
+    if "max_id" in keys:
+        q = q.filter(sort_key < tuple_(*keys["max_id"]))
+    if "since_id" in keys:
+        q = q.filter(sort_key > tuple_(*keys["since_id"]))
+    if "min_id" in keys:
+        q = q.filter(sort_key > tuple_(*keys["min_id"]))
+        return q.order_by(*[column.asc() for column in columns]).limit(count).all()[::-1]
+    return q.order_by(*[column.desc() for column in columns]).limit(count).all()
+
+
+def link_header(first_cursor, last_cursor):
+    """
+    Link header with the next (older) and prev (newer) pages of the current request
+    """
+    args = {k: v for k, v in request.args.items() if k not in CURSORS}
+    args.update(request.view_args or {})
+    next_url = url_for(request.endpoint, max_id=last_cursor, _external=True, **args)
+    prev_url = url_for(request.endpoint, min_id=first_cursor, _external=True, **args)
+    return f'<{next_url}>; rel="next", <{prev_url}>; rel="prev"'
+
+
+def keyset_response(items, json_items, cursor_of):
+    """
+    jsonify json_items with the Link header built from the cursors of the first and last items
+    """
+    resp = jsonify(json_items)
+    if items:
+        resp.headers["Link"] = link_header(cursor_of(items[0]), cursor_of(items[-1]))
+    return resp
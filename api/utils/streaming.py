@@ -0,0 +1,92 @@
+# Events of the streaming API, published over Redis pub/sub by the web and the workers
+# and relayed to the clients by the asyncio streaming server, see streaming.py
+# Streams are "public", "public:local" and "user:<user id>" (home timeline and processing events).
+# Publishing is a no-op if STREAMING_REDIS_URL is not set, and never fails the caller.
+import redis
+from flask import current_app, json
+
+from datas_helpers import to_json_tracks
+from models import HomeTimeline
+
+CHANNEL_PREFIX = "reel2bits:streaming:"
+
+_redis_client = None
+
+
+def _redis():
+    global _redis_client
+    url = current_app.config["STREAMING_REDIS_URL"]
+    if not url:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis_client
+
+
+def channel(stream):
+    return f"{CHANNEL_PREFIX}{stream}"
+
+
+def message(event, payload):
+    """
+    Serialize an event with the app JSON encoder, like the API responses (dates, UUIDs)
+    """
+    return json.dumps({"event": event, "payload": payload})
+
+
+def publish(streams, event, payload):
+    """
+    Publish an event to streams
+    :param streams: a list of streams names
+    :param event: the SSE event name, "update" or "processing"
+    :param payload: an object serializable by the app JSON encoder
+    """
+    client = _redis()
+    if not client or not streams:
+        return
+    try:
+        data = message(event, payload)
+    except (TypeError, ValueError) as e:
+        current_app.logger.error(f"streaming: cannot serialize {event}: {e}")
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for stream in streams:
+            pipe.publish(channel(stream), data)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        current_app.logger.warning(f"streaming: cannot publish {event}: {e}")
+
+
+def publish_processing(sound, stage, status):
+    """
+    Processing event to the track owner
+    :param stage: "metadatas", "transcode" or "workflow"
+    :param status: "started", "done" or "error"
+    """
+    if not sound.user.local:
+        return
+    payload = {
+        "id": str(sound.flake_id),
+        "stage": stage,
+        "status": status,
+        "transcode_state": sound.transcode_state,
+    }
+    publish([f"user:{sound.user_id}"], "processing", payload)
+
+
+def publish_new_track(sound):
+    """
+    A processed track is inserted in the public timelines if public, and in the home timelines having it
+    """
+    if not _redis() or sound.private or sound.transcode_state != sound.TRANSCODE_DONE:
+        return
+
+    homes = HomeTimeline.query.with_entities(HomeTimeline.user_id).filter(HomeTimeline.sound_id == sound.id)
+    streams = [f"user:{user_id}" for user_id, in homes]
+    if sound.activity and sound.activity.is_public:
+        streams.append("public")
+        if sound.activity.local:
+            streams.append("public:local")
+
+    publish(streams, "update", to_json_tracks([sound])[0])
@@ -0,0 +1,64 @@
+# Resumable uploads of tracks, following the tus protocol (https://tus.io/protocols/resumable-upload.html):
+# core protocol with the creation and termination extensions, see controllers/api/tracks.py
+# The bytes are appended to the file as they arrive and hashed on the way, for the blobs store.
+import base64
+import hashlib
+import threading
+
+from cachetools import LRUCache
+from werkzeug.datastructures import MultiDict
+
+TUS_VERSION = "1.0.0"
+CHUNK_SIZE = 65536
+
+# Extensions of the files transcoded to MP3 when processed
+TRANSCODED_EXTENSIONS = ("flac", "ogg", "oga", "wav")
+
+# SHA-256 of the uploads being received in this process, by upload id, with their offset
+# if the next bytes arrive in another process, it hashes again what was already received
+_hashers = LRUCache(maxsize=256)
+_hashers_lock = threading.Lock()
+
+
+def parse_metadata(header):
+    """
+    Upload-Metadata header: comma separated pairs of a key and its value in base64
+    :return: a MultiDict usable as form data
+    """
+    metadata = MultiDict()
+    for pair in header.split(","):
+        key, _, value = pair.strip().partition(" ")
+        if key:
+            metadata[key] = base64.b64decode(value).decode("utf-8") if value else ""
+    return metadata
+
+
+def resume_hasher(upload_id, path, offset):
+    """
+    :return: a SHA-256 of the offset bytes already received, to be updated with the next ones
+    """
+    with _hashers_lock:
+        cached = _hashers.pop(upload_id, None)
+    if cached and cached[0] == offset:
+        return cached[1]
+
+    hasher = hashlib.sha256()
+    remaining = offset
+    with open(path, "rb") as f:
+        while remaining:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher
+
+
+def keep_hasher(upload_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, hasher)
+
+
+def forget_hasher(upload_id):
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
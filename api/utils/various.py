@@ -1,16 +1,17 @@
 import datetime
 import hashlib
-import os
-import subprocess
 from os.path import splitext
 import random
 import string
 import json
+import base64
+import math
 
+import numpy
 from flask import current_app
 from flask_security import current_user
 
-from models import db, Role, Logging, UserLogging
+from models import db, Role, Logging, UserLogging, SoundWaveform
 
 
 class InvalidUsage(Exception):
@@ -91,171 +92,142 @@ def duration_human(seconds):
 
 # Pixels per seconds, the higher, the more points in the waveform
 # the more the waveform is "big in size"
+# this is the full resolution level, smaller ones are served from the SoundWaveform pyramid
 def determine_pps(duration):
-    # duration is less than 1 sec
-    if duration < 1:
-        pps = int(duration * 1000 * 4)
-    # duration is less than 30sec
-    elif 1 < duration <= 60 / 2:
-        pps = 1000
-    # duration is more than 30sec but less than 2min
-    elif 60 / 2 < duration <= 2 * 60:
-        pps = 20
-    # duration is more than 2min but less than 30min
-    elif 2 * 60 < duration <= 30 * 60:
-        pps = 10
-    # everything else
-    else:
-        pps = 1
+    max_points = int(current_app.config["WAVEFORM_MAX_POINTS"])
+    pps = math.ceil(max_points / duration) if duration > 0 else 1
     print(f"duration: {duration}, pps: {pps}")
     # just in case, cap the PPS to a max of 9999
-    return pps if pps < 10000 else 9999
-
-
-def generate_audio_dat_file(filename, duration):
-    binary = current_app.config["AUDIOWAVEFORM_BIN"]
-    if not os.path.exists(binary) or not os.path.exists(filename):
-        add_log("AUDIOWAVEFORM", "ERROR", "Filename {0} or binary {1} invalid".format(filename, binary))
-        return None
+    return min(max(pps, 1), 9999)
 
-    fname, _ = splitext(filename)
 
-    audio_dat = "{0}.dat".format(fname)
+# Peaks are stored as signed 8 bits integers, normalized so that the highest peak is at full scale
+WAVEFORM_PEAKS_SCALE = 127
 
-    # pixels-per-second is needed here or it will be ignored in the json waveform generation
-    pps = determine_pps(duration)
-    cmd = [binary, "-i", filename, "-o", audio_dat, "--pixels-per-second", str(pps), "-b", "8"]
 
-    try:
-        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if not process:
-            add_log("AUDIOWAVEFORM_DAT", "ERROR", "Subprocess returned None")
-            return None
-    except subprocess.CalledProcessError as e:
-        add_log("AUDIOWAVEFORM_DAT", "ERROR", "Process error: {0}".format(e))
-        return None
+def waveform_peaks(data):
+    """
+    Normalize min/max pairs to compact int8 peaks.
+    :return: the peaks as bytes, one byte per value
+    """
+    values = numpy.asarray(data, dtype=numpy.float64)
+    max_val = numpy.abs(values).max() if values.size else 0
+    if not max_val:
+        return bytes(values.size)
+    return numpy.round(values * (WAVEFORM_PEAKS_SCALE / max_val)).astype(numpy.int8).tobytes()
 
-    print("- Command ran with: {0}".format(process.args))
 
-    if process.stderr.startswith(b"Can't generate"):
-        add_log("AUDIOWAVEFORM_DAT", "ERROR", "Process error: {0}".format(process.stderr))
-        return None
+def waveform_minmax(samples, samples_per_peak):
+    """
+    Vectorized min/max pairs of PCM samples, one pair every samples_per_peak samples,
+    the last pair covers the remaining samples.
+    :return: an array of the interleaved min and max
+    """
+    samples = numpy.asarray(samples)
+    full = len(samples) // samples_per_peak * samples_per_peak
+    buckets = samples[:full].reshape(-1, samples_per_peak)
+    mins, maxs = buckets.min(axis=1), buckets.max(axis=1)
+    if full < len(samples):
+        rest = samples[full:]
+        mins = numpy.append(mins, rest.min())
+        maxs = numpy.append(maxs, rest.max())
+    pairs = numpy.empty(len(mins) * 2, dtype=samples.dtype)
+    pairs[0::2] = mins
+    pairs[1::2] = maxs
+    return pairs
+
+
+class WaveformAccumulator(object):
+    """
+    Min/max pairs of a mono 16 bits little-endian PCM stream, fed by chunks of any size.
+    """
 
-    return audio_dat
+    def __init__(self, samples_per_peak):
+        self.samples_per_peak = samples_per_peak
+        self.samples = 0
+        self._pairs = []
+        self._buffer = bytearray()
+
+    def _consume(self, end):
+        samples = numpy.frombuffer(bytes(self._buffer[:end]), dtype="<i2")
+        del self._buffer[:end]
+        self._pairs.append(waveform_minmax(samples, self.samples_per_peak))
+        self.samples += len(samples)
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        bucket_size = self.samples_per_peak * 2
+        end = len(self._buffer) // bucket_size * bucket_size
+        if end:
+            self._consume(end)
+
+    def peaks(self):
+        """
+        :return: the int8 peaks, see waveform_peaks()
+        """
+        # the last incomplete bucket, without a dangling odd byte
+        end = len(self._buffer) // 2 * 2
+        if end:
+            self._consume(end)
+        return waveform_peaks(numpy.concatenate(self._pairs) if self._pairs else [])
+
+
+def waveform_downsample(peaks):
+    """
+    Halve the number of min/max pairs of int8 peaks, merging two pairs into one, vectorized.
+    """
+    pairs = numpy.frombuffer(peaks, dtype="i1").reshape(-1, 2)
+    if len(pairs) % 2:
+        # the last pair is merged with itself
+        pairs = numpy.concatenate([pairs, pairs[-1:]])
+    merged = pairs.reshape(-1, 2, 2)
+    half = numpy.empty((len(merged), 2), dtype="i1")
+    half[:, 0] = merged[:, :, 0].min(axis=1)
+    half[:, 1] = merged[:, :, 1].max(axis=1)
+    return half.tobytes()
+
+
+def waveform_pyramid(peaks, overview_points):
+    """
+    Build the levels of the peaks pyramid, from the overview (at most overview_points pairs)
+    to the full resolution peaks.
+    :return: a list of peaks bytes, index is the level
+    """
+    levels = [peaks]
+    while len(levels[0]) // 2 > overview_points:
+        levels.insert(0, waveform_downsample(levels[0]))
+    return levels
 
 
-def get_waveform(filename, duration):
-    binary = current_app.config["AUDIOWAVEFORM_BIN"]
-    if not os.path.exists(binary) or not os.path.exists(filename):
-        add_log("AUDIOWAVEFORM", "ERROR", "Filename {0} or binary {1} invalid".format(filename, binary))
-        return None
+def save_waveform_levels(sound_id, peaks):
+    """
+    Replace the SoundWaveform levels of the track by the pyramid of peaks, doesn't commit.
+    """
+    SoundWaveform.query.filter(SoundWaveform.sound_id == sound_id).delete()
+    if not peaks:
+        return
+    for level, level_peaks in enumerate(waveform_pyramid(peaks, int(current_app.config["WAVEFORM_OVERVIEW_POINTS"]))):
+        etag = hashlib.sha256(level_peaks).hexdigest()
+        db.session.add(SoundWaveform(sound_id=sound_id, level=level, peaks=level_peaks, etag=etag))
 
-    fname, _ = splitext(filename)
 
-    tmpjson = "{0}.json".format(fname)
+def waveform_from_json(waveform_json):
+    """
+    Convert a legacy JSON waveform (normalized floats) to compact int8 peaks.
+    """
+    return waveform_peaks(json.loads(waveform_json)["data"])
 
-    # pixels-persecond is same value as in generate_audio_dat_file
-    pps = determine_pps(duration)
-    cmd = [binary, "-i", filename, "--pixels-per-second", str(pps), "-b", "8", "-o", tmpjson]
 
+def waveform_to_json(peaks, level=0):
     """
-    Failed: Can't generate "xxx" from "xxx"
-    OK:
-    Input file: piano2.wav
-    Frames: 302712
-    Sample rate: 48000 Hz
-    Channels: 2
-    Format: 0x10002
-    Sections: 1
-    Seekable: yes
-    Generating waveform data...
-    Samples per pixel: 4800
-    Input channels: 2
-    Done: 100%
-    Read 302712 frames
-    Generated 64 points
-    Writing output file: some-file.json
+    Compact encoding of the peaks for the API, base64 of the int8 values.
     """
-
-    try:
-        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if not process:
-            add_log("AUDIOWAVEFORM", "ERROR", "Subprocess returned None")
-            return None
-    except subprocess.CalledProcessError as e:
-        add_log("AUDIOWAVEFORM", "ERROR", "Process error: {0}".format(e))
-        return None
-
-    print("- Command ran with: {0}".format(process.args))
-
-    if process.stderr.startswith(b"Can't generate"):
-        add_log("AUDIOWAVEFORM", "ERROR", "Process error: {0}".format(process.stderr))
-        return None
-
-    with open(tmpjson, "r") as f:
-        waveform_json = f.readlines()
-
-    os.unlink(tmpjson)
-
-    if isinstance(waveform_json, list):
-        waveform_json = waveform_json[0].rstrip()
-
-    waveform_json = json.loads(waveform_json)
-
-    # normalize the peak datas
-    data = waveform_json["data"]
-    # number of decimals to use when rounding the peak value
-    digits = 2
-    max_val = float(max(data))
-    new_data = []
-    for x in data:
-        new_data.append(round(x / max_val, digits))
-    waveform_json["data"] = new_data
-
-    return json.dumps(waveform_json)
-
-
-def create_png_waveform(fn_audio, fn_png):
-    binary = current_app.config["AUDIOWAVEFORM_BIN"]
-    if not os.path.exists(binary) or not os.path.exists(fn_audio):
-        add_log("AUDIOWAVEFORM_PNG", "ERROR", "Filename {0} or binary {1} invalid".format(fn_audio, binary))
-        return None
-
-    fname, _ = splitext(fn_png)
-
-    pngwf = "{0}.png".format(fname)
-
-    cmd = [
-        binary,
-        "-i",
-        fn_audio,
-        "--width",
-        "384",
-        "--height",
-        "64",
-        "--no-axis-labels",
-        "--background-color",
-        "FFFFFF00",
-        "-o",
-        pngwf,
-    ]
-
-    try:
-        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if not process:
-            add_log("AUDIOWAVEFORM_PNG", "ERROR", "Subprocess returned None")
-            return None
-    except subprocess.CalledProcessError as e:
-        add_log("AUDIOWAVEFORM_PNG", "ERROR", "Process error: {0}".format(e))
-        return None
-
-    print("- Command ran with: {0}".format(process.args))
-
-    if process.stderr.startswith(b"Can't generate"):
-        add_log("AUDIOWAVEFORM_PNG", "ERROR", "Process error: {0}".format(process.stderr))
-        return None
-
-    return True
+    return {
+        "level": level,
+        "bits": 8,
+        "scale": WAVEFORM_PEAKS_SCALE,
+        "data": base64.b64encode(peaks).decode("ascii"),
+    }
 
 
 def get_hashed_filename(filename):
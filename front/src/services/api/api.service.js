@@ -1,4 +1,4 @@
-import { parseUser, parseStatus } from '../entity_normalizer/entity_normalizer.service.js'
+import { parseUser, parseStatus, parseWaveform } from '../entity_normalizer/entity_normalizer.service.js'
 import { RegistrationError, StatusCodeError } from '../errors/errors'
 import { map, reduce } from 'lodash'
 
@@ -243,6 +243,18 @@ const fetchTrackLogs = ({ userId, trackId, credentials }) => {
     .then((data) => data.json())
 }
 
+const fetchTrackWaveform = ({ url, level, credentials }) => {
+  return fetch(`${url}?level=${level}`, { headers: authHeaders(credentials) })
+    .then((data) => {
+      if (data.ok) {
+        return data
+      }
+      throw new Error('Error fetching track waveform', data)
+    })
+    .then((data) => data.json())
+    .then((data) => parseWaveform(data))
+}
+
 const trackRetryProcessing = ({ userId, trackId, credentials }) => {
   return promisedRequest({
     url: TRACKS_RETRY_PROCESSING_URL(userId, trackId),
@@ -721,6 +733,7 @@ const apiService = {
   trackEdit,
   trackFetch,
   fetchTrackLogs,
+  fetchTrackWaveform,
   trackRetryProcessing,
   albumNew,
   albumDelete,
@@ -32,6 +32,10 @@ const backendInteractorService = credentials => {
     return apiService.fetchTrackLogs({ userId, trackId, credentials })
   }
 
+  const fetchTrackWaveform = ({ url, level = 0 }) => {
+    return apiService.fetchTrackWaveform({ url, level, credentials })
+  }
+
   const trackRetryProcessing = ({ userId, trackId }) => {
     return apiService.trackRetryProcessing({ userId, trackId, credentials })
   }
@@ -217,6 +221,7 @@ const backendInteractorService = credentials => {
     trackDelete,
     trackEdit,
     fetchTrackLogs,
+    fetchTrackWaveform,
     trackRetryProcessing,
     albumFetch,
     albumDelete,
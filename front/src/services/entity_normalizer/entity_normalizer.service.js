@@ -135,6 +135,19 @@ export const parseUser = (data) => {
   return output
 }
 
+// Waveform peaks are served as base64 of signed 8 bits integers, decode them to floats for wavesurfer
+export const parseWaveform = (waveform) => {
+  if (!waveform) {
+    return waveform
+  }
+  const bytes = atob(waveform.data)
+  const data = new Array(bytes.length)
+  for (let i = 0; i < bytes.length; i++) {
+    data[i] = ((bytes.charCodeAt(i) << 24) >> 24) / waveform.scale
+  }
+  return { level: waveform.level, bits: waveform.bits, data }
+}
+
 export const parseStatus = (data) => {
   const output = {}
 
@@ -146,8 +159,9 @@ export const parseStatus = (data) => {
   output.picture_url = (data.reel2bits.picture_url || '/static/artwork_placeholder.svg')
   output.media_orig = data.reel2bits.media_orig
   output.media_transcoded = data.reel2bits.media_transcoded
+  output.renditions = data.reel2bits.renditions || [] // lowest bitrate first
   output.url_feed = data.reel2bits.url_feed
-  output.waveform = data.reel2bits.waveform
+  output.waveform = data.reel2bits.waveform // url of the waveform levels
   output.private = data.reel2bits.private
   output.uploaded_on = data.created_at
   output.uploaded_elapsed = data.uploaded_elapsed